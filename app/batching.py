@@ -0,0 +1,278 @@
+"""
+Chunked, rate-limit-aware embedding requests
+
+Long transcripts exceed the embedding API's per-request input count and token
+limits. The batcher splits inputs by item count and estimated tokens, sends the
+chunks concurrently (bounded by a semaphore and a tokens-per-minute budget) and
+writes each chunk's vectors straight into one preallocated result matrix.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.context import RequestContext, get_context, request_context
+from app.utils import calculate_token_estimate
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRateLimiter:
+    """Sliding one-minute window token budget"""
+
+    def __init__(self, tokens_per_minute: int, window_seconds: float = 60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._used = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now: float):
+        while self._events and now - self._events[0][0] >= self.window_seconds:
+            _, tokens = self._events.popleft()
+            self._used -= tokens
+
+    async def acquire(self, tokens: int):
+        """Wait until `tokens` fit in the current window, then reserve them"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                # A single request larger than the whole budget goes alone
+                if not self._events or self._used + tokens <= self.tokens_per_minute:
+                    self._events.append((now, tokens))
+                    self._used += tokens
+                    return
+                wait = self.window_seconds - (now - self._events[0][0])
+                logger.info(f"Embedding TPM budget exhausted, waiting {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+
+class EmbeddingBatcher:
+    """Split embedding inputs into API-sized chunks and run them concurrently"""
+
+    def __init__(
+        self,
+        max_items: int = 2048,
+        max_tokens: int = 100000,
+        max_input_tokens: int = 8191,
+        concurrency: int = 4,
+        tokens_per_minute: Optional[int] = None,
+        upstream=None
+    ):
+        """
+        Args:
+            max_items: Maximum inputs per embeddings request
+            max_tokens: Maximum estimated tokens per embeddings request
+            max_input_tokens: Maximum estimated tokens for a single input (longer inputs are truncated)
+            concurrency: Maximum requests in flight at once
+            tokens_per_minute: Optional token budget shared by all requests (None = unlimited)
+            upstream: Optional UpstreamCaller adding retries and circuit breaking to each request
+        """
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_input_tokens = max_input_tokens
+        self.concurrency = concurrency
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        self.upstream = upstream
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def from_env(cls, upstream=None) -> "EmbeddingBatcher":
+        """Create a batcher configured from environment variables"""
+        tpm = int(os.getenv("EMBEDDING_TPM", "0"))
+        return cls(
+            max_items=int(os.getenv("EMBEDDING_BATCH_SIZE", "2048")),
+            max_tokens=int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000")),
+            concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+            tokens_per_minute=tpm or None,
+            upstream=upstream
+        )
+
+    def plan(self, texts: List[str]) -> List[Tuple[int, int, int]]:
+        """
+        Split texts into contiguous chunks within the item and token limits
+
+        Returns:
+            List of (start, end, estimated_tokens) ranges over texts
+        """
+        chunks = []
+        start = 0
+        chunk_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = min(max(calculate_token_estimate(text), 1), self.max_input_tokens)
+            if i > start and (i - start >= self.max_items or chunk_tokens + tokens > self.max_tokens):
+                chunks.append((start, i, chunk_tokens))
+                start = i
+                chunk_tokens = 0
+            chunk_tokens += tokens
+        if start < len(texts):
+            chunks.append((start, len(texts), chunk_tokens))
+        return chunks
+
+    def _truncate(self, text: str) -> str:
+        """Cut inputs that would exceed the per-input token limit"""
+        max_chars = self.max_input_tokens * 4
+        if len(text) > max_chars:
+            logger.warning(f"Truncating embedding input from {len(text)} to {max_chars} characters")
+            return text[:max_chars]
+        return text
+
+    async def embed(self, client, model: str, texts: List[str]) -> Tuple[np.ndarray, int]:
+        """
+        Embed texts in as many requests as the limits require
+
+        Args:
+            client: AsyncOpenAI client
+            model: Embedding model name
+            texts: Inputs to embed
+
+        Returns:
+            Tuple of (float32 array of shape (len(texts), dim) in input order, total tokens used)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        chunks = self.plan(texts)
+        if len(chunks) > 1:
+            logger.info(f"Embedding {len(texts)} inputs in {len(chunks)} chunks")
+
+        result: Optional[np.ndarray] = None
+        total_tokens = 0
+
+        async def run_chunk(start: int, end: int, estimate: int):
+            nonlocal result, total_tokens
+            async with self._semaphore:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(estimate)
+                inputs = [self._truncate(t) for t in texts[start:end]]
+                if self.upstream is not None:
+                    response = await self.upstream.call(
+                        "embeddings",
+                        model,
+                        lambda timeout: client.embeddings.create(model=model, input=inputs, timeout=timeout)
+                    )
+                else:
+                    call_start = time.perf_counter()
+                    try:
+                        response = await client.embeddings.create(model=model, input=inputs)
+                    except Exception:
+                        metrics.observe_upstream_call(model, "embeddings", time.perf_counter() - call_start, error=True)
+                        raise
+                    metrics.observe_upstream_call(model, "embeddings", time.perf_counter() - call_start)
+
+            # Copy straight into the shared output so each response can be freed
+            vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[start:end] = vectors
+            if hasattr(response, 'usage') and response.usage:
+                total_tokens += response.usage.total_tokens
+
+        await asyncio.gather(*(run_chunk(*chunk) for chunk in chunks))
+
+        if result is None:
+            result = np.zeros((0, 0), dtype=np.float32)
+        return result, total_tokens
+
+
+class EmbeddingCoalescer:
+    """
+    Merge embedding calls from concurrent requests into shared API batches
+
+    Calls arriving within `window_ms` of the first pending call are combined,
+    deduplicated and sent through the batcher together. Each caller gets back
+    its own rows plus its share of the token usage (by estimated tokens).
+
+    The merged call runs in its own batch RequestContext rather than the context
+    of whichever request opened the window: its deadline is the latest of the
+    waiters' deadlines, and retries it makes are attributed to every waiter.
+    """
+
+    def __init__(self, batcher: EmbeddingBatcher, window_ms: float = 5.0):
+        self.batcher = batcher
+        self.window_ms = window_ms
+        self._pending: Dict[str, List[Tuple[List[str], asyncio.Future, RequestContext]]] = {}
+        self._clients: Dict[str, object] = {}
+        self._flushes: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls, batcher: EmbeddingBatcher) -> "EmbeddingCoalescer":
+        """Create a coalescer configured from environment variables"""
+        return cls(batcher, window_ms=float(os.getenv("EMBEDDING_COALESCE_MS", "5")))
+
+    async def embed(self, client, model: str, texts: List[str]) -> Tuple[np.ndarray, int]:
+        """
+        Embed texts, possibly as part of a larger shared request
+
+        Returns:
+            Tuple of (float32 array of shape (len(texts), dim), attributed tokens)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if model not in self._pending:
+            self._pending[model] = []
+            self._clients[model] = client
+            # Neutral context: the flush must not inherit the opening request's contextvars
+            loop.call_later(self.window_ms / 1000, self._schedule_flush, model, context=contextvars.Context())
+        self._pending[model].append((texts, future, get_context()))
+
+        return await future
+
+    def _schedule_flush(self, model: str):
+        """Start a flush task (and keep a reference until it finishes)"""
+        task = asyncio.ensure_future(self._flush(model))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, model: str):
+        """Send all pending calls for a model as one batched embedding run"""
+        waiters = self._pending.pop(model, [])
+        client = self._clients.pop(model, None)
+        waiters = [(texts, future, ctx) for texts, future, ctx in waiters if not future.cancelled()]
+        if not waiters:
+            return
+
+        # Deduplicate across callers
+        positions: Dict[str, int] = {}
+        for texts, _, _ in waiters:
+            for text in texts:
+                positions.setdefault(text, len(positions))
+        unique_texts = list(positions)
+
+        if len(waiters) > 1:
+            logger.debug(f"Coalesced {len(waiters)} embedding calls into {len(unique_texts)} inputs")
+
+        # The batch may run until the last waiter gives up (no deadline if any waiter has none)
+        deadlines = [ctx.deadline for _, _, ctx in waiters]
+        with request_context() as batch_ctx:
+            batch_ctx.deadline = None if None in deadlines else max(deadlines)
+            try:
+                vectors, tokens = await self.batcher.embed(client, model, unique_texts)
+            except Exception as e:
+                error = e
+            else:
+                error = None
+        for _, _, ctx in waiters:
+            ctx.add_retries(batch_ctx.retries)
+
+        if error is not None:
+            for _, future, _ in waiters:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        estimates = [sum(calculate_token_estimate(t) for t in texts) for texts, _, _ in waiters]
+        total_estimate = sum(estimates) or 1
+        for (texts, future, _), estimate in zip(waiters, estimates):
+            if not future.done():
+                rows = vectors[[positions[t] for t in texts]]
+                future.set_result((rows, round(tokens * estimate / total_estimate)))
@@ -0,0 +1,479 @@
+"""
+Content-addressed embedding and result caches
+
+Embeddings are keyed by (embedding model, hash of normalized text), so the same
+text is only ever sent to the embedding API once per model. Two tiers:
+- an in-process LRU (fast, bounded by item count)
+- an optional on-disk SQLite store (persistent across restarts, bounded by item count)
+
+Pre-forked workers (app/serve.py) additionally share a read-only snapshot of
+the disk tier (EmbeddingSnapshot): memory-mapped files the OS page cache holds
+once for all workers, consulted after the in-process LRU.
+
+Finished notes are cached the same way (ResultCache), keyed by the normalized
+transcript segments plus everything that changes the output (models, threshold,
+prompt version), with a TTL on top of the size bound.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQLITE_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text before hashing (unicode form + collapsed whitespace)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """Build the cache key for a text embedded with a given model"""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingSnapshot:
+    """
+    Read-only, memory-mapped embedding table shared by worker processes
+
+    Stored as three .npy files in one directory: sorted keys (fixed-width
+    bytes), row offsets and one flat float32 vector buffer. Opening maps them
+    with mmap_mode="r", so every process reading the same snapshot shares the
+    pages instead of holding its own copy; lookups are binary searches.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Snapshot directory written by `EmbeddingSnapshot.write`
+        """
+        self.path = path
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+    @staticmethod
+    def write(path: str, items: List[Tuple[str, np.ndarray]]):
+        """
+        Write a snapshot of (key, vector) pairs to a new directory
+
+        The files are written to a temporary directory that is renamed into
+        place, so readers never see a partial snapshot.
+        """
+        items = sorted(items, key=lambda item: item[0])
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        keys = np.array([key.encode("utf-8") for key, _ in items], dtype=bytes)
+        lengths = np.array([len(vector) for _, vector in items], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        vectors = (np.concatenate([np.asarray(v, dtype=np.float32) for _, v in items])
+                   if items else np.zeros(0, dtype=np.float32))
+        np.save(os.path.join(tmp_path, "keys.npy"), keys)
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Vectors for cache keys (read-only views; None where absent)"""
+        if len(self.keys) == 0 or not keys:
+            return [None] * len(keys)
+        wanted = np.array([key.encode("utf-8") for key in keys], dtype=self.keys.dtype)
+        positions = np.searchsorted(self.keys, wanted)
+        positions[positions == len(self.keys)] = 0
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        for i in np.flatnonzero(self.keys[positions] == wanted):
+            row = positions[i]
+            results[i] = self.vectors[self.offsets[row]:self.offsets[row + 1]]
+        return results
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + SQLite) embedding cache"""
+
+    def __init__(
+        self,
+        max_memory_items: int = 50000,
+        disk_path: Optional[str] = None,
+        max_disk_items: int = 500000,
+        snapshot_path: Optional[str] = None
+    ):
+        """
+        Args:
+            max_memory_items: Maximum embeddings kept in the in-process LRU
+            disk_path: SQLite file for the persistent tier (None disables it)
+            max_disk_items: Maximum embeddings kept on disk before evicting least recently used
+            snapshot_path: Shared read-only EmbeddingSnapshot directory (None disables it)
+        """
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.disk_path = disk_path
+        self.snapshot: Optional[EmbeddingSnapshot] = None
+        if snapshot_path:
+            try:
+                self.snapshot = EmbeddingSnapshot(snapshot_path)
+                logger.info(f"Embedding cache snapshot: {snapshot_path} ({len(self.snapshot)} entries)")
+            except OSError as e:
+                logger.warning(f"Embedding cache snapshot unavailable ({snapshot_path}): {e}")
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Rows last counted in the disk tier (other workers may share the file)
+        self._disk_count = 0
+
+        # Lifetime counters (per-request counters live on the caller)
+        self.hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @classmethod
+    def from_env(cls) -> "EmbeddingCache":
+        """Create a cache configured from environment variables"""
+        disk_path = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+        return cls(
+            max_memory_items=int(os.getenv("EMBEDDING_CACHE_SIZE", "50000")),
+            disk_path=disk_path or None,
+            max_disk_items=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "500000")),
+            # Set by app/serve.py for its workers
+            snapshot_path=os.getenv("EMBEDDING_SNAPSHOT_PATH") or None
+        )
+
+    def _open_disk(self, path: str):
+        """Open (and create if needed) the SQLite tier"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._db.commit()
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache disk tier: {path} ({self._disk_count} entries)")
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings for texts
+
+        Returns:
+            List aligned with texts; None for cache misses
+        """
+        keys = [embedding_cache_key(model, t) for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        disk_lookup: Dict[str, List[int]] = {}
+
+        with self._lock:
+            snapshot_lookup: List[int] = []
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                elif self.snapshot is not None:
+                    snapshot_lookup.append(i)
+                elif self._db is not None:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if snapshot_lookup:
+                # Shared pages: not copied into this process's LRU
+                found = self.snapshot.get_many([keys[i] for i in snapshot_lookup])
+                for i, vector in zip(snapshot_lookup, found):
+                    if vector is not None:
+                        results[i] = vector
+                    elif self._db is not None:
+                        disk_lookup.setdefault(keys[i], []).append(i)
+
+            if disk_lookup:
+                found = self._read_disk(list(disk_lookup))
+                for key, vector in found.items():
+                    for i in disk_lookup[key]:
+                        results[i] = vector
+                    self._remember(key, vector)
+
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(texts) - hits
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        """Store embeddings for texts in both tiers"""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = embedding_cache_key(model, text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, int(vector.shape[0]), vector.tobytes(), now))
+
+            if self._db is not None and rows:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._evict_disk()
+                self._db.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert into the memory LRU, evicting the least recently used entries"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Read embeddings from SQLite and refresh their last-used time"""
+        found: Dict[str, np.ndarray] = {}
+        for start in range(0, len(keys), _SQLITE_CHUNK):
+            chunk = keys[start:start + _SQLITE_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._db.commit()
+        return found
+
+    def _evict_disk(self):
+        """
+        Drop least recently used rows when the disk tier is over capacity
+
+        Runs inside the insert's write transaction and counts the table itself,
+        so workers sharing the file (app/serve.py) bound its total size.
+        """
+        count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_disk_items
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+        self._disk_count = min(count, self.max_disk_items)
+
+    def stats(self) -> dict:
+        """Lifetime cache statistics"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_items": self._disk_count if self._db is not None else None,
+            "snapshot_items": len(self.snapshot) if self.snapshot is not None else None
+        }
+
+    def export_snapshot(self, path: str, max_items: int) -> int:
+        """
+        Write the most recently used disk-tier entries as an EmbeddingSnapshot
+
+        Returns:
+            Number of entries written (0 without a disk tier)
+        """
+        items: List[Tuple[str, np.ndarray]] = []
+        if self._db is not None:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT key, vector FROM embeddings ORDER BY last_used DESC LIMIT ?", (max_items,)
+                ).fetchall()
+            items = [(key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows]
+        EmbeddingSnapshot.write(path, items)
+        return len(items)
+
+    def close(self):
+        """Close the disk tier"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def result_cache_key(segments: List, **config) -> str:
+    """
+    Build the result cache key for a transcript and pipeline configuration
+
+    Args:
+        segments: TranscriptSegment objects (ids, speakers, times and normalized text are hashed)
+        **config: Output-relevant settings (models, threshold, prompt version, ...)
+    """
+    payload = {
+        "segments": [
+            [seg.id, seg.speaker, seg.start_ms, seg.end_ms, normalize_text(seg.text)]
+            for seg in segments
+        ],
+        "config": config
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + SQLite) cache of serialized outputs with a TTL"""
+
+    def __init__(self, max_items: int = 1000, ttl_seconds: float = 86400.0, disk_path: Optional[str] = None):
+        """
+        Args:
+            max_items: Maximum entries per tier before evicting least recently used
+            ttl_seconds: Entries older than this are treated as misses and dropped
+            disk_path: SQLite file for the persistent tier (None disables it)
+        """
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+
+        # key -> (stored_at, serialized value)
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Rows last counted in the disk tier (other workers may share the file)
+        self._disk_count = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """Create a cache configured from environment variables"""
+        return cls(
+            max_items=int(os.getenv("RESULT_CACHE_SIZE", "1000")),
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400")),
+            disk_path=os.getenv("RESULT_CACHE_PATH", "") or None
+        )
+
+    def _open_disk(self, path: str):
+        """Open (and create if needed) the SQLite tier"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+        self._db.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+        self._db.commit()
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        logger.info(f"Result cache disk tier: {path} ({self._disk_count} entries)")
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        Look up a cached value
+
+        Returns:
+            Tuple of (serialized value, stored_at timestamp), or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT stored_at, value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[0] <= self.ttl_seconds:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+                    self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1], entry[0]
+
+    def put(self, key: str, value: str):
+        """Store a serialized value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, (now, value))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, stored_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key: str, entry: Tuple[float, str]):
+        """Insert into the memory LRU, evicting the least recently used entries"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        """
+        Drop expired rows, then least recently used rows over capacity
+
+        Counts the table inside the write transaction, like EmbeddingCache,
+        so workers sharing the file bound its total size.
+        """
+        self._db.execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl_seconds,))
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self.max_items
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+        self._disk_count = min(count, self.max_items)
+
+    def stats(self) -> dict:
+        """Lifetime cache statistics"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_items": self._disk_count if self._db is not None else None
+        }
+
+    def close(self):
+        """Close the disk tier"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,206 @@
+"""
+Managed OpenAI client with a persistent, instrumented connection pool
+
+One httpx connection pool per process, shared by every request, with
+configurable keep-alive limits and HTTP/2 when the optional `h2` package is
+installed. Connections are pre-warmed at startup (so the first requests skip
+DNS/TCP/TLS setup) and closed on shutdown. Requests in flight and open/idle
+connections are tracked for /health and /metrics to help tune the limits.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """True if httpx can negotiate HTTP/2 (needs the `h2` package)"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports when it has been fully read or closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._on_close()
+        await self._stream.aclose()
+
+
+class _TrackedTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper counting requests from send until the body is closed"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, owner: "ManagedOpenAIClient"):
+        self._transport = transport
+        self._owner = owner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._owner._request_started()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._owner._request_finished()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, self._owner._request_finished),
+            extensions=response.extensions
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class ManagedOpenAIClient:
+    """AsyncOpenAI client over a shared, tunable and observable connection pool"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 120.0,
+        connect_timeout: float = 10.0,
+        http2: Optional[bool] = None,
+        prewarm_connections: int = 2,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        Args:
+            api_key: OpenAI API key
+            base_url: API base URL (None = OPENAI_BASE_URL or the public API)
+            max_connections: Maximum open connections
+            max_keepalive_connections: Idle connections kept open for reuse
+            keepalive_expiry: Seconds an idle connection is kept
+            timeout: Default read/write/pool timeout (per-request deadlines can be shorter)
+            connect_timeout: Connection setup timeout
+            http2: Use HTTP/2 (None = when `h2` is installed)
+            prewarm_connections: Connections opened by prewarm()
+            transport: Optional transport override (e.g. an in-process mock)
+        """
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.http2 = http2_available() if http2 is None else (http2 and http2_available())
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+        self.prewarm_connections = prewarm_connections
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._transport = transport or httpx.AsyncHTTPTransport(limits=limits, http2=self.http2)
+        self.http_client = httpx.AsyncClient(
+            transport=_TrackedTransport(self._transport, self),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
+        # Retries are handled by UpstreamCaller, not the SDK
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0)
+
+        self.active_requests = 0
+        self.peak_active_requests = 0
+        self.requests_total = 0
+        self.closed = False
+
+    @classmethod
+    def from_env(cls, api_key: str, transport: Optional[httpx.AsyncBaseTransport] = None) -> "ManagedOpenAIClient":
+        """Create a client configured from environment variables"""
+        http2 = os.getenv("OPENAI_HTTP2", "auto").lower()
+        return cls(
+            api_key=api_key,
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")),
+            timeout=float(os.getenv("OPENAI_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10")),
+            http2=None if http2 == "auto" else http2 in ("1", "true", "yes"),
+            prewarm_connections=int(os.getenv("OPENAI_PREWARM_CONNECTIONS", "2")),
+            transport=transport
+        )
+
+    def _request_started(self):
+        self.requests_total += 1
+        self.active_requests += 1
+        self.peak_active_requests = max(self.peak_active_requests, self.active_requests)
+        metrics.UPSTREAM_HTTP_IN_FLIGHT.set(self.active_requests)
+
+    def _request_finished(self):
+        self.active_requests -= 1
+        metrics.UPSTREAM_HTTP_IN_FLIGHT.set(self.active_requests)
+
+    async def prewarm(self):
+        """
+        Open connections ahead of traffic with cheap, token-free requests
+
+        Failures are logged, not raised: the service still starts and
+        connects lazily on the first real request.
+        """
+        if self.prewarm_connections <= 0:
+            return
+        results = await asyncio.gather(
+            *(self.client.models.list() for _ in range(self.prewarm_connections)),
+            return_exceptions=True
+        )
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.warning(f"Connection prewarm failed: {failures[0]}")
+        else:
+            stats = self.stats()
+            logger.info(
+                f"Prewarmed upstream connections ({stats['open_connections']} open, "
+                f"http2={self.http2})"
+            )
+
+    async def aclose(self):
+        """Close all pooled connections (waits for nothing; call after traffic has drained)"""
+        if not self.closed:
+            self.closed = True
+            await self.http_client.aclose()
+            logger.info("Upstream HTTP client closed")
+
+    def stats(self) -> Dict:
+        """Pool configuration and utilization"""
+        open_connections = idle_connections = None
+        # httpcore's pool is private API; report what it exposes, if anything
+        pool = getattr(self._transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            open_connections = len(connections)
+            idle_connections = sum(1 for c in connections if c.is_idle())
+            metrics.UPSTREAM_HTTP_CONNECTIONS.set(open_connections - idle_connections, state="active")
+            metrics.UPSTREAM_HTTP_CONNECTIONS.set(idle_connections, state="idle")
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "open_connections": open_connections,
+            "idle_connections": idle_connections,
+            "active_requests": self.active_requests,
+            "peak_active_requests": self.peak_active_requests,
+            "requests_total": self.requests_total,
+            "utilization": round(self.active_requests / self.max_connections, 3) if self.max_connections else None,
+            "closed": self.closed
+        }
@@ -0,0 +1,215 @@
+"""
+Per-request pipeline context and process-wide usage aggregates
+
+Each `process_transcript` call runs inside its own RequestContext, reachable
+from any stage through a contextvar (asyncio tasks inherit it), so concurrent
+requests never share token counts, timings or retry counts. Every usage record
+is also added to the process-wide UsageAggregator for capacity and billing.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional
+
+from app import metrics
+from app.utils import TokenCounter
+
+# USD per 1M tokens: (input/prompt, output/completion)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int = 0) -> float:
+    """Estimate USD cost of a call (0.0 for models without known pricing)"""
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class UsageAggregator:
+    """
+    Process-wide token and cost counters by model
+
+    Lifetime totals plus per-second buckets over a sliding window for rates.
+    Recording is a dict update under a lock, so it is cheap enough for every call.
+    """
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+        # model -> deque of [second, tokens, cost]
+        self._buckets: Dict[str, Deque[List[float]]] = {}
+        self.requests_total = 0
+
+    def record(self, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, embedding_tokens: int = 0):
+        """Record token usage attributed to one request"""
+        tokens = prompt_tokens + completion_tokens + embedding_tokens
+        cost = estimate_cost(model, prompt_tokens + embedding_tokens, completion_tokens)
+        second = int(time.time())
+
+        with self._lock:
+            totals = self._totals.setdefault(model, {
+                "usage_records": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "embedding_tokens": 0,
+                "cost_usd": 0.0
+            })
+            totals["usage_records"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["embedding_tokens"] += embedding_tokens
+            totals["cost_usd"] += cost
+
+            buckets = self._buckets.setdefault(model, deque())
+            if buckets and buckets[-1][0] == second:
+                buckets[-1][1] += tokens
+                buckets[-1][2] += cost
+            else:
+                buckets.append([second, tokens, cost])
+            self._expire(buckets, second)
+
+    def record_request(self):
+        """Count one processed transcript"""
+        with self._lock:
+            self.requests_total += 1
+
+    def _expire(self, buckets: Deque[List[float]], now_second: int):
+        while buckets and buckets[0][0] <= now_second - self.window_seconds:
+            buckets.popleft()
+
+    def snapshot(self) -> dict:
+        """Current totals and windowed rates (tokens/sec, cost/hour) by model"""
+        now_second = int(time.time())
+        # Use the elapsed time while the window is still filling up
+        window = max(min(self.window_seconds, time.time() - self.started_at), 1.0)
+
+        by_model = {}
+        total_rate = 0.0
+        total_cost_rate = 0.0
+        with self._lock:
+            for model, totals in self._totals.items():
+                buckets = self._buckets[model]
+                self._expire(buckets, now_second)
+                window_tokens = sum(b[1] for b in buckets)
+                window_cost = sum(b[2] for b in buckets)
+                tokens_per_second = window_tokens / window
+                cost_per_hour = window_cost / window * 3600
+                total_rate += tokens_per_second
+                total_cost_rate += cost_per_hour
+                by_model[model] = {
+                    **totals,
+                    "cost_usd": round(totals["cost_usd"], 6),
+                    "tokens_per_second": round(tokens_per_second, 2),
+                    "cost_per_hour_usd": round(cost_per_hour, 6)
+                }
+            requests_total = self.requests_total
+
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "window_seconds": self.window_seconds,
+            "requests_total": requests_total,
+            "tokens_per_second": round(total_rate, 2),
+            "cost_per_hour_usd": round(total_cost_rate, 6),
+            "by_model": by_model
+        }
+
+
+# Process-wide aggregate, shared by all requests
+usage_aggregator = UsageAggregator(window_seconds=int(os.getenv("USAGE_WINDOW_SECONDS", "60")))
+
+
+@dataclass
+class RequestContext:
+    """Usage, timings and retries for a single pipeline run"""
+    session_id: Optional[str] = None
+    usage: TokenCounter = field(default_factory=TokenCounter)
+    timings: Dict[str, float] = field(default_factory=dict)
+    retries: Dict[str, int] = field(default_factory=dict)
+    # Estimated prompt composition of the note request (PromptBuilder.budget)
+    prompt_budget: Dict[str, int] = field(default_factory=dict)
+    # Statements cited via model-named source_ids vs. retrieval, plus rejected ids
+    citation_sources: Dict[str, int] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.perf_counter)
+    deadline: Optional[float] = None    # time.perf_counter() value, None = no deadline
+
+    def add_completion(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Record a chat completion's token usage (cached_tokens: part of prompt_tokens served from cache)"""
+        self.usage.add_completion(prompt_tokens, completion_tokens, cached_tokens)
+        usage_aggregator.record(model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        metrics.TOKENS.inc(prompt_tokens, model=model, type="prompt")
+        metrics.TOKENS.inc(cached_tokens, model=model, type="cached_prompt")
+        metrics.TOKENS.inc(completion_tokens, model=model, type="completion")
+
+    def add_embedding(self, model: str, tokens: int):
+        """Record an embedding call's token usage"""
+        self.usage.add_embedding(tokens)
+        usage_aggregator.record(model, embedding_tokens=tokens)
+        metrics.TOKENS.inc(tokens, model=model, type="embedding")
+
+    def add_cache_lookup(self, hits: int, misses: int):
+        """Record embedding cache results"""
+        self.usage.add_cache_lookup(hits, misses)
+        metrics.EMBEDDING_CACHE_LOOKUPS.inc(hits, result="hit")
+        metrics.EMBEDDING_CACHE_LOOKUPS.inc(misses, result="miss")
+
+    def record_retry(self, operation: str, model: str = "") -> int:
+        """Count a retry of an upstream operation, returning the count so far"""
+        metrics.UPSTREAM_RETRIES.inc(model=model, operation=operation)
+        self.retries[operation] = self.retries.get(operation, 0) + 1
+        return self.retries[operation]
+
+    def add_retries(self, retries: Dict[str, int]):
+        """Attribute retries made on this request's behalf by a shared call (already in metrics)"""
+        for operation, count in retries.items():
+            self.retries[operation] = self.retries.get(operation, 0) + count
+
+    def remaining_seconds(self) -> Optional[float]:
+        """Seconds left before the deadline (None without a deadline)"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the context was created"""
+        return round((time.perf_counter() - self.started_at) * 1000, 2)
+
+
+_current_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def get_context() -> RequestContext:
+    """
+    Get the context of the running request
+
+    Outside of a request (e.g. diagnostic scripts calling pipeline methods
+    directly) a throwaway context is returned so callers never need a None check.
+    """
+    ctx = _current_context.get()
+    if ctx is None:
+        ctx = RequestContext()
+        _current_context.set(ctx)
+    return ctx
+
+
+@contextmanager
+def request_context(session_id: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[RequestContext]:
+    """Run a block inside a fresh RequestContext, optionally with a deadline `timeout` seconds away"""
+    ctx = RequestContext(session_id=session_id)
+    if timeout:
+        ctx.deadline = ctx.started_at + timeout
+    token = _current_context.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current_context.reset(token)
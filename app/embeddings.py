@@ -0,0 +1,262 @@
+"""
+Pluggable embedding backends
+
+`TranscriptProcessor._embed_texts` sends cache misses to one backend, chosen
+with EMBEDDING_BACKEND:
+
+- openai:  the remote embeddings API (default), through the shared batcher,
+           coalescer and upstream retry layer
+- hashing: CPU-only hashed bag-of-words vectors with sublinear TF; no weights,
+           no network, deterministic across processes
+- sentence-transformers: a local model (optionally ONNX) loaded once per worker;
+           needs the optional `sentence-transformers` package
+
+Local backends batch their inputs and run on a thread pool, so the event loop
+never blocks on CPU work. Similarity scores are not comparable across
+backends, so each carries its own calibrated default `citation_threshold`
+(CITATION_THRESHOLD still overrides it).
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBackend:
+    """Turns texts into vectors; subclasses implement `embed`"""
+
+    name = "base"
+    # Default cosine threshold for a segment to count as a citation
+    citation_threshold = 0.5
+    # Whether vectors are worth storing in the embedding cache
+    cacheable = True
+
+    def __init__(self, model: str):
+        """
+        Args:
+            model: Model name; also namespaces the embedding cache
+        """
+        self.model = model
+
+    async def embed(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """
+        Embed texts in order
+
+        Returns:
+            Tuple of (one vector per text, billable tokens used)
+        """
+        raise NotImplementedError
+
+    async def start(self):
+        """Load whatever the backend needs before the first request"""
+
+    def close(self):
+        """Release backend resources"""
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "model": self.model, "citation_threshold": self.citation_threshold}
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Remote embeddings API through the shared coalescer and batcher"""
+
+    name = "openai"
+    # Tested empirically with text-embedding-3-small
+    citation_threshold = 0.50
+
+    def __init__(self, model: str, coalescer, get_client: Callable):
+        """
+        Args:
+            model: Embedding model (e.g. text-embedding-3-small)
+            coalescer: EmbeddingCoalescer merging concurrent requests' texts
+            get_client: Returns the AsyncOpenAI client (created lazily by the processor)
+        """
+        super().__init__(model)
+        self.coalescer = coalescer
+        self.get_client = get_client
+
+    async def embed(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        return await self.coalescer.embed(self.get_client(), self.model, texts)
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """Base for CPU backends: splits inputs into batches run on a thread pool"""
+
+    def __init__(self, model: str, batch_size: int = 64, threads: int = 4):
+        """
+        Args:
+            model: Model name
+            batch_size: Texts per thread-pool task
+            threads: Worker threads (shared by all requests in this process)
+        """
+        super().__init__(model)
+        self.batch_size = batch_size
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"embed-{self.name}")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch synchronously (runs on a pool thread)"""
+        raise NotImplementedError
+
+    async def embed(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        if not texts:
+            return [], 0
+        loop = asyncio.get_running_loop()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self.encode, batch) for batch in batches
+        ))
+        vectors = np.vstack(results).astype(np.float32, copy=False)
+        # No billable tokens
+        return list(vectors), 0
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "batch_size": self.batch_size, "threads": self.threads}
+
+
+class HashingEmbeddingBackend(LocalEmbeddingBackend):
+    """
+    Hashed bag-of-words vectors (the "hashing trick") for environments without weights
+
+    Lowercased, stemmed content words and bigrams are hashed into `dim` signed
+    buckets with sublinear (1 + log tf) weights, then L2-normalized. Purely
+    lexical: paraphrases that share no words score low, hence the lower threshold.
+    """
+
+    name = "hashing"
+    # Best F1 against the API backend's citations in data/output_*.json
+    citation_threshold = 0.10
+    # Cheaper to recompute than to look up
+    cacheable = False
+
+    def __init__(self, dim: int = 1024, batch_size: int = 64, threads: int = 4):
+        self.dim = dim
+        super().__init__(f"hashing-{dim}", batch_size=batch_size, threads=threads)
+
+    def features(self, text: str) -> Counter:
+        """Weighted unigram and bigram features of a text"""
+        tokens = tokenize(text)
+        features = Counter(tokens)
+        for first, second in zip(tokens, tokens[1:]):
+            features[f"{first} {second}"] += 0.5
+        return features
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                # The sign bit keeps colliding features from only ever adding up
+                sign = 1.0 if digest >> 63 else -1.0
+                matrix[row, digest % self.dim] += sign * (1.0 + math.log(count) if count >= 1 else count)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerBackend(LocalEmbeddingBackend):
+    """Local sentence-transformers model, loaded once per process"""
+
+    name = "sentence-transformers"
+    # Typical for all-MiniLM-style models, whose cosine scores run lower than OpenAI's
+    citation_threshold = 0.40
+
+    _models: Dict[Tuple[str, str, str], object] = {}
+    _models_lock = threading.Lock()
+
+    def __init__(
+        self,
+        model: str = "all-MiniLM-L6-v2",
+        device: str = "cpu",
+        runtime: str = "torch",
+        batch_size: int = 64,
+        threads: int = 4
+    ):
+        """
+        Args:
+            model: sentence-transformers model name or path
+            device: Torch device ("cpu")
+            runtime: "torch", or "onnx" (needs sentence-transformers>=3.2 with ONNX extras)
+            batch_size: Texts per thread-pool task
+            threads: Worker threads
+        """
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise ImportError(
+                "EMBEDDING_BACKEND=sentence-transformers needs the optional "
+                "`sentence-transformers` package (pip install sentence-transformers)"
+            )
+        self.device = device
+        self.runtime = runtime
+        super().__init__(model, batch_size=batch_size, threads=threads)
+
+    def _load(self):
+        key = (self.model, self.device, self.runtime)
+        with self._models_lock:
+            if key not in self._models:
+                from sentence_transformers import SentenceTransformer
+                kwargs = {"device": self.device}
+                if self.runtime != "torch":
+                    kwargs["backend"] = self.runtime
+                logger.info(f"Loading local embedding model {self.model} ({self.runtime}, {self.device})")
+                self._models[key] = SentenceTransformer(self.model, **kwargs)
+            return self._models[key]
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self._load().encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
+    async def start(self):
+        # Load the model at startup instead of on the first request
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._load)
+
+
+def backend_from_env(coalescer, get_client: Callable, model: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Create the embedding backend selected by EMBEDDING_BACKEND
+
+    Args:
+        coalescer: EmbeddingCoalescer for the OpenAI backend
+        get_client: Returns the AsyncOpenAI client (OpenAI backend only)
+        model: OpenAI embedding model (default EMBEDDING_MODEL)
+    """
+    name = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+    threads = int(os.getenv("EMBEDDING_THREADS", "4"))
+    batch_size = int(os.getenv("EMBEDDING_LOCAL_BATCH", "64"))
+    if name == "openai":
+        return OpenAIEmbeddingBackend(
+            model or os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"), coalescer, get_client
+        )
+    if name == "hashing":
+        return HashingEmbeddingBackend(
+            dim=int(os.getenv("EMBEDDING_HASH_DIM", "1024")), batch_size=batch_size, threads=threads
+        )
+    if name in ("sentence-transformers", "sentence_transformers", "local"):
+        return SentenceTransformerBackend(
+            model=os.getenv("EMBEDDING_LOCAL_MODEL", "all-MiniLM-L6-v2"),
+            device=os.getenv("EMBEDDING_LOCAL_DEVICE", "cpu"),
+            runtime=os.getenv("EMBEDDING_LOCAL_RUNTIME", "torch"),
+            batch_size=batch_size,
+            threads=threads
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {name}")
@@ -0,0 +1,175 @@
+"""
+Offloading CPU-bound pipeline work from the event loop
+
+Parsing the note, building the BM25 index and scoring citations are plain
+synchronous computations. For a multi-hour transcript they take long enough to
+stall every other request served by the same event loop. `Offloader` runs
+such calls on a pool once their input is at least OFFLOAD_MIN_SEGMENTS
+segments; smaller inputs run inline, where a pool hop would cost more than it
+saves.
+
+- thread:  a thread pool (default). The request context is copied along, and
+           numpy releases the GIL in the scoring kernels, so the loop keeps
+           serving other requests.
+- process: a process pool for calls marked `process_safe` (module-level
+           functions on picklable arguments, e.g. the BM25 index build, which
+           is pure-Python tokenizing and holds the GIL). Other calls still use
+           the thread pool: bound processor methods cannot be pickled.
+- off:     everything inline (previous behavior).
+
+`LoopLagMonitor` measures how late a periodic timer fires on the event loop,
+which is the delay every other coroutine saw at that moment. It feeds
+aidmi_event_loop_lag_seconds and the `event_loop` entry of /health.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+import numpy as np
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "thread", "process")
+
+
+class Offloader:
+    """Runs synchronous calls inline or on a thread/process pool by input size"""
+
+    def __init__(self, mode: str = "thread", min_segments: int = 1000, workers: int = 2):
+        """
+        Args:
+            mode: "off", "thread" or "process"
+            min_segments: Inputs at least this large (in transcript segments) are offloaded
+            workers: Threads (and processes, in process mode) per pool
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown OFFLOAD_MODE: {mode} (expected one of {', '.join(MODES)})")
+        self.mode = mode
+        self.min_segments = min_segments
+        self.workers = workers
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self.offloaded = 0
+        self.inline = 0
+
+    @classmethod
+    def from_env(cls) -> "Offloader":
+        """Create an offloader configured from OFFLOAD_* environment variables"""
+        return cls(
+            mode=os.getenv("OFFLOAD_MODE", "thread").lower(),
+            min_segments=int(os.getenv("OFFLOAD_MIN_SEGMENTS", "1000")),
+            workers=int(os.getenv("OFFLOAD_WORKERS", "2"))
+        )
+
+    def _pool(self, process_safe: bool) -> Executor:
+        # Created on first use, so a pre-forking parent never starts pool threads
+        if self.mode == "process" and process_safe:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.workers)
+            return self._processes
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offload")
+        return self._threads
+
+    async def run(self, task: str, func: Callable[..., Any], *args, size: int, process_safe: bool = False) -> Any:
+        """
+        Call `func(*args)`, on a pool if `size` reaches the threshold
+
+        Args:
+            task: Name for metrics (e.g. "extract_citations")
+            func: Synchronous callable
+            size: Input size in transcript segments
+            process_safe: `func` and its arguments can be pickled (eligible for the process pool)
+
+        Returns:
+            The call's result
+        """
+        if self.mode == "off" or size < self.min_segments:
+            self.inline += 1
+            return func(*args)
+        self.offloaded += 1
+        pool = self._pool(process_safe)
+        kind = "process" if isinstance(pool, ProcessPoolExecutor) else "thread"
+        metrics.OFFLOADED_TASKS.inc(task=task, pool=kind)
+        loop = asyncio.get_running_loop()
+        if kind == "process":
+            return await loop.run_in_executor(pool, func, *args)
+        # Carry the request context (timings, usage) into the pool thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(pool, context.run, func, *args)
+
+    def close(self):
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = self._processes = None
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "min_segments": self.min_segments,
+            "workers": self.workers,
+            "offloaded": self.offloaded,
+            "inline": self.inline
+        }
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how late a timer of `interval` seconds fires"""
+
+    def __init__(self, interval: float = 0.1, window: int = 600):
+        """
+        Args:
+            interval: Seconds between samples
+            window: Recent samples kept for /health percentiles
+        """
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "LoopLagMonitor":
+        """Create a monitor configured from LOOP_LAG_INTERVAL_MS"""
+        return cls(interval=float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000)
+
+    def start(self):
+        """Start sampling on the running loop (no-op if already running or disabled)"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._sample())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record(max(time.perf_counter() - start - self.interval, 0.0))
+
+    def record(self, lag: float):
+        self.samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        metrics.EVENT_LOOP_LAG.observe(lag)
+
+    def stats(self) -> Dict:
+        if not self.samples:
+            return {"samples": 0}
+        lags = np.asarray(self.samples) * 1000
+        return {
+            "samples": len(lags),
+            "lag_p50_ms": round(float(np.percentile(lags, 50)), 2),
+            "lag_p99_ms": round(float(np.percentile(lags, 99)), 2),
+            "lag_max_ms": round(self.max_lag * 1000, 2)
+        }
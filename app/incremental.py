@@ -0,0 +1,504 @@
+"""
+Incremental re-processing of corrected or extended transcripts
+
+The first incremental request for a session runs the full pipeline and keeps
+its intermediate state (segment and statement embeddings, note sections,
+spans). Later versions of the same session are diffed against that state by
+segment id and content hash, and only the work the edit invalidates is redone:
+
+- Only added or changed segments are embedded
+- A SOAP section is regenerated only if it cites a changed/removed segment or
+  is the nearest section to new material; other sections are kept verbatim
+- Citation search is re-run only for statements that are new, cite a changed
+  or removed segment, or that new material could enter the top-k of; with
+  hybrid retrieval or candidate pruning on, any edit that shifts BM25
+  statistics or section time windows re-cites every statement
+- Unchanged statements keep their span id, and kept citations keep their
+  number; new spans and citations are numbered after the previous maximum
+
+Edits touching more than `full_rerun_ratio` of the segments, transcripts over
+the single-prompt budget and configuration changes fall back to a full run.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.cache import normalize_text
+from app.context import RequestContext
+from app.models import NoteSpan, SOAPNoteOutput
+from app.retrieval import SegmentIndex, normalize_rows
+from app.transcript import SegmentRow, TranscriptColumns
+from app.utils import calculate_token_estimate
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ("subjective", "objective", "assessment", "plan")
+
+
+def segment_hash(segment: SegmentRow) -> str:
+    """Content hash of a segment (speaker + normalized text; timestamps are ignored)"""
+    content = f"{segment.speaker}\x1f{normalize_text(segment.text)}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class SegmentDiff:
+    """How a new transcript version relates to the previous one"""
+    unchanged: Dict[int, int]   # new segment index -> old segment index
+    changed: List[int]          # new indices whose id exists but content differs
+    added: List[int]            # new indices with no previous counterpart
+    removed: List[int]          # old indices that are gone
+    hashes: List[str] = field(default_factory=list)  # segment_hash of every new segment
+
+    @property
+    def fresh(self) -> List[int]:
+        """New indices that need embedding (changed + added, in transcript order)"""
+        return sorted(self.changed + self.added)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.changed or self.added or self.removed)
+
+
+def diff_segments(old_hashes: List[str], old_ids: List[str], segments: TranscriptColumns) -> SegmentDiff:
+    """
+    Match segments by id, then by content hash for re-segmented (renamed) lines
+
+    Args:
+        old_hashes: segment_hash of every previous segment
+        old_ids: Ids of every previous segment
+        segments: New transcript segments
+
+    Returns:
+        SegmentDiff between the two versions
+    """
+    old_by_id = {seg_id: i for i, seg_id in enumerate(old_ids)}
+    unchanged: Dict[int, int] = {}
+    changed: List[int] = []
+    unmatched: List[int] = []
+    matched_old = set()
+
+    hashes = [segment_hash(seg) for seg in segments]
+    for i, seg_id in enumerate(segments.ids):
+        j = old_by_id.get(seg_id)
+        if j is None:
+            unmatched.append(i)
+        elif old_hashes[j] == hashes[i]:
+            unchanged[i] = j
+            matched_old.add(j)
+        else:
+            changed.append(i)
+            matched_old.add(j)
+
+    # A new id carrying exactly the text of a vanished segment is the same line renamed
+    free_by_hash: Dict[str, List[int]] = {}
+    for j, digest in enumerate(old_hashes):
+        if j not in matched_old:
+            free_by_hash.setdefault(digest, []).append(j)
+    added = []
+    for i in unmatched:
+        candidates = free_by_hash.get(hashes[i])
+        if candidates:
+            j = candidates.pop(0)
+            unchanged[i] = j
+            matched_old.add(j)
+        else:
+            added.append(i)
+
+    removed = [j for j in range(len(old_ids)) if j not in matched_old]
+    return SegmentDiff(unchanged=unchanged, changed=changed, added=added, removed=removed, hashes=hashes)
+
+
+@dataclass
+class SessionState:
+    """Everything needed to update a session's note without starting over"""
+    config_key: str
+    segments: TranscriptColumns
+    segment_hashes: List[str]
+    segment_embeddings: np.ndarray    # (n_segments, dim)
+    sections: Dict[str, Any]          # section -> as generated (sentence list, or text in JSON mode)
+    statements: List[Dict]            # section, text (aligned with spans)
+    statement_embeddings: np.ndarray  # (n_statements, dim)
+    spans: List[NoteSpan]
+    floors: np.ndarray                # score a new segment must reach to enter each statement's top-k
+    output: SOAPNoteOutput
+
+
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _span_number(span_id: str) -> int:
+    match = re.search(r"(\d+)$", span_id)
+    return int(match.group(1)) if match else 0
+
+
+class IncrementalUpdater:
+    """Per-session state (bounded LRU) and the incremental update algorithm"""
+
+    def __init__(self, processor, max_sessions: int = 500, full_rerun_ratio: float = 0.5):
+        """
+        Args:
+            processor: TranscriptProcessor whose stages are reused
+            max_sessions: Sessions whose state is kept (least recently used are dropped)
+            full_rerun_ratio: Fraction of changed/added/removed segments above which
+                the whole pipeline is re-run instead
+        """
+        self.processor = processor
+        self.max_sessions = max_sessions
+        self.full_rerun_ratio = full_rerun_ratio
+        self._states: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def from_env(cls, processor) -> "IncrementalUpdater":
+        """Create an updater configured from environment variables"""
+        return cls(
+            processor,
+            max_sessions=int(os.getenv("INCREMENTAL_MAX_SESSIONS", "500")),
+            full_rerun_ratio=float(os.getenv("INCREMENTAL_FULL_RERUN_RATIO", "0.5"))
+        )
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Lock serializing updates of one session"""
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        state = self._states.get(session_id)
+        if state is not None:
+            self._states.move_to_end(session_id)
+        return state
+
+    def put(self, session_id: str, state: SessionState):
+        self._states[session_id] = state
+        self._states.move_to_end(session_id)
+        while len(self._states) > self.max_sessions:
+            evicted, _ = self._states.popitem(last=False)
+            lock = self._locks.get(evicted)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted]
+
+    def forget(self, session_id: str):
+        """Drop a session's state (its next incremental request runs in full)"""
+        self._states.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        return {"sessions": len(self._states), "max_sessions": self.max_sessions}
+
+    async def update(
+        self,
+        transcript: TranscriptColumns,
+        ctx: RequestContext,
+        segment_embeddings: Optional[np.ndarray] = None
+    ) -> SOAPNoteOutput:
+        """
+        Process a new version of a session's transcript, reusing the previous run
+
+        Args:
+            transcript: Latest version of the session transcript
+            ctx: Request context of this update
+            segment_embeddings: Optional precomputed embeddings aligned with the segments
+
+        Returns:
+            SOAPNoteOutput; metadata["incremental"] describes what was redone
+        """
+        processor = self.processor
+        config_key = processor._pipeline_config_key()
+        state = self.get(transcript.session_id)
+        if state is None or state.config_key != config_key:
+            reason = "first_version" if state is None else "config_changed"
+            return await self._full_run(transcript, ctx, config_key, reason, segment_embeddings)
+
+        segments = transcript
+        diff = diff_segments(state.segment_hashes, state.segments.ids, segments)
+        unchanged = (
+            diff.is_empty
+            and state.segments.ids == segments.ids
+            and np.array_equal(state.segments.start_ms, segments.start_ms)
+            and np.array_equal(state.segments.end_ms, segments.end_ms)
+        )
+        if unchanged:
+            # Same content, ids and times: the previous note still applies. Renamed or
+            # reordered segments go through the normal path so citations and embedding
+            # rows follow the new ids; re-timed ones so pruning's time windows are redone.
+            state.segments = segments
+            ctx.timings["total"] = ctx.elapsed_ms()
+            return state.output.model_copy(update={"metadata": {
+                **state.output.metadata,
+                "token_usage": ctx.usage.get_summary(),
+                "timings_ms": ctx.timings,
+                "incremental": {"mode": "unchanged", "segments_added": 0, "segments_changed": 0, "segments_removed": 0}
+            }})
+
+        edited = len(diff.changed) + len(diff.added) + len(diff.removed)
+        if edited > self.full_rerun_ratio * max(len(segments), len(state.segments)):
+            return await self._full_run(transcript, ctx, config_key, "too_many_changes", segment_embeddings)
+
+        transcript_text = processor._format_transcript_for_llm(segments)
+        if calculate_token_estimate(processor.prompts.system_prompt + transcript_text) > processor.max_prompt_tokens:
+            return await self._full_run(transcript, ctx, config_key, "over_prompt_budget", segment_embeddings)
+
+        # 1. Embed only the changed and added segments
+        stage_start = time.perf_counter()
+        fresh = diff.fresh
+        dim = state.segment_embeddings.shape[1]
+        if segment_embeddings is not None:
+            segment_embeddings = np.asarray(segment_embeddings, dtype=np.float32)
+        else:
+            segment_embeddings = np.zeros((len(segments), dim), dtype=np.float32)
+            for i, j in diff.unchanged.items():
+                segment_embeddings[i] = state.segment_embeddings[j]
+            if fresh:
+                segment_embeddings[fresh] = await processor._embed_segments(segments.take(fresh))
+        ctx.timings["embed_segments"] = _ms_since(stage_start)
+
+        # 2. Which statements and sections the edit touches. Citations of renamed
+        # segments must be re-cited (their id is gone) but the content is unchanged.
+        new_ids = set(segments.ids)
+        content_stale = {segments.ids[i] for i in diff.changed} | {state.segments.ids[j] for j in diff.removed}
+        stale_ids = content_stale | {seg_id for seg_id in state.segments.ids if seg_id not in new_ids}
+        cites_stale = np.array(
+            [any(c.id in stale_ids for c in span.citations) for span in state.spans], dtype=bool
+        )
+        reachable = np.zeros(len(state.statements), dtype=bool)
+        dirty = {
+            s["section"] for s, span in zip(state.statements, state.spans)
+            if any(c.id in content_stale for c in span.citations)
+        }
+        if fresh and len(state.statements):
+            similarity = normalize_rows(segment_embeddings[fresh]) @ normalize_rows(state.statement_embeddings).T
+            # New material may displace a statement's current citations...
+            reachable = (similarity >= state.floors[None, :]).any(axis=0)
+            # ...and belongs to the section of its nearest statement
+            dirty |= {state.statements[j]["section"] for j in similarity.argmax(axis=1)}
+        elif fresh:
+            dirty = set(SECTIONS)
+        if self._retrieval_shifted(state, segments, diff):
+            reachable[:] = True
+
+        # 3. Regenerate only the dirty sections
+        stage_start = time.perf_counter()
+        sections = dict(state.sections)
+        dirty_sections = [section for section in SECTIONS if section in dirty]
+        if dirty_sections:
+            sections.update(await self._regenerate_sections(state.sections, dirty_sections, transcript_text))
+        ctx.timings["regenerate_sections"] = _ms_since(stage_start)
+        stage_start = time.perf_counter()
+
+        # 4. Rebuild the statement list, keeping previous statements where the text is unchanged
+        statements, previous = self._match_statements(state, sections, set(dirty_sections))
+        statement_embeddings = np.zeros((len(statements), dim), dtype=np.float32)
+        new_rows = [k for k, j in enumerate(previous) if j is None]
+        for k, j in enumerate(previous):
+            if j is not None:
+                statement_embeddings[k] = state.statement_embeddings[j]
+        if new_rows:
+            statement_embeddings[new_rows] = await processor._embed_texts([statements[k]["text"] for k in new_rows])
+        ctx.timings["embed_statements"] = _ms_since(stage_start)
+        stage_start = time.perf_counter()
+
+        # 5. Re-cite affected statements only; everything else keeps its span as is
+        affected = [
+            k for k, j in enumerate(previous)
+            if j is None or cites_stale[j] or reachable[j]
+        ]
+        next_span = max((_span_number(span.id) for span in state.spans), default=0) + 1
+        next_citation = max((c.num for span in state.spans for c in span.citations), default=0) + 1
+        span_ids = []
+        citation_numbers = []
+        for k in affected:
+            j = previous[k]
+            if j is None:
+                span_ids.append(f"span_{next_span:03d}")
+                next_span += 1
+                citation_numbers.append({})
+            else:
+                span_ids.append(state.spans[j].id)
+                citation_numbers.append({
+                    c.id: c.num for c in state.spans[j].citations if c.id not in stale_ids
+                })
+        recited = await processor._extract_citations_rag(
+            [statements[k] for k in affected],
+            segments,
+            segment_embeddings,
+            statement_embeddings[affected],
+            first_citation=next_citation,
+            span_ids=span_ids,
+            citation_numbers=citation_numbers
+        )
+        spans: List[Optional[NoteSpan]] = [state.spans[j] if j is not None else None for j in previous]
+        for k, span in zip(affected, recited):
+            spans[k] = span
+        ctx.timings["extract_citations"] = _ms_since(stage_start)
+        ctx.timings["total"] = ctx.elapsed_ms()
+
+        output = SOAPNoteOutput(
+            session_id=transcript.session_id,
+            note_spans=spans,
+            metadata={
+                "total_segments": len(segments),
+                "total_statements": len(spans),
+                "model_used": processor.chat_model,
+                "embedding_model": processor.embedding_model,
+                "citation_threshold": processor.citation_threshold,
+                "token_usage": ctx.usage.get_summary(),
+                "embedding_cache": ctx.usage.get_cache_summary(),
+                "timings_ms": ctx.timings,
+                "retries": ctx.retries,
+                "generation_mode": "incremental",
+                "incremental": {
+                    "mode": "incremental",
+                    "segments_added": len(diff.added),
+                    "segments_changed": len(diff.changed),
+                    "segments_removed": len(diff.removed),
+                    "segments_embedded": len(fresh),
+                    "sections_regenerated": dirty_sections,
+                    "statements_recited": len(affected),
+                    "spans_reused": len(spans) - len(affected)
+                }
+            }
+        )
+        self.put(transcript.session_id, SessionState(
+            config_key=config_key,
+            segments=segments,
+            segment_hashes=diff.hashes,
+            segment_embeddings=segment_embeddings,
+            sections=sections,
+            statements=statements,
+            statement_embeddings=statement_embeddings,
+            spans=spans,
+            floors=self._floors(segment_embeddings, statement_embeddings),
+            output=output
+        ))
+        logger.info(
+            f"Incremental update of {transcript.session_id}: {len(fresh)} segments embedded, "
+            f"sections {dirty_sections or 'none'} regenerated, {len(affected)}/{len(spans)} statements re-cited"
+        )
+        return output
+
+    async def _full_run(
+        self,
+        transcript: TranscriptColumns,
+        ctx: RequestContext,
+        config_key: str,
+        reason: str,
+        segment_embeddings: Optional[np.ndarray] = None
+    ) -> SOAPNoteOutput:
+        """Run the whole pipeline and record the session state it produced"""
+        results: Dict = {}
+        output = await self.processor._run_pipeline(transcript, ctx, results, segment_embeddings)
+        soap_note = results["generate_note"]
+        statements = [
+            {"section": s["section"], "text": s["text"], "source_ids": s.get("source_ids")}
+            for s in results["parse_note"]
+        ]
+        segment_embeddings = results["embed_segments"]
+        statement_embeddings = results["embed_statements"]
+        if len(statement_embeddings) == 0:
+            statement_embeddings = np.zeros((0, segment_embeddings.shape[1]), dtype=np.float32)
+        output.metadata["incremental"] = {"mode": "full", "reason": reason}
+        self.put(transcript.session_id, SessionState(
+            config_key=config_key,
+            segments=transcript,
+            segment_hashes=[segment_hash(seg) for seg in transcript],
+            segment_embeddings=segment_embeddings,
+            sections={section: soap_note[section] for section in SECTIONS if section in soap_note},
+            statements=statements,
+            statement_embeddings=statement_embeddings,
+            spans=list(output.note_spans),
+            floors=self._floors(segment_embeddings, statement_embeddings),
+            output=output
+        ))
+        return output
+
+    async def _regenerate_sections(
+        self,
+        current: Dict[str, Any],
+        sections: List[str],
+        transcript_text: str
+    ) -> Dict[str, Any]:
+        """Ask the model to rewrite the given sections against the updated transcript (the copied rest is ignored)"""
+        result = await self.processor._request_soap_json(*self.processor.prompts.sections(
+            transcript_text,
+            current_note=json.dumps({s: current.get(s, "") for s in SECTIONS}, indent=2),
+            sections=sections
+        ))
+        return {section: result.get(section, current.get(section, "")) for section in sections}
+
+    def _match_statements(self, state: SessionState, sections: Dict[str, Any], dirty: set):
+        """
+        Statements of the updated note, each paired with its previous index (None = new)
+
+        Clean sections keep their statements; in regenerated sections a sentence
+        identical to a previous one of the same section reuses it.
+        """
+        statements: List[Dict] = []
+        previous: List[Optional[int]] = []
+        for section in SECTIONS:
+            old = [j for j, s in enumerate(state.statements) if s["section"] == section]
+            if section not in dirty:
+                statements.extend(state.statements[j] for j in old)
+                previous.extend(old)
+                continue
+            by_text: Dict[str, List[int]] = {}
+            for j in old:
+                by_text.setdefault(normalize_text(state.statements[j]["text"]), []).append(j)
+            for sentence, source_ids in self.processor._section_sentences(sections.get(section, "")):
+                reusable = by_text.get(normalize_text(sentence))
+                statements.append({"section": section, "text": sentence, "source_ids": source_ids})
+                previous.append(reusable.pop(0) if reusable else None)
+        return statements, previous
+
+    def _retrieval_shifted(self, state: SessionState, segments: TranscriptColumns, diff: SegmentDiff) -> bool:
+        """
+        Whether the edit can move citations the dense floors do not account for
+
+        Hybrid retrieval's BM25 statistics (IDF, average length) change with any
+        changed, added or removed segment, and candidate pruning's section time
+        windows with any timestamp. Either can reorder or rescue candidates of a
+        statement no new segment is near, so such edits re-cite every statement.
+        """
+        processor = self.processor
+        if not (processor.hybrid_retrieval or processor.candidate_pruning):
+            return False
+        if diff.fresh or diff.removed:
+            return True
+        if not processor.candidate_pruning:
+            return False
+        new_rows = list(diff.unchanged)
+        old_rows = [diff.unchanged[i] for i in new_rows]
+        return not (
+            np.array_equal(segments.start_ms[new_rows], state.segments.start_ms[old_rows])
+            and np.array_equal(segments.end_ms[new_rows], state.segments.end_ms[old_rows])
+        )
+
+    def _floors(self, segment_embeddings: np.ndarray, statement_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Per statement, the score a segment needs to become one of its citations
+
+        Dense cosine only; with hybrid retrieval or pruning on, edits that shift
+        their scoring re-cite everything instead (see `_retrieval_shifted`).
+        """
+        processor = self.processor
+        floors = np.full(len(statement_embeddings), processor.citation_threshold, dtype=np.float32)
+        if len(statement_embeddings) == 0 or len(segment_embeddings) == 0:
+            return floors
+        retrieval = SegmentIndex(segment_embeddings).search(
+            statement_embeddings,
+            top_k=processor.citation_top_k,
+            threshold=processor.citation_threshold
+        )
+        # Statements with a full top-k only take segments beating their weakest citation
+        full = retrieval.mask.all(axis=1) & (retrieval.mask.shape[1] == processor.citation_top_k)
+        floors[full] = retrieval.scores[full, -1]
+        return floors
@@ -0,0 +1,349 @@
+"""
+Durable job queue for asynchronous note generation
+
+POST /jobs stores the transcript in a SQLite queue and returns at once; a pool
+of asyncio workers claims jobs (highest priority first, then oldest) and runs
+TranscriptProcessor.process_transcript. GET /jobs/{id} polls status and result.
+
+- Resubmitting a session_id returns the existing job (failed jobs are requeued)
+- Claims are leases: a job whose worker died is picked up again once its lease
+  expires, up to `max_attempts` times; several processes can share one file
+- The number of queued jobs is bounded, so overload is rejected at submit time
+- Finished jobs (transcript and note are PHI) are deleted `retention_seconds`
+  after they finish, checked on every claim
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app.models import SOAPNoteOutput, TranscriptInput
+from app.transcript import TranscriptColumns
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a submission would exceed the queued-job limit"""
+
+
+class JobStore:
+    """SQLite-backed job table with leased claims"""
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 600.0,
+        max_attempts: int = 3,
+        retention_seconds: Optional[float] = 86400.0
+    ):
+        """
+        Args:
+            path: SQLite file (":memory:" for a non-durable queue)
+            lease_seconds: Time after which a running job is presumed abandoned
+            max_attempts: Claims per job before it is marked failed
+            retention_seconds: Succeeded and failed jobs are deleted this long after
+                finishing (None keeps them)
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; claims use explicit BEGIN IMMEDIATE transactions
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " session_id TEXT NOT NULL UNIQUE,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " lease_expires_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority DESC, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+
+    def submit(self, transcript: TranscriptInput, priority: int = 0, max_queued: Optional[int] = None) -> Tuple[Dict, bool]:
+        """
+        Add a job, or return the existing job for the same session_id
+
+        Returns:
+            Tuple of (job, created) where created is False for resubmissions
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, status FROM jobs WHERE session_id = ?", (transcript.session_id,)
+                ).fetchone()
+                if row is not None and row[1] != FAILED:
+                    self._db.execute("COMMIT")
+                    return self._get(row[0]), False
+
+                if max_queued is not None:
+                    queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                    if queued >= max_queued:
+                        raise QueueFullError(f"Job queue is full ({queued} queued)")
+
+                if row is not None:
+                    # Failed jobs are retried on resubmission with the new payload
+                    job_id = row[0]
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, priority = ?, payload = ?, result = NULL, error = NULL,"
+                        " attempts = 0, created_at = ?, started_at = NULL, finished_at = NULL,"
+                        " lease_expires_at = NULL WHERE id = ?",
+                        (QUEUED, priority, transcript.model_dump_json(), now, job_id)
+                    )
+                else:
+                    job_id = f"job_{uuid.uuid4().hex}"
+                    self._db.execute(
+                        "INSERT INTO jobs (id, session_id, priority, status, payload, created_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (job_id, transcript.session_id, priority, QUEUED, transcript.model_dump_json(), now)
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return self._get(job_id), True
+
+    def claim(self) -> Optional[Tuple[str, TranscriptColumns]]:
+        """Lease the next runnable job (queued, or running with an expired lease)"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Abandoned jobs that used up their attempts are failed, not retried
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?"
+                    " WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                    (FAILED, "Worker lease expired too many times", now, RUNNING, now, self.max_attempts)
+                )
+                self._purge(now)
+                row = self._db.execute(
+                    "SELECT id, payload FROM jobs"
+                    " WHERE status = ? OR (status = ? AND lease_expires_at < ?)"
+                    " ORDER BY priority DESC, created_at LIMIT 1",
+                    (QUEUED, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_expires_at = ?"
+                    " WHERE id = ?",
+                    (RUNNING, now, now + self.lease_seconds, row[0])
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        # Validated as a TranscriptInput on submit; columns skip the per-segment models
+        return row[0], TranscriptColumns.from_json(row[1])
+
+    def purge(self) -> int:
+        """Delete finished jobs past the retention period, returning how many were deleted"""
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now: float) -> int:
+        if self.retention_seconds is None:
+            return 0
+        deleted = self._db.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (SUCCEEDED, FAILED, now - self.retention_seconds)
+        ).rowcount
+        if deleted > 0:
+            logger.info(f"Purged {deleted} finished jobs past retention")
+        return max(deleted, 0)
+
+    def complete(self, job_id: str, output: SOAPNoteOutput):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+                (SUCCEEDED, output.model_dump_json(), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+
+    def release(self, job_id: str):
+        """Put a claimed job back in the queue (e.g. on shutdown)"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), started_at = NULL,"
+                " lease_expires_at = NULL WHERE id = ? AND status = ?",
+                (QUEUED, job_id, RUNNING)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._get(job_id)
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT id, session_id, priority, status, result, error, attempts, created_at, started_at, finished_at"
+            " FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "session_id": row[1],
+            "priority": row[2],
+            "status": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "attempts": row[6],
+            "created_at": row[7],
+            "started_at": row[8],
+            "finished_at": row[9]
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobQueue:
+    """Pool of asyncio workers draining a JobStore through a TranscriptProcessor"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        processor,
+        workers: int = 4,
+        max_queued: int = 1000,
+        poll_seconds: float = 1.0
+    ):
+        """
+        Args:
+            store: Durable job table
+            processor: TranscriptProcessor running the jobs
+            workers: Jobs processed at once by this process (max in flight)
+            max_queued: Submissions are rejected while this many jobs are queued
+            poll_seconds: Idle poll interval (picks up jobs submitted by other processes)
+        """
+        self.store = store
+        self.processor = processor
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_seconds = poll_seconds
+        self.in_flight = 0
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls, processor) -> "JobQueue":
+        """Create a queue configured from environment variables"""
+        retention = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+        store = JobStore(
+            os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite") or ":memory:",
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "600")),
+            max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+            retention_seconds=retention if retention > 0 else None
+        )
+        return cls(
+            store,
+            processor,
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", "1000")),
+            poll_seconds=float(os.getenv("JOB_POLL_SECONDS", "1"))
+        )
+
+    def submit(self, transcript: TranscriptInput, priority: int = 0) -> Tuple[Dict, bool]:
+        """Queue a transcript (idempotent by session_id) and wake a worker"""
+        job, created = self.store.submit(transcript, priority, max_queued=self.max_queued)
+        if created and self._wakeup is not None:
+            self._wakeup.set()
+        return job, created
+
+    def start(self):
+        """Start the worker tasks on the running event loop"""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while not self._stopping:
+            # Cleared before claiming so a submission in between is not missed
+            self._wakeup.clear()
+            claimed = self.store.claim()
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, transcript = claimed
+            # Another job may be waiting behind this one
+            self._wakeup.set()
+            self.in_flight += 1
+            try:
+                output = await self.processor.process_transcript(transcript)
+            except asyncio.CancelledError:
+                self.store.release(job_id)
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} ({transcript.session_id}) failed: {e}")
+                self.store.fail(job_id, str(e))
+            else:
+                self.store.complete(job_id, output)
+                logger.info(f"Job {job_id} ({transcript.session_id}) succeeded")
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        """Queue depth by status plus this process's in-flight count"""
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "max_queued": self.max_queued,
+            "jobs": self.store.counts()
+        }
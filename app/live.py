@@ -0,0 +1,278 @@
+"""
+Live session mode: a draft SOAP note while the session is still running
+
+Segments arrive over a WebSocket as ASR emits them. They are embedded in
+micro-batches into a growing per-session embedding matrix, and the draft note
+is refreshed periodically, after enough new segments, or on demand, through
+the incremental pipeline (app/incremental.py): each refresh regenerates only
+the sections new material touches and re-cites only the affected statements.
+New and changed spans are pushed to the client. When the session ends almost
+all embedding and retrieval work is done, so finalizing is one small update.
+
+Protocol (JSON messages on /live/{session_id}):
+
+    client -> server
+        {"type": "segment", "segment": {...TranscriptSegment...}}
+        {"type": "segments", "segments": [...]}
+        {"type": "refresh"}     draft now instead of waiting for the next refresh
+        {"type": "finalize"}    final note, then the server closes the socket
+
+    server -> client
+        {"type": "ack", "segments": n, "pending": m}
+        {"type": "draft", "version": v, "spans": [new or changed NoteSpans],
+         "removed": [span ids], "order": [span ids], "metadata": {...}}
+        {"type": "final", "note": {...SOAPNoteOutput...}}
+        {"type": "error", "detail": "..."}
+
+A segment sent again with a known id replaces it (ASR corrections).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from app import metrics
+from app.context import request_context
+from app.models import NoteSpan, SOAPNoteOutput, TranscriptSegment
+from app.transcript import TranscriptColumns
+
+logger = logging.getLogger(__name__)
+
+
+class LiveSession:
+    """Segments, embeddings and draft note of one live session"""
+
+    def __init__(
+        self,
+        processor,
+        session_id: str,
+        patient_id: str,
+        send: Callable[[Dict], Awaitable[None]],
+        embed_batch_size: int = 16,
+        embed_interval: float = 0.5,
+        refresh_segments: int = 20,
+        refresh_seconds: float = 30.0
+    ):
+        """
+        Args:
+            processor: TranscriptProcessor used for embedding and drafts
+            session_id: Session identifier (also keys the incremental state)
+            patient_id: Patient identifier
+            send: Coroutine delivering a JSON message to the client
+            embed_batch_size: Pending segments that trigger an embedding call at once
+            embed_interval: Seconds before a smaller pending batch is embedded anyway
+            refresh_segments: New or corrected segments that trigger a draft refresh
+            refresh_seconds: Draft refresh interval while segments keep arriving
+        """
+        self.processor = processor
+        self.session_id = session_id
+        self.patient_id = patient_id
+        self._send = send
+        self.embed_batch_size = embed_batch_size
+        self.embed_interval = embed_interval
+        self.refresh_segments = refresh_segments
+        self.refresh_seconds = refresh_seconds
+
+        self.segments: List[TranscriptSegment] = []
+        self._positions: Dict[str, int] = {}
+        # Rows [0, len(segments)) of a matrix grown by doubling; pending rows are not embedded yet
+        self._matrix: Optional[np.ndarray] = None
+        self._pending: List[int] = []
+        self._changes_since_draft = 0
+
+        self.version = 0
+        self.embedding_tokens = 0
+        self.last_output: Optional[SOAPNoteOutput] = None
+        self._pushed: Dict[str, NoteSpan] = {}
+
+        self._send_lock = asyncio.Lock()
+        self._embed_lock = asyncio.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_requested = False
+        self._tasks: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls, processor, session_id: str, patient_id: str, send) -> "LiveSession":
+        """Create a session configured from environment variables"""
+        return cls(
+            processor,
+            session_id,
+            patient_id,
+            send,
+            embed_batch_size=int(os.getenv("LIVE_EMBED_BATCH", "16")),
+            embed_interval=int(os.getenv("LIVE_EMBED_INTERVAL_MS", "500")) / 1000,
+            refresh_segments=int(os.getenv("LIVE_REFRESH_SEGMENTS", "20")),
+            refresh_seconds=float(os.getenv("LIVE_REFRESH_SECONDS", "30"))
+        )
+
+    def start(self):
+        """Start the micro-batch embedder and the periodic draft refresh"""
+        metrics.LIVE_SESSIONS.inc()
+        self._tasks = [
+            asyncio.ensure_future(self._embed_loop()),
+            asyncio.ensure_future(self._refresh_timer())
+        ]
+
+    async def close(self):
+        """Stop background work (the incremental state is kept for later corrections)"""
+        tasks = self._tasks + ([self._refresh_task] if self._refresh_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._tasks:
+            metrics.LIVE_SESSIONS.dec()
+        self._tasks = []
+
+    async def send(self, message: Dict):
+        # Background refreshes and the receive loop share one socket
+        async with self._send_lock:
+            await self._send(message)
+
+    async def add_segments(self, segments: List[TranscriptSegment]):
+        """Append new segments (or replace corrected ones) and schedule their embedding"""
+        for segment in segments:
+            position = self._positions.get(segment.id)
+            if position is None:
+                self._positions[segment.id] = len(self.segments)
+                self._pending.append(len(self.segments))
+                self.segments.append(segment)
+            elif self.segments[position] != segment:
+                self.segments[position] = segment
+                self._pending.append(position)
+            else:
+                continue
+            self._changes_since_draft += 1
+
+        if len(self._pending) >= self.embed_batch_size:
+            self._batch_ready.set()
+        if self._changes_since_draft >= self.refresh_segments:
+            self.request_refresh()
+        await self.send({"type": "ack", "segments": len(self.segments), "pending": len(self._pending)})
+
+    async def flush(self):
+        """Embed every pending segment into the session matrix"""
+        self.processor._ensure_client()
+        async with self._embed_lock:
+            while self._pending:
+                positions = sorted(set(self._pending))
+                self._pending = []
+                batch = [self.segments[i] for i in positions]
+                with request_context(self.session_id, self.processor.request_timeout) as ctx:
+                    try:
+                        vectors = await self.processor._embed_segments(TranscriptColumns.from_segments(batch))
+                    except BaseException:
+                        # Retried by the next flush
+                        self._pending.extend(positions)
+                        raise
+                self.embedding_tokens += ctx.usage.total_embedding_tokens
+                self._grow(len(self.segments), vectors.shape[1])
+                # Rows corrected while this batch was in flight are pending again
+                self._matrix[positions] = vectors
+
+    def _grow(self, rows: int, dim: int):
+        if self._matrix is None:
+            self._matrix = np.zeros((max(rows, 64), dim), dtype=np.float32)
+        elif rows > self._matrix.shape[0]:
+            grown = np.zeros((max(rows, 2 * self._matrix.shape[0]), dim), dtype=np.float32)
+            grown[:self._matrix.shape[0]] = self._matrix
+            self._matrix = grown
+
+    def request_refresh(self):
+        """Refresh the draft in the background (coalesced with a refresh already running)"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._run_refreshes())
+        else:
+            self._refresh_requested = True
+
+    async def _run_refreshes(self):
+        while True:
+            self._refresh_requested = False
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Live draft refresh failed for {self.session_id}: {e}")
+                await self.send({"type": "error", "detail": f"Draft refresh failed: {str(e)}"})
+            if not self._refresh_requested:
+                return
+
+    async def refresh(self) -> Optional[SOAPNoteOutput]:
+        """Update the draft from all segments so far and push the spans that changed"""
+        async with self._refresh_lock:
+            if not self.segments:
+                return None
+            await self.flush()
+            # No await between snapshot and reset, so later segments count for the next draft
+            segments = list(self.segments)
+            embeddings = self._matrix[:len(segments)].copy()
+            self._changes_since_draft = 0
+
+            transcript = TranscriptColumns.from_segments(segments, self.session_id, self.patient_id)
+            output = await self.processor.process_transcript_incremental(transcript, embeddings)
+            self.version += 1
+            self.last_output = output
+
+            changed = [span for span in output.note_spans if self._pushed.get(span.id) != span]
+            order = [span.id for span in output.note_spans]
+            removed = [span_id for span_id in self._pushed if span_id not in set(order)]
+            self._pushed = {span.id: span for span in output.note_spans}
+            await self.send({
+                "type": "draft",
+                "version": self.version,
+                "spans": [span.model_dump() for span in changed],
+                "removed": removed,
+                "order": order,
+                "metadata": output.metadata
+            })
+            return output
+
+    async def finalize(self) -> SOAPNoteOutput:
+        """Final note: one last incremental update over whatever arrived since the last draft"""
+        start = time.perf_counter()
+        for task in self._tasks:
+            task.cancel()
+        if self._refresh_task is not None and not self._refresh_task.done():
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+
+        output = self.last_output
+        if output is None or self._changes_since_draft or self._pending:
+            output = await self.refresh()
+        if output is None:
+            raise ValueError("Live session has no segments")
+
+        output = output.model_copy(update={"metadata": {
+            **output.metadata,
+            "live": {
+                "drafts": self.version,
+                "segments": len(self.segments),
+                "embedding_tokens": self.embedding_tokens,
+                "finalize_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        }})
+        await self.send({"type": "final", "note": output.model_dump()})
+        return output
+
+    async def _embed_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.embed_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            if not self._pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Live embedding failed for {self.session_id}, will retry: {e}")
+
+    async def _refresh_timer(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            if self._changes_since_draft:
+                self.request_refresh()
@@ -10,14 +10,23 @@ from dotenv import load_dotenv
 # CRITICAL: Load environment variables FIRST, before any other imports
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 import uvicorn
 from typing import List, Dict, Optional
+import json
 import logging
+import math
 
-from app.models import TranscriptInput, SOAPNoteOutput
+from app.models import TranscriptInput, TranscriptSegment, SOAPNoteOutput
 from app.pipeline import TranscriptProcessor
+from app.context import usage_aggregator
+from app.resilience import UpstreamUnavailableError
+from app.jobs import JobQueue, QueueFullError
+from app.live import LiveSession
+from app.serve import worker_health
+from app import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,14 +39,24 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.middleware("http")
+async def track_in_flight(request: Request, call_next):
+    """Count in-flight HTTP requests for the metrics endpoint"""
+    metrics.HTTP_REQUESTS.inc()
+    with metrics.HTTP_IN_FLIGHT.track_inprogress():
+        return await call_next(request)
+
+
 # Initialize processor (will be created once on startup)
 processor: Optional[TranscriptProcessor] = None
+# Background job workers (POST /jobs)
+job_queue: Optional[JobQueue] = None
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the transcript processor on startup"""
-    global processor
+    global processor, job_queue
     logger.info("Initializing Transcript Processor...")
     
     # Verify API key is loaded
@@ -49,7 +68,23 @@ async def startup_event():
         logger.error("Please check your .env file")
     
     processor = TranscriptProcessor()
+    # Open upstream connections now so the first requests skip connection setup
+    await processor.start()
     logger.info(f"Processor ready! OpenAI configured: {processor.openai_configured}")
+    
+    job_queue = JobQueue.from_env(processor)
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close upstream connections and caches (after uvicorn has drained requests)"""
+    if job_queue is not None:
+        # Running jobs are put back in the queue for the next start
+        await job_queue.stop()
+        job_queue.store.close()
+    if processor is not None:
+        await processor.close()
 
 
 @app.get("/")
@@ -63,12 +98,20 @@ async def root():
 
 
 @app.post("/generate-note", response_model=SOAPNoteOutput)
-async def generate_note(transcript: TranscriptInput):
+async def generate_note(
+    transcript: TranscriptInput,
+    cache: str = Query(default="use", pattern="^(use|bypass|refresh)$"),
+    incremental: bool = Query(default=False)
+):
     """
     Generate a structured SOAP note with citations from a therapy session transcript.
     
     Args:
         transcript: TranscriptInput object containing session_id, patient_id, and segments
+        cache: "use" (default) serves identical transcripts from the result cache,
+            "refresh" recomputes and updates it, "bypass" skips it entirely
+        incremental: Diff against this session's previous incremental request and
+            only redo what changed (corrected/extended transcripts); ignores `cache`
         
     Returns:
         SOAPNoteOutput with structured note spans including citations
@@ -81,16 +124,209 @@ async def generate_note(transcript: TranscriptInput):
             raise HTTPException(status_code=400, detail="Transcript must contain at least one segment")
         
         # Process transcript through pipeline
-        result = await processor.process_transcript(transcript)
+        if incremental:
+            result = await processor.process_transcript_incremental(transcript)
+        else:
+            result = await processor.process_transcript(transcript, cache_mode=cache)
         
         logger.info(f"Successfully generated note for session: {transcript.session_id}")
         return result
         
+    except UpstreamUnavailableError as e:
+        # Circuit open or deadline hit: tell the client when to come back
+        logger.error(f"Upstream unavailable for transcript {transcript.session_id}: {str(e)}")
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+        raise HTTPException(status_code=503, detail=f"Upstream unavailable: {str(e)}", headers=headers)
     except Exception as e:
         logger.error(f"Error processing transcript {transcript.session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate note: {str(e)}")
 
 
+@app.post("/generate-note/stream")
+async def generate_note_stream(transcript: TranscriptInput):
+    """
+    Stream a SOAP note as Server-Sent Events.
+    
+    Each cited statement is sent as soon as it is ready:
+    
+        event: span
+        data: {...NoteSpan...}
+    
+    followed by a final `done` event carrying the metadata (or an `error` event).
+    Citation numbers are continuous across all spans, as in /generate-note.
+    """
+    if not transcript.segments:
+        raise HTTPException(status_code=400, detail="Transcript must contain at least one segment")
+    
+    logger.info(f"Streaming note for transcript: {transcript.session_id}")
+    
+    async def events():
+        try:
+            async for event, data in processor.stream_transcript(transcript):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming transcript {transcript.session_id}: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'Failed to generate note: {str(e)}'})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/generate-notes/batch")
+async def generate_notes_batch(request: Request, concurrency: Optional[int] = Query(default=None, ge=1)):
+    """
+    Generate SOAP notes for many transcripts in one request.
+    
+    Accepts a JSON array of TranscriptInput objects, or NDJSON (one TranscriptInput
+    per line, Content-Type: application/x-ndjson). Results are streamed back as NDJSON
+    in completion order, one line per item:
+    
+        {"index": 0, "session_id": "...", "status": "ok", "result": {...SOAPNoteOutput...}}
+        {"index": 1, "session_id": "...", "status": "error", "error": "..."}
+    
+    Args:
+        concurrency: Optional override of the number of transcripts processed at once
+    """
+    body = await request.body()
+    try:
+        items = _parse_batch_body(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {str(e)}")
+    
+    # Validate every item up front; invalid items are reported without aborting the batch
+    transcripts: List[TranscriptInput] = []
+    positions: List[int] = []
+    errors: List[Dict] = []
+    for index, item in enumerate(items):
+        try:
+            transcript = TranscriptInput.model_validate(item)
+            if not transcript.segments:
+                raise ValueError("Transcript must contain at least one segment")
+            transcripts.append(transcript)
+            positions.append(index)
+        except (ValidationError, ValueError) as e:
+            session_id = item.get("session_id") if isinstance(item, dict) else None
+            errors.append({"index": index, "session_id": session_id, "status": "error", "error": str(e)})
+    
+    logger.info(f"Processing batch of {len(items)} transcripts ({len(errors)} invalid)")
+    
+    async def stream_results():
+        for error in errors:
+            yield json.dumps(error) + "\n"
+        async for batch_index, result, error in processor.process_batch(transcripts, concurrency):
+            line = {"index": positions[batch_index], "session_id": transcripts[batch_index].session_id}
+            if error is None:
+                line.update(status="ok", result=result.model_dump())
+            else:
+                line.update(status="error", error=str(error))
+            yield json.dumps(line) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(transcript: TranscriptInput, response: Response, priority: int = Query(default=0)):
+    """
+    Queue a transcript for background processing and return its job id at once.
+    
+    Poll GET /jobs/{job_id} for the result. Resubmitting a session_id returns the
+    existing job (200) instead of creating a new one; failed jobs are requeued.
+    Higher `priority` jobs are processed first.
+    """
+    if not transcript.segments:
+        raise HTTPException(status_code=400, detail="Transcript must contain at least one segment")
+    
+    try:
+        job, created = job_queue.submit(transcript, priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    if not created:
+        response.status_code = 200
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    logger.info(f"{'Queued' if created else 'Found existing'} job {job['job_id']} for session {transcript.session_id}")
+    return {key: job[key] for key in ("job_id", "session_id", "status", "priority", "created_at")}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Job status (queued, running, succeeded, failed) with the SOAPNoteOutput
+    under `result` once it has succeeded, or `error` if it failed.
+    """
+    job = job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.websocket("/live/{session_id}")
+async def live_session(websocket: WebSocket, session_id: str, patient_id: str = Query(default="unknown")):
+    """
+    Live session: stream segments in while the session runs, receive draft spans.
+    
+    Client messages: {"type": "segment", "segment": {...}}, {"type": "segments",
+    "segments": [...]}, {"type": "refresh"} and {"type": "finalize"}. The server
+    pushes "ack", "draft" (new/changed spans, removed span ids, span order) and,
+    after finalize, a "final" message with the full SOAPNoteOutput before closing.
+    See app/live.py for the full protocol.
+    """
+    await websocket.accept()
+    session = LiveSession.from_env(processor, session_id, patient_id, websocket.send_json)
+    session.start()
+    logger.info(f"Live session started: {session_id}")
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+                kind = message.get("type") if isinstance(message, dict) else None
+                if kind == "segment":
+                    await session.add_segments([TranscriptSegment.model_validate(message.get("segment"))])
+                elif kind == "segments":
+                    await session.add_segments([TranscriptSegment.model_validate(s) for s in message.get("segments") or []])
+                elif kind == "refresh":
+                    session.request_refresh()
+                elif kind == "finalize":
+                    await session.finalize()
+                    await websocket.close()
+                    break
+                else:
+                    await session.send({"type": "error", "detail": f"Unknown message type: {kind}"})
+            except (ValidationError, ValueError) as e:
+                await session.send({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        logger.info(f"Live session disconnected: {session_id}")
+    except Exception as e:
+        logger.error(f"Live session {session_id} failed: {str(e)}")
+        await session.send({"type": "error", "detail": f"Failed to generate note: {str(e)}"})
+        await websocket.close(code=1011)
+    finally:
+        await session.close()
+
+
+def _parse_batch_body(body: bytes, content_type: str) -> List:
+    """Parse a batch request body given as a JSON array or NDJSON"""
+    text = body.decode("utf-8").strip()
+    if not text:
+        raise ValueError("empty body")
+    if "ndjson" in content_type or not text.startswith("["):
+        try:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise ValueError(f"malformed NDJSON line: {e}")
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(str(e))
+    if not isinstance(items, list):
+        raise ValueError("expected a JSON array of transcripts")
+    return items
+
+
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
@@ -100,9 +336,43 @@ async def health_check():
         "processor_initialized": processor is not None,
         "openai_configured": processor.openai_configured if processor else False,
         "env_file_exists": os.path.exists(".env"),
-        "api_key_present": api_key is not None and len(api_key) > 0
+        "api_key_present": api_key is not None and len(api_key) > 0,
+        "upstream_circuits": processor.upstream.snapshot() if processor else {},
+        "embedding_backend": processor.embedding_backend.stats() if processor else None,
+        "upstream_pool": processor.pool_stats() if processor else None,
+        "incremental_sessions": processor.incremental.stats() if processor else None,
+        "live_sessions": int(metrics.LIVE_SESSIONS.get()),
+        "jobs": job_queue.stats() if job_queue else None,
+        "embedding_cache": processor.embedding_cache.stats() if processor else None,
+        "offload": processor.offload.stats() if processor else None,
+        "event_loop": processor.loop_monitor.stats() if processor else None,
+        # None unless started by app/serve.py
+        "workers": worker_health()
     }
 
 
+@app.get("/usage")
+async def usage():
+    """
+    Process-wide usage aggregates (cheap to scrape)
+    
+    Lifetime token/cost totals by model plus tokens/sec and cost/hour over a
+    sliding window (USAGE_WINDOW_SECONDS).
+    """
+    return usage_aggregator.snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text-format metrics (stage latencies, upstream calls, tokens, coverage)"""
+    if processor is not None:
+        # Refreshes the connection pool gauges
+        processor.pool_stats()
+    if job_queue is not None:
+        for status, count in job_queue.store.counts().items():
+            metrics.JOBS.set(count, status=status)
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,330 @@
+"""
+Prometheus-style metrics with low-overhead recording
+
+Counters, gauges and fixed-bucket histograms kept in plain dicts behind a lock
+and rendered in the Prometheus text exposition format by GET /metrics. Recording
+is a dict lookup, a bisect and an increment, so it can stay on in production.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Stage latencies range from sub-millisecond (parsing) to tens of seconds (LLM calls)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATIO_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabeled series are exported as 0 before the first update
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabeled series are exported as 0 before the first update
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        """Increment for the duration of a block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram (cumulative buckets rendered on scrape)"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_LATENCY = registry.register(Histogram(
+    "aidmi_stage_duration_seconds",
+    "Wall-clock duration of each pipeline stage",
+    ("stage",)
+))
+PIPELINE_LATENCY = registry.register(Histogram(
+    "aidmi_pipeline_duration_seconds",
+    "End-to-end duration of process_transcript"
+))
+FIRST_SPAN_LATENCY = registry.register(Histogram(
+    "aidmi_stream_first_span_seconds",
+    "Time from request start to the first note span sent by stream_transcript"
+))
+PIPELINE_ERRORS = registry.register(Counter(
+    "aidmi_pipeline_errors_total",
+    "Transcripts that failed to process"
+))
+PIPELINES_IN_FLIGHT = registry.register(Gauge(
+    "aidmi_pipelines_in_flight",
+    "Transcripts currently being processed"
+))
+HTTP_REQUESTS = registry.register(Counter(
+    "aidmi_http_requests_total",
+    "HTTP requests served"
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "aidmi_http_requests_in_flight",
+    "HTTP requests currently being served"
+))
+OFFLOADED_TASKS = registry.register(Counter(
+    "aidmi_offloaded_tasks_total",
+    "CPU-bound pipeline calls run off the event loop by task and pool",
+    ("task", "pool")
+))
+EVENT_LOOP_LAG = registry.register(Histogram(
+    "aidmi_event_loop_lag_seconds",
+    "Delay of a periodic event-loop timer (time other coroutines waited)"
+))
+UPSTREAM_REQUESTS = registry.register(Counter(
+    "aidmi_upstream_requests_total",
+    "Upstream API calls by model and operation",
+    ("model", "operation")
+))
+UPSTREAM_ERRORS = registry.register(Counter(
+    "aidmi_upstream_errors_total",
+    "Failed upstream API calls by model and operation",
+    ("model", "operation")
+))
+UPSTREAM_RETRIES = registry.register(Counter(
+    "aidmi_upstream_retries_total",
+    "Retried upstream API calls by model and operation",
+    ("model", "operation")
+))
+UPSTREAM_RETRY_BUDGET_EXHAUSTED = registry.register(Counter(
+    "aidmi_upstream_retry_budget_exhausted_total",
+    "Retries skipped because the retry budget was spent",
+    ("model", "operation")
+))
+UPSTREAM_CIRCUIT_OPEN = registry.register(Gauge(
+    "aidmi_upstream_circuit_open",
+    "1 while the circuit breaker for a model is open",
+    ("model",)
+))
+UPSTREAM_HTTP_IN_FLIGHT = registry.register(Gauge(
+    "aidmi_upstream_http_requests_in_flight",
+    "HTTP requests to the OpenAI API currently open (until the body is read)"
+))
+UPSTREAM_HTTP_CONNECTIONS = registry.register(Gauge(
+    "aidmi_upstream_http_connections",
+    "Pooled connections to the OpenAI API by state (active, idle)",
+    ("state",)
+))
+UPSTREAM_LATENCY = registry.register(Histogram(
+    "aidmi_upstream_duration_seconds",
+    "Upstream API call latency by model and operation",
+    ("model", "operation")
+))
+TOKENS = registry.register(Counter(
+    "aidmi_tokens_total",
+    "Tokens used by model and type (prompt, cached_prompt, completion, embedding)",
+    ("model", "type")
+))
+EMBEDDING_CACHE_LOOKUPS = registry.register(Counter(
+    "aidmi_embedding_cache_lookups_total",
+    "Embedding cache lookups by result (hit, miss)",
+    ("result",)
+))
+RESULT_CACHE_LOOKUPS = registry.register(Counter(
+    "aidmi_result_cache_lookups_total",
+    "Result cache lookups by result (hit, shared, miss)",
+    ("result",)
+))
+JOBS = registry.register(Gauge(
+    "aidmi_jobs",
+    "Jobs in the queue by status",
+    ("status",)
+))
+LIVE_SESSIONS = registry.register(Gauge(
+    "aidmi_live_sessions",
+    "Open live-session WebSockets"
+))
+STATEMENT_CITATIONS = registry.register(Counter(
+    "aidmi_statement_citations_total",
+    "Statements by how their citations were found (source_ids, retrieval)",
+    ("method",)
+))
+NOTE_SPANS = registry.register(Counter(
+    "aidmi_note_spans_total",
+    "Note spans generated"
+))
+NOTE_SPANS_NEEDS_CONFIRMATION = registry.register(Counter(
+    "aidmi_note_spans_needs_confirmation_total",
+    "Note spans without sufficient transcript support"
+))
+NEEDS_CONFIRMATION_RATIO = registry.register(Histogram(
+    "aidmi_note_needs_confirmation_ratio",
+    "Share of spans per note flagged needs_confirmation",
+    buckets=RATIO_BUCKETS
+))
+
+
+def observe_upstream_call(model: str, operation: str, duration: float, error: bool = False):
+    """Record one upstream API call"""
+    UPSTREAM_REQUESTS.inc(model=model, operation=operation)
+    UPSTREAM_LATENCY.observe(duration, model=model, operation=operation)
+    if error:
+        UPSTREAM_ERRORS.inc(model=model, operation=operation)
@@ -6,37 +6,134 @@ FIXED VERSION: Lower default threshold (0.50) and working token tracking
 import os
 import json
 import logging
-from typing import List, Dict, Tuple, Optional
+import time
+from typing import AsyncIterator, List, Dict, Tuple, Optional, Union
 import numpy as np
-from openai import AsyncOpenAI
 import asyncio
-from sklearn.metrics.pairwise import cosine_similarity
 
-from app.models import TranscriptInput, SOAPNoteOutput, NoteSpan, TranscriptSegment, Citation
-from app.utils import retry_with_backoff, validate_segment_ids, TokenCounter
+from app.models import TranscriptInput, SOAPNoteOutput, NoteSpan, Citation
+from app.utils import validate_segment_ids, calculate_token_estimate
+from app.context import RequestContext, get_context, request_context, usage_aggregator
+from app import metrics
+from app.streaming import StreamingSOAPParser
+from app.stages import StageGraph
+from app.cache import EmbeddingCache, ResultCache, result_cache_key
+from app.retrieval import BM25Index, RetrievalResult, SegmentIndex, hybrid_search, verify_claims
+from app.batching import EmbeddingBatcher, EmbeddingCoalescer
+from app.embeddings import backend_from_env
+from app.resilience import UpstreamCaller
+from app.client import ManagedOpenAIClient
+from app.executor import LoopLagMonitor, Offloader
+from app.incremental import IncrementalUpdater
+from app.pruning import SegmentFilter
+from app.transcript import TranscriptColumns
+from app.prompts import PROMPT_VERSION
+from app.prompt_builder import JSON_MODE, NoteFormatError, PromptBuilder, validate_json
 
 logger = logging.getLogger(__name__)
 
+CITATION_MODES = ("retrieval", "source_ids")
+
+
+def _streamed_statement(sentence: Tuple) -> Dict:
+    """Statement dict from a StreamingSOAPParser (section, text[, source_ids]) tuple"""
+    return {
+        'section': sentence[0],
+        'text': sentence[1],
+        'candidates': None,
+        'source_ids': sentence[2] if len(sentence) > 2 else None
+    }
+
+
+def _cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prompt cache (0 if not reported)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return int(getattr(details, "cached_tokens", None) or 0)
+
 
 class TranscriptProcessor:
     """Main processor for converting transcripts to SOAP notes with citations"""
     
-    def __init__(self):
-        """Initialize the processor with OpenAI client"""
+    def __init__(self, embedding_cache: Optional[EmbeddingCache] = None):
+        """
+        Initialize the processor with OpenAI client
+        
+        Args:
+            embedding_cache: Embedding cache to use (default: EmbeddingCache.from_env())
+        """
         # Don't check for API key here - it will be loaded by main.py
         self.api_key = None
         self.client = None
+        self.managed_client: Optional[ManagedOpenAIClient] = None
         self.openai_configured = False
             
         # Configuration - Read from environment with better defaults
-        self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
         self.chat_model = os.getenv("CHAT_MODEL", "gpt-4o-mini")
-        # Default to 0.50 for good citation coverage (tested empirically)
-        self.citation_threshold = float(os.getenv("CITATION_THRESHOLD", "0.50"))
-        self.max_retries = 3
+        self.citation_top_k = 3  # Consider top 3 segments per statement
+        
+        # Fuse dense cosine ranks with BM25 ranks over the segment text (see app/retrieval.py)
+        self.hybrid_retrieval = os.getenv("HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+        self.lexical_weight = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+        # Strong lexical matches pass if their cosine is within this margin of the threshold
+        self.lexical_margin = float(os.getenv("HYBRID_DENSE_MARGIN", "0.1"))
+        self.min_lexical_score = float(os.getenv("HYBRID_MIN_LEXICAL", "0.3"))
+        # Narrow each section's candidate segments by speaker and time (see app/pruning.py)
+        self.candidate_pruning = os.getenv("CANDIDATE_PRUNING", "true").lower() in ("1", "true", "yes")
+        self.pruning_min_candidates = int(os.getenv("PRUNING_MIN_CANDIDATES", "8"))
+        
+        # Retries, backoff, circuit breaking and retry budget for every upstream call
+        self.upstream = UpstreamCaller.from_env()
+        # Per-request deadline shared by all upstream calls (0 = none)
+        self.request_timeout = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "120"))
+        
+        # Long transcripts switch to map-reduce generation above this prompt size
+        self.max_prompt_tokens = int(os.getenv("SOAP_MAX_PROMPT_TOKENS", "12000"))
+        self.chunk_window_minutes = int(os.getenv("SOAP_CHUNK_MINUTES", "15"))
+        self.chunk_max_tokens = int(os.getenv("SOAP_CHUNK_TOKENS", "6000"))
+        
+        # retrieval: search the transcript for every statement. source_ids: the model names
+        # supporting segment ids per sentence; only statements without a verified id are searched
+        self.citation_mode = os.getenv("CITATION_MODE", "retrieval").lower()
+        if self.citation_mode not in CITATION_MODES:
+            raise ValueError(
+                f"Unknown CITATION_MODE: {self.citation_mode} (expected one of {', '.join(CITATION_MODES)})"
+            )
         
-        # Token tracking
-        self.token_counter = TokenCounter()
+        # Stable cacheable prompt prefix + compact transcript encoding (see app/prompt_builder.py)
+        self.prompts = PromptBuilder.from_env(source_ids=self.citation_mode == "source_ids")
+        
+        # Maximum transcripts processed at once by process_batch
+        self.batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+        
+        # CPU-bound stages of large transcripts run off the event loop (see app/executor.py)
+        self.offload = Offloader.from_env()
+        self.loop_monitor = LoopLagMonitor.from_env()
+        
+        # Content-addressed embedding cache (memory LRU + optional SQLite tier)
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache.from_env()
+        
+        # Finished notes by transcript content + configuration (TTL + LRU, optional SQLite tier)
+        self.result_cache = ResultCache.from_env()
+        # Identical requests already running, so concurrent retries share one run
+        self._pending_results: Dict[str, asyncio.Future] = {}
+        
+        # Previous run per session, so corrected transcripts only redo what changed
+        self.incremental = IncrementalUpdater.from_env(self)
+        
+        # Splits large embedding requests by item count and estimated tokens
+        self.embedding_batcher = EmbeddingBatcher.from_env(upstream=self.upstream)
+        
+        # Merges embedding calls from concurrent requests into shared batches
+        self.embedding_coalescer = EmbeddingCoalescer.from_env(self.embedding_batcher)
+        
+        # Remote API or a local CPU model (EMBEDDING_BACKEND, see app/embeddings.py)
+        self.embedding_backend = backend_from_env(self.embedding_coalescer, lambda: self.client)
+        self.embedding_model = self.embedding_backend.model
+        # Scores differ per backend, so each has its own calibrated default
+        # (0.50 for OpenAI: good citation coverage, tested empirically)
+        threshold = os.getenv("CITATION_THRESHOLD")
+        self.citation_threshold = float(threshold) if threshold else self.embedding_backend.citation_threshold
         
         logger.info(f"Initialized with threshold: {self.citation_threshold}")
     
@@ -46,194 +143,733 @@ class TranscriptProcessor:
             self.api_key = os.getenv("OPENAI_API_KEY")
             if not self.api_key:
                 raise Exception("OpenAI API key not configured")
-            self.client = AsyncOpenAI(api_key=self.api_key)
+            # One shared keep-alive pool for all requests (see app/client.py)
+            self.managed_client = ManagedOpenAIClient.from_env(self.api_key)
+            self.client = self.managed_client.client
             self.openai_configured = True
             logger.info("OpenAI client initialized")
+    
+    async def start(self):
+        """Load the embedding backend, create the client and pre-warm upstream connections"""
+        self.loop_monitor.start()
+        await self.embedding_backend.start()
+        if not os.getenv("OPENAI_API_KEY"):
+            return
+        self._ensure_client()
+        if self.managed_client is not None:
+            await self.managed_client.prewarm()
+    
+    async def close(self):
+        """Release upstream connections and the caches"""
+        if self.managed_client is not None:
+            await self.managed_client.aclose()
+        await self.loop_monitor.stop()
+        self.offload.close()
+        self.embedding_backend.close()
+        self.embedding_cache.close()
+        self.result_cache.close()
+    
+    def pool_stats(self) -> Optional[Dict]:
+        """Upstream connection pool utilization (None before the client exists)"""
+        return self.managed_client.stats() if self.managed_client is not None else None
         
-    async def process_transcript(self, transcript: TranscriptInput) -> SOAPNoteOutput:
+    async def process_transcript(
+        self,
+        transcript: Union[TranscriptInput, TranscriptColumns],
+        cache_mode: str = "use"
+    ) -> SOAPNoteOutput:
         """
-        Main pipeline: transcript -> SOAP note with verified citations
+        Transcript -> SOAP note, served from the result cache when possible
+        
+        Args:
+            transcript: Session transcript
+            cache_mode: "use" (read and write the cache), "refresh" (recompute and
+                overwrite) or "bypass" (neither read nor write)
         
-        Steps:
-        1. Embed all transcript segments
-        2. Generate SOAP note using LLM
-        3. Parse note into individual statements
-        4. For each statement, find supporting segments using embeddings (RAG)
-        5. Verify and score citations
+        Returns:
+            SOAPNoteOutput; metadata["result_cache"] says how it was served
+            (hit, shared, miss, refresh or bypass)
+        """
+        if cache_mode not in ("use", "refresh", "bypass"):
+            raise ValueError(f"Invalid cache mode: {cache_mode}")
+        # Built once here; every stage reads the columns, not the Pydantic segments
+        transcript = TranscriptColumns.from_input(transcript)
+        if cache_mode == "bypass":
+            return self._with_cache_status(await self._process_uncached(transcript), "bypass")
+        
+        key = self._result_cache_key(transcript)
+        while cache_mode == "use":
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                value, stored_at = cached
+                metrics.RESULT_CACHE_LOOKUPS.inc(result="hit")
+                usage_aggregator.record_request()
+                output = SOAPNoteOutput.model_validate_json(value)
+                return self._with_cache_status(output, "hit", transcript.session_id, time.time() - stored_at)
+            pending = self._pending_results.get(key)
+            if pending is None:
+                metrics.RESULT_CACHE_LOOKUPS.inc(result="miss")
+                break
+            # The same transcript is being processed right now (e.g. a client retry)
+            metrics.RESULT_CACHE_LOOKUPS.inc(result="shared")
+            try:
+                output = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The owning request was cancelled (e.g. its client disconnected):
+                # look again, and compute the note here if nobody else is
+                continue
+            return self._with_cache_status(output, "shared", transcript.session_id)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending_results[key] = future
+        try:
+            output = await self._process_uncached(transcript)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Marks the exception retrieved when no other caller was waiting
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(output)
+            self.result_cache.put(key, output.model_dump_json())
+        finally:
+            if self._pending_results.get(key) is future:
+                del self._pending_results[key]
+        return self._with_cache_status(output, "miss" if cache_mode == "use" else "refresh")
+    
+    def _pipeline_config(self) -> Dict:
+        """Every setting that changes the output for a given transcript"""
+        return {
+            "chat_model": self.chat_model,
+            "embedding_model": self.embedding_model,
+            "citation_threshold": self.citation_threshold,
+            "retrieval": self._retrieval_config(),
+            "prompt_version": PROMPT_VERSION,
+            "prompt": self.prompts.config()
+        }
+    
+    def _retrieval_config(self) -> Dict:
+        pruning = {"pruning_min_candidates": self.pruning_min_candidates if self.candidate_pruning else None}
+        if not self.hybrid_retrieval:
+            return {"mode": "dense", **pruning}
+        return {
+            "mode": "hybrid",
+            "rrf_k": self.rrf_k,
+            "lexical_weight": self.lexical_weight,
+            "dense_margin": self.lexical_margin,
+            "min_lexical": self.min_lexical_score,
+            **pruning
+        }
+    
+    def _pipeline_config_key(self) -> str:
+        return json.dumps(self._pipeline_config(), sort_keys=True)
+    
+    def _result_cache_key(self, transcript: TranscriptColumns) -> str:
+        """Hash of the normalized segments plus every setting that changes the output"""
+        return result_cache_key(transcript, **self._pipeline_config())
+    
+    async def process_transcript_incremental(
+        self,
+        transcript: Union[TranscriptInput, TranscriptColumns],
+        segment_embeddings: Optional[np.ndarray] = None
+    ) -> SOAPNoteOutput:
+        """
+        Re-process a corrected or extended transcript, redoing only what changed
+        
+        The session's previous incremental run is diffed against this version
+        (see app/incremental.py); the first version of a session runs in full.
+        The result cache is not used.
+        
+        Args:
+            transcript: Latest version of the session transcript
+            segment_embeddings: Optional precomputed embeddings aligned with
+                the transcript's segments (e.g. from a live session); nothing is re-embedded
+        
+        Returns:
+            SOAPNoteOutput; metadata["incremental"] describes what was redone
         """
-        # Initialize client on first use
         self._ensure_client()
+        transcript = TranscriptColumns.from_input(transcript)
         
-        # Reset token counter for this session
-        self.token_counter.reset()
+        async with self.incremental.lock(transcript.session_id):
+            with request_context(transcript.session_id, self.request_timeout) as ctx, \
+                    metrics.PIPELINES_IN_FLIGHT.track_inprogress():
+                try:
+                    output = await self.incremental.update(transcript, ctx, segment_embeddings)
+                except Exception:
+                    metrics.PIPELINE_ERRORS.inc()
+                    raise
+        usage_aggregator.record_request()
+        self._record_output_metrics(output, ctx)
+        return output
+    
+    def _with_cache_status(
+        self,
+        output: SOAPNoteOutput,
+        status: str,
+        session_id: Optional[str] = None,
+        age_seconds: Optional[float] = None
+    ) -> SOAPNoteOutput:
+        """Copy of output for this request, with metadata["result_cache"] set"""
+        result_cache = {"status": status, "hit": status in ("hit", "shared")}
+        if age_seconds is not None:
+            result_cache["age_seconds"] = round(age_seconds, 1)
+        return output.model_copy(update={
+            "session_id": session_id or output.session_id,
+            "metadata": {**(output.metadata or {}), "result_cache": result_cache}
+        })
+    
+    async def _process_uncached(self, transcript: TranscriptColumns) -> SOAPNoteOutput:
+        """
+        Main pipeline: transcript -> SOAP note with verified citations
         
-        logger.info(f"Step 1: Embedding {len(transcript.segments)} transcript segments...")
-        segment_embeddings = await self._embed_segments(transcript.segments)
+        Stages (run as a dependency graph, independent stages overlap):
+        1. Embed all transcript segments          (independent)
+        2. Generate SOAP note using LLM           (independent)
+        3. Parse note into individual statements  (after 2)
+        4. Embed statements                       (after 3)
+        5. Find supporting segments using embeddings (RAG) and
+           verify/score citations                 (after 1 and 4)
+        """
+        # Initialize client on first use
+        self._ensure_client()
         
-        logger.info("Step 2: Generating SOAP note with LLM...")
-        soap_note = await self._generate_soap_note(transcript)
+        # Usage, timings and retries are tracked per request, never on the shared processor
+        with request_context(transcript.session_id, self.request_timeout) as ctx, \
+                metrics.PIPELINES_IN_FLIGHT.track_inprogress():
+            try:
+                output = await self._run_pipeline(transcript, ctx)
+            except Exception:
+                metrics.PIPELINE_ERRORS.inc()
+                raise
+        usage_aggregator.record_request()
+        self._record_output_metrics(output, ctx)
+        return output
+    
+    def _record_output_metrics(self, output: SOAPNoteOutput, ctx: RequestContext):
+        """Export stage latencies and citation coverage for a finished request"""
+        for stage, ms in ctx.timings.items():
+            if stage == "total":
+                metrics.PIPELINE_LATENCY.observe(ms / 1000)
+            elif stage == "first_span":
+                # A point in time since request start, not a stage duration
+                metrics.FIRST_SPAN_LATENCY.observe(ms / 1000)
+            else:
+                metrics.STAGE_LATENCY.observe(ms / 1000, stage=stage)
         
-        logger.info("Step 3: Parsing SOAP note into statements...")
-        statements = self._parse_soap_note(soap_note)
+        total = len(output.note_spans)
+        flagged = sum(1 for span in output.note_spans if span.needs_confirmation)
+        metrics.NOTE_SPANS.inc(total)
+        metrics.NOTE_SPANS_NEEDS_CONFIRMATION.inc(flagged)
+        if total:
+            metrics.NEEDS_CONFIRMATION_RATIO.observe(flagged / total)
+    
+    async def _run_pipeline(
+        self,
+        transcript: TranscriptColumns,
+        ctx: RequestContext,
+        results_out: Optional[Dict] = None,
+        segment_embeddings: Optional[np.ndarray] = None
+    ) -> SOAPNoteOutput:
+        """
+        Run the stage graph for one transcript inside its request context
         
-        logger.info("Step 4: Extracting citations using RAG approach...")
-        note_spans = await self._extract_citations_rag(
-            statements, 
-            transcript.segments, 
-            segment_embeddings
+        Args:
+            results_out: Optional dict that receives every stage's result
+            segment_embeddings: Optional precomputed segment embeddings (skips embedding)
+        """
+        graph = StageGraph()
+        if segment_embeddings is not None:
+            graph.add("embed_segments", lambda: segment_embeddings)
+        else:
+            graph.add("embed_segments", lambda: self._embed_segments(transcript))
+        graph.add("generate_note", lambda: self._generate_soap_note(transcript))
+        graph.add("parse_note",
+                  lambda generate_note: self.offload.run(
+                      "parse_note", self._parse_soap_note, generate_note, size=len(transcript)
+                  ),
+                  deps=("generate_note",))
+        graph.add("embed_statements", lambda parse_note: self._embed_texts([s['text'] for s in parse_note]),
+                  deps=("parse_note",))
+        graph.add("lexical_index", lambda: self._build_lexical_index(transcript))
+        graph.add("segment_filter", lambda: self._build_segment_filter(transcript))
+        graph.add(
+            "extract_citations",
+            lambda parse_note, embed_statements, embed_segments, lexical_index, segment_filter:
+                self._extract_citations_rag(
+                    parse_note,
+                    transcript,
+                    embed_segments,
+                    embed_statements,
+                    lexical_index=lexical_index,
+                    segment_filter=segment_filter
+                ),
+            deps=("parse_note", "embed_statements", "embed_segments", "lexical_index", "segment_filter")
         )
         
-        logger.info("Step 5: Finalizing output...")
+        logger.info(
+            f"Running pipeline: embedding {len(transcript)} segments "
+            f"while generating SOAP note..."
+        )
+        results, timings = await graph.run()
+        ctx.timings.update(timings)
+        if results_out is not None:
+            results_out.update(results)
+        note_spans = results["extract_citations"]
+        soap_note = results["generate_note"]
         
-        # Get token summary
-        token_summary = self.token_counter.get_summary()
+        # Time saved by overlapping stages vs. running them one after another
+        sequential_ms = sum(ms for name, ms in timings.items() if name != "total")
+        logger.info(f"Pipeline finished in {timings['total']}ms (sequential: {sequential_ms:.2f}ms)")
         
         output = SOAPNoteOutput(
             session_id=transcript.session_id,
             note_spans=note_spans,
             metadata={
-                "total_segments": len(transcript.segments),
+                "total_segments": len(transcript),
                 "total_statements": len(note_spans),
                 "model_used": self.chat_model,
                 "embedding_model": self.embedding_model,
                 "citation_threshold": self.citation_threshold,
-                "token_usage": token_summary
+                "retrieval": self._retrieval_config()["mode"],
+                "citation_mode": self.citation_mode,
+                "citation_sources": dict(ctx.citation_sources),
+                "structured_output": self.prompts.structured,
+                "token_usage": ctx.usage.get_summary(),
+                "embedding_cache": ctx.usage.get_cache_summary(),
+                "timings_ms": ctx.timings,
+                "retries": ctx.retries,
+                "overlap_saved_ms": round(max(sequential_ms - timings["total"], 0.0), 2),
+                "prompt_budget": self._prompt_budget(ctx),
+                "generation_mode": "map_reduce" if "_chunks" in soap_note else "single",
+                "generation_chunks": len(soap_note.get("_chunks", [])) or 1
             }
         )
         
         return output
     
-    async def _embed_segments(self, segments: List[TranscriptSegment]) -> np.ndarray:
+    async def stream_transcript(
+        self,
+        transcript: Union[TranscriptInput, TranscriptColumns]
+    ) -> AsyncIterator[Tuple[str, Dict]]:
         """
-        Embed all transcript segments for semantic search
+        Streaming pipeline: yield each cited note span as soon as it is ready
         
-        Returns:
-            numpy array of shape (n_segments, embedding_dim)
+        The SOAP note is requested as a streaming chat completion. Sentences are
+        split off incrementally as tokens arrive, then embedded and cited in
+        arrival order while generation continues. Segment embedding runs
+        concurrently from the start. Citation numbers stay globally continuous.
+        
+        Yields:
+            ("span", NoteSpan dict) for each statement, then ("done", metadata)
         """
-        texts = [f"{seg.speaker}: {seg.text}" for seg in segments]
+        self._ensure_client()
+        transcript = TranscriptColumns.from_input(transcript)
         
-        try:
-            response = await self.client.embeddings.create(
-                model=self.embedding_model,
-                input=texts
+        with request_context(transcript.session_id, self.request_timeout) as ctx, \
+                metrics.PIPELINES_IN_FLIGHT.track_inprogress():
+            segment_task = asyncio.ensure_future(self._embed_segments(transcript))
+            queue: asyncio.Queue = asyncio.Queue()
+            producer = asyncio.ensure_future(self._stream_statements(transcript, queue))
+            
+            note_spans: List[NoteSpan] = []
+            next_citation = 1
+            lexical_index = await self._build_lexical_index(transcript)
+            segment_filter = self._build_segment_filter(transcript)
+            try:
+                finished = False
+                while not finished:
+                    # Cite everything that has arrived since the last batch together
+                    batch = [await queue.get()]
+                    while not queue.empty():
+                        batch.append(queue.get_nowait())
+                    if batch[-1] is None:
+                        finished = True
+                        batch = batch[:-1]
+                    if not batch:
+                        continue
+                    
+                    statement_embeddings = await self._embed_texts([s['text'] for s in batch])
+                    segment_embeddings = await segment_task
+                    spans = await self._extract_citations_rag(
+                        batch,
+                        transcript,
+                        segment_embeddings,
+                        statement_embeddings,
+                        first_span=len(note_spans),
+                        first_citation=next_citation,
+                        lexical_index=lexical_index,
+                        segment_filter=segment_filter
+                    )
+                    for span in spans:
+                        if not note_spans:
+                            ctx.timings["first_span"] = ctx.elapsed_ms()
+                        note_spans.append(span)
+                        next_citation += len(span.citations)
+                        yield "span", span.model_dump()
+                
+                # Surface generation errors
+                await producer
+                await segment_task
+            except Exception:
+                metrics.PIPELINE_ERRORS.inc()
+                raise
+            finally:
+                for task in (producer, segment_task):
+                    if not task.done():
+                        task.cancel()
+            
+            ctx.timings["total"] = ctx.elapsed_ms()
+            output = SOAPNoteOutput(
+                session_id=transcript.session_id,
+                note_spans=note_spans,
+                metadata={
+                    "total_segments": len(transcript),
+                    "total_statements": len(note_spans),
+                    "model_used": self.chat_model,
+                    "embedding_model": self.embedding_model,
+                    "citation_threshold": self.citation_threshold,
+                    "retrieval": self._retrieval_config()["mode"],
+                    "citation_mode": self.citation_mode,
+                    "citation_sources": dict(ctx.citation_sources),
+                    "structured_output": self.prompts.structured,
+                    "token_usage": ctx.usage.get_summary(),
+                    "embedding_cache": ctx.usage.get_cache_summary(),
+                    "timings_ms": ctx.timings,
+                    "retries": ctx.retries,
+                    "prompt_budget": self._prompt_budget(ctx),
+                    "generation_mode": "stream"
+                }
             )
-            embeddings = np.array([item.embedding for item in response.data])
+        
+        usage_aggregator.record_request()
+        self._record_output_metrics(output, ctx)
+        yield "done", output.metadata
+    
+    async def _stream_statements(self, transcript: TranscriptColumns, queue: asyncio.Queue):
+        """
+        Generate the SOAP note as a stream, putting each finished statement on the queue
+        
+        A None sentinel is always put last. Transcripts over the prompt budget
+        fall back to (non-streaming) map-reduce generation.
+        """
+        try:
+            transcript_text = self._format_transcript_for_llm(transcript)
+            prompt_tokens = calculate_token_estimate(self.prompts.system_prompt + transcript_text)
+            if prompt_tokens > self.max_prompt_tokens and len(transcript) > 1:
+                soap_note = await self._generate_soap_note(transcript)
+                for statement in self._parse_soap_note(soap_note):
+                    queue.put_nowait(statement)
+                return
             
-            # Track token usage
-            if hasattr(response, 'usage') and response.usage:
-                self.token_counter.add_embedding(response.usage.total_tokens)
+            get_context().prompt_budget.update(self.prompts.budget(transcript, transcript_text))
+            prompt = self.prompts.soap(transcript_text)
+            emitted = 0
             
-            logger.info(f"Created embeddings with shape: {embeddings.shape}")
-            return embeddings
+            async def stream_note(timeout):
+                nonlocal emitted
+                stream = await self.client.chat.completions.create(
+                    model=self.chat_model,
+                    messages=[
+                        {"role": "system", "content": prompt.system},
+                        {"role": "user", "content": prompt.user}
+                    ],
+                    response_format=prompt.response_format,
+                    temperature=0.3,  # Lower temperature for consistency
+                    max_tokens=1000,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                )
+                
+                parser = StreamingSOAPParser(source_ids=self.prompts.source_ids)
+                async for chunk in stream:
+                    if getattr(chunk, 'usage', None):
+                        get_context().add_completion(
+                            self.chat_model,
+                            chunk.usage.prompt_tokens,
+                            chunk.usage.completion_tokens,
+                            _cached_tokens(chunk.usage)
+                        )
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        for sentence in parser.feed(chunk.choices[0].delta.content):
+                            queue.put_nowait(_streamed_statement(sentence))
+                            emitted += 1
+                for sentence in parser.close():
+                    queue.put_nowait(_streamed_statement(sentence))
             
-        except Exception as e:
-            logger.error(f"Error creating embeddings: {e}")
-            raise
+            # A stream can only be restarted before any statement was handed out
+            await self.upstream.call("chat_stream", self.chat_model, stream_note, can_retry=lambda: emitted == 0)
+            logger.info("Finished streaming SOAP note")
+        finally:
+            queue.put_nowait(None)
+    
+    async def process_batch(
+        self,
+        transcripts: List[Union[TranscriptInput, TranscriptColumns]],
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Tuple[int, Optional[SOAPNoteOutput], Optional[Exception]]]:
+        """
+        Process many transcripts under a concurrency limit, yielding results as they complete
+        
+        Items run concurrently, so their embedding calls are merged into shared
+        API batches by the embedding coalescer. A failing item does not abort the batch.
+        
+        Yields:
+            Tuples of (input index, output or None, exception or None) in completion order
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)
+        
+        async def run(index: int, transcript: Union[TranscriptInput, TranscriptColumns]):
+            async with semaphore:
+                try:
+                    return index, await self.process_transcript(transcript), None
+                except Exception as e:
+                    logger.error(f"Batch item {index} ({transcript.session_id}) failed: {e}")
+                    return index, None, e
+        
+        tasks = [asyncio.ensure_future(run(i, t)) for i, t in enumerate(transcripts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client went away or caller stopped iterating
+            for task in tasks:
+                task.cancel()
     
-    async def _generate_soap_note(self, transcript: TranscriptInput) -> Dict:
+    async def _embed_segments(self, segments: TranscriptColumns) -> np.ndarray:
+        """
+        Embed all transcript segments for semantic search
+        
+        Returns:
+            numpy array of shape (n_segments, embedding_dim)
+        """
+        names = segments.speaker_names
+        texts = [f"{names[code]}: {text}" for code, text in zip(segments.speakers.tolist(), segments.texts())]
+        embeddings = await self._embed_texts(texts)
+        logger.info(f"Created embeddings with shape: {embeddings.shape}")
+        return embeddings
+    
+    async def _generate_soap_note(self, transcript: TranscriptColumns) -> Dict:
         """
         Generate SOAP note using LLM with structured output
         
+        Transcripts whose estimated prompt size exceeds `max_prompt_tokens` are
+        generated hierarchically (see `_generate_soap_note_chunked`).
+        
         Returns:
             Dict with keys: subjective, objective, assessment, plan
+            (plus `_chunks`/`_sources` in map-reduce mode)
         """
         # Prepare transcript text
-        transcript_text = self._format_transcript_for_llm(transcript.segments)
+        transcript_text = self._format_transcript_for_llm(transcript)
+        get_context().prompt_budget.update(self.prompts.budget(transcript, transcript_text))
         
-        # Create prompt for SOAP note generation
-        system_prompt = """You are an expert clinical documentation assistant specializing in behavioral health.
-Your task is to generate a professional SOAP note from a therapy session transcript.
-
-SOAP Format:
-- Subjective: Patient's reported experiences, feelings, and concerns in their own words
-- Objective: Observable behaviors, affect, and clinical observations
-- Assessment: Clinical interpretation, diagnosis considerations, progress evaluation
-- Plan: Treatment interventions, homework, follow-up items
-
-Guidelines:
-- Be concise and clinically appropriate
-- Use professional clinical language
-- Focus on clinically relevant information
-- Each section should be 2-4 sentences
-- Stick to what's in the transcript - don't infer beyond what's stated
-"""
+        prompt_tokens = calculate_token_estimate(self.prompts.system_prompt + transcript_text)
+        if prompt_tokens > self.max_prompt_tokens and len(transcript) > 1:
+            logger.info(
+                f"Estimated prompt of {prompt_tokens} tokens exceeds {self.max_prompt_tokens}, "
+                f"using map-reduce generation"
+            )
+            return await self._generate_soap_note_chunked(transcript)
         
-        user_prompt = f"""Generate a SOAP note from this therapy session transcript:
-
-{transcript_text}
-
-Return ONLY a valid JSON object with this structure:
-{{
-  "subjective": "...",
-  "objective": "...",
-  "assessment": "...",
-  "plan": "..."
-}}"""
+        soap_note = await self._request_soap_json(*self.prompts.soap(transcript_text))
+        logger.info("Successfully generated SOAP note")
+        return soap_note
+    
+    async def _generate_soap_note_chunked(self, segments: TranscriptColumns) -> Dict:
+        """
+        Map-reduce SOAP generation for transcripts that exceed the context window
         
-        try:
-            # Use JSON mode for structured output
+        1. Split the transcript into time-windowed chunks
+        2. Extract a partial SOAP note per chunk (concurrently)
+        3. Merge the partial notes in a reduce step
+        
+        The chunk segment ranges are kept under `_chunks`, and the chunks each
+        section draws on under `_sources`, so citation search can be limited to them.
+        """
+        chunks = self._plan_chunks(segments)
+        logger.info(f"Generating SOAP note from {len(chunks)} transcript chunks...")
+        
+        async def extract(part: int, start: int, end: int) -> Dict:
+            return await self._request_soap_json(*self.prompts.chunk(
+                self._format_transcript_for_llm(segments, start, end),
+                part=part,
+                total_parts=len(chunks),
+                start=self._format_timestamp(int(segments.start_ms[start])),
+                end=self._format_timestamp(int(segments.end_ms[end - 1]))
+            ))
+        
+        partial_notes = await asyncio.gather(*(
+            extract(part, start, end) for part, (start, end) in enumerate(chunks, start=1)
+        ))
+        
+        partial_text = "\n\n".join(
+            f"Part {part} [{self._format_timestamp(int(segments.start_ms[start]))} - "
+            f"{self._format_timestamp(int(segments.end_ms[end - 1]))}]:\n{json.dumps(note, indent=2)}"
+            for part, ((start, end), note) in enumerate(zip(chunks, partial_notes), start=1)
+        )
+        merged = await self._request_soap_json(*self.prompts.reduce(partial_text))
+        
+        # Keep only valid part numbers; sections without sources search everything
+        raw_sources = merged.pop("sources", None)
+        sources = {}
+        if isinstance(raw_sources, dict):
+            for section, parts in raw_sources.items():
+                if isinstance(parts, list):
+                    valid = sorted({p for p in parts if isinstance(p, int) and 1 <= p <= len(chunks)})
+                    if valid:
+                        sources[section] = valid
+        
+        merged["_chunks"] = [list(chunk) for chunk in chunks]
+        merged["_sources"] = sources
+        logger.info("Successfully generated SOAP note (map-reduce)")
+        return merged
+    
+    def _plan_chunks(self, segments: TranscriptColumns) -> List[Tuple[int, int]]:
+        """
+        Split segments into contiguous time windows that each fit the chunk token budget
+        
+        Returns:
+            List of (start, end) segment index ranges
+        """
+        window_ms = self.chunk_window_minutes * 60 * 1000
+        # Per-segment token estimates of the prompt format, from lengths only
+        line_tokens = (self.prompts.line_chars(segments) // 4).tolist()
+        start_ms = segments.start_ms.tolist()
+        chunks = []
+        start = 0
+        chunk_tokens = 0
+        for i, tokens in enumerate(line_tokens):
+            window_full = start_ms[i] - start_ms[start] >= window_ms
+            if i > start and (window_full or chunk_tokens + tokens > self.chunk_max_tokens):
+                chunks.append((start, i))
+                start = i
+                chunk_tokens = 0
+            chunk_tokens += tokens
+        chunks.append((start, len(segments)))
+        return chunks
+    
+    async def _request_soap_json(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        response_format: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Run one JSON chat completion and parse the result
+        
+        Args:
+            response_format: A strict `json_schema` format (the reply is validated
+                against it) or JSON mode (default)
+        
+        Transient API errors, unparseable JSON and replies not matching the
+        schema are retried by self.upstream.
+        """
+        response_format = response_format or JSON_MODE
+        
+        async def request(timeout) -> Dict:
             response = await self.client.chat.completions.create(
                 model=self.chat_model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
-                response_format={"type": "json_object"},
+                response_format=response_format,
                 temperature=0.3,  # Lower temperature for consistency
-                max_tokens=1000
+                max_tokens=1000,
+                timeout=timeout
             )
             
-            # Track token usage
+            # Track token usage (tokens are spent even if the JSON is invalid)
             if hasattr(response, 'usage') and response.usage:
-                self.token_counter.add_completion(
+                get_context().add_completion(
+                    self.chat_model,
                     response.usage.prompt_tokens,
-                    response.usage.completion_tokens
+                    response.usage.completion_tokens,
+                    _cached_tokens(response.usage)
                 )
             
-            soap_note = json.loads(response.choices[0].message.content)
-            logger.info("Successfully generated SOAP note")
-            return soap_note
-            
+            message = response.choices[0].message
+            if message.content is None:
+                # Structured outputs report a refusal instead of content
+                raise NoteFormatError(f"No content in completion (refusal: {getattr(message, 'refusal', None)})")
+            note = json.loads(message.content)
+            if response_format["type"] == "json_schema":
+                validate_json(note, response_format["json_schema"]["schema"])
+            return note
+        
+        try:
+            return await self.upstream.call(
+                "chat", self.chat_model, request, retry_on=(json.JSONDecodeError, NoteFormatError)
+            )
         except Exception as e:
             logger.error(f"Error generating SOAP note: {e}")
-            # Retry logic
-            if hasattr(self, '_retry_count') and self._retry_count < self.max_retries:
-                self._retry_count += 1
-                logger.info(f"Retrying... ({self._retry_count}/{self.max_retries})")
-                await asyncio.sleep(1)
-                return await self._generate_soap_note(transcript)
-            else:
-                self._retry_count = 0
-                raise
+            raise
     
     def _parse_soap_note(self, soap_note: Dict) -> List[Dict]:
         """
         Parse SOAP note into individual statements
         
         Returns:
-            List of dicts with keys: section, text
+            List of dicts with keys: section, text, candidates
+            (candidates: segment indices to search for citations, None = all)
         """
         statements = []
         
+        # Map-reduce notes record which chunks each section draws on
+        chunks = soap_note.get("_chunks", [])
+        sources = soap_note.get("_sources", {})
+        
         for section in ['subjective', 'objective', 'assessment', 'plan']:
             if section not in soap_note:
                 continue
-                
-            text = soap_note[section]
             
-            # Split into sentences (simple approach - can be improved)
-            sentences = self._split_into_sentences(text)
+            candidates = None
+            if section in sources:
+                candidates = np.concatenate([
+                    np.arange(*chunks[part - 1]) for part in sources[section]
+                ])
             
-            for sentence in sentences:
-                if sentence.strip():
-                    statements.append({
-                        'section': section,
-                        'text': sentence.strip()
-                    })
+            for sentence, source_ids in self._section_sentences(soap_note[section]):
+                statements.append({
+                    'section': section,
+                    'text': sentence,
+                    'candidates': candidates,
+                    'source_ids': source_ids
+                })
         
         logger.info(f"Parsed {len(statements)} statements from SOAP note")
         return statements
     
+    def _section_sentences(self, value) -> List[Tuple[str, Optional[List[str]]]]:
+        """
+        (sentence, source_ids) pairs of one section of a generated note
+        
+        A section is either a list of {"text"[, "source_ids"]} sentence objects
+        (STRUCTURED_OUTPUT or CITATION_MODE=source_ids), taken as is, or prose
+        from a legacy JSON-mode reply, split with `_split_into_sentences`
+        (source_ids None).
+        """
+        if not isinstance(value, list):
+            return [(sentence, None) for sentence in self._split_into_sentences(str(value))]
+        sentences = []
+        for item in value:
+            if isinstance(item, dict):
+                text = str(item.get('text') or "").strip()
+                ids = item.get('source_ids')
+                ids = [i for i in ids if isinstance(i, str)] if isinstance(ids, list) else []
+            else:
+                text, ids = str(item).strip(), []
+            if text:
+                sentences.append((text, ids))
+        return sentences
+    
     def _split_into_sentences(self, text: str) -> List[str]:
         """
         Split text into sentences (simple rule-based approach)
@@ -243,70 +879,172 @@ Return ONLY a valid JSON object with this structure:
         sentences = re.split(r'(?<=[.!?])\s+', text)
         return [s.strip() for s in sentences if s.strip()]
     
+    async def _build_lexical_index(self, segments: TranscriptColumns) -> Optional[BM25Index]:
+        """BM25 index over the segment texts (None when hybrid retrieval is off)"""
+        if not self.hybrid_retrieval:
+            return None
+        start = time.perf_counter()
+        index = await self.offload.run(
+            "lexical_index", BM25Index, segments.texts(), size=len(segments), process_safe=True
+        )
+        ctx = get_context()
+        ctx.timings["lexical_index"] = round(
+            ctx.timings.get("lexical_index", 0.0) + (time.perf_counter() - start) * 1000, 2
+        )
+        return index
+    
+    def _build_segment_filter(self, segments: TranscriptColumns) -> Optional[SegmentFilter]:
+        """Speaker/time index for per-section candidate pruning (None when pruning is off)"""
+        if not self.candidate_pruning:
+            return None
+        return SegmentFilter(segments, min_candidates=self.pruning_min_candidates)
+    
     async def _extract_citations_rag(
         self, 
         statements: List[Dict], 
-        segments: List[TranscriptSegment],
-        segment_embeddings: np.ndarray
+        segments: TranscriptColumns,
+        segment_embeddings: np.ndarray,
+        statement_embeddings: np.ndarray,
+        first_span: int = 0,
+        first_citation: int = 1,
+        span_ids: Optional[List[str]] = None,
+        citation_numbers: Optional[List[Dict[str, int]]] = None,
+        lexical_index: Optional[BM25Index] = None,
+        segment_filter: Optional[SegmentFilter] = None
     ) -> List[NoteSpan]:
         """
         Extract citations using RAG approach with embeddings
         Now includes inline citation numbers WITHIN the sentence text
         
-        For each statement:
-        1. Embed the statement
-        2. Find top-k most similar segments using cosine similarity
-        3. For each citation, find best matching phrase in statement
-        4. Insert citation numbers inline: "text [1] more text [2]"
-        5. Include full transcript text for each citation
+        For each statement (embedded upstream by the embed_statements stage):
+        1. Find top-k most similar segments (one batched cosine top-k search)
+        2. For each citation, find best matching phrase in statement
+        3. Insert citation numbers inline: "text [1] more text [2]"
+        4. Include full transcript text for each citation
+        
+        `first_span`/`first_citation` continue span ids and citation numbers
+        when a note is cited in several batches (streaming). `span_ids` and
+        `citation_numbers` (per statement: segment id -> number to keep) preserve
+        a previous run's numbering; only citations not found there draw new numbers.
+        `lexical_index` is the transcript's BM25 index for hybrid retrieval (built
+        here when hybrid retrieval is on and none is passed). `segment_filter`
+        narrows each statement's candidates to its section's speakers and time
+        window (likewise built here when pruning is on).
+        
+        With CITATION_MODE=source_ids, the segments a statement names in its
+        `source_ids` are verified against their embeddings first; only
+        statements left without a passing claim are searched.
+        
+        Scoring and span building run on the offload pool for large transcripts.
         """
+        if self.hybrid_retrieval and lexical_index is None:
+            lexical_index = await self._build_lexical_index(segments)
+        if self.candidate_pruning and segment_filter is None:
+            segment_filter = self._build_segment_filter(segments)
+        return await self.offload.run(
+            "extract_citations",
+            self._cite_statements,
+            statements,
+            segments,
+            segment_embeddings,
+            statement_embeddings,
+            first_span,
+            first_citation,
+            span_ids,
+            citation_numbers,
+            lexical_index,
+            segment_filter,
+            size=len(segments)
+        )
+    
+    def _cite_statements(
+        self,
+        statements: List[Dict],
+        segments: TranscriptColumns,
+        segment_embeddings: np.ndarray,
+        statement_embeddings: np.ndarray,
+        first_span: int,
+        first_citation: int,
+        span_ids: Optional[List[str]],
+        citation_numbers: Optional[List[Dict[str, int]]],
+        lexical_index: Optional[BM25Index],
+        segment_filter: Optional[SegmentFilter]
+    ) -> List[NoteSpan]:
+        """Synchronous body of `_extract_citations_rag` (may run on a pool thread)"""
         note_spans = []
         
-        # Embed all statements at once for efficiency
-        statement_texts = [s['text'] for s in statements]
-        statement_embeddings = await self._embed_texts(statement_texts)
-        
         # GLOBAL citation counter - continues across all spans
-        global_citation_num = 1
-        
-        # For each statement, find similar segments
-        for idx, (statement, stmt_embedding) in enumerate(zip(statements, statement_embeddings)):
-            # Calculate cosine similarity between statement and all segments
-            similarities = cosine_similarity(
-                stmt_embedding.reshape(1, -1),
-                segment_embeddings
-            )[0]
-            
-            # Get top-k most similar segments
-            top_k = 3  # Consider top 3 segments
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
-            top_scores = similarities[top_indices]
-            
-            # Filter by threshold and collect citations
+        global_citation_num = first_citation
+        
+        ctx = get_context()
+        
+        retrieval_start = time.perf_counter()
+        searched = list(range(len(statements)))
+        if self.citation_mode == "source_ids":
+            # Verify the segments the model named; search only for statements left without support
+            retrieval = verify_claims(
+                segment_embeddings,
+                statement_embeddings,
+                self._claimed_segments(statements, segments, ctx),
+                top_k=self.citation_top_k,
+                threshold=self.citation_threshold
+            )
+            searched = np.flatnonzero(~retrieval.mask.any(axis=1)).tolist()
+            verified = len(statements) - len(searched)
+            ctx.citation_sources["source_ids"] = ctx.citation_sources.get("source_ids", 0) + verified
+            metrics.STATEMENT_CITATIONS.inc(verified, method="source_ids")
+            if searched:
+                fallback = self._search_segments(
+                    [statements[i] for i in searched],
+                    segment_embeddings,
+                    statement_embeddings[searched],
+                    lexical_index,
+                    segment_filter
+                )
+                retrieval.indices[searched] = fallback.indices
+                retrieval.scores[searched] = fallback.scores
+                retrieval.mask[searched] = fallback.mask
+        else:
+            # Score all statements against all segments in one pass
+            retrieval = self._search_segments(
+                statements, segment_embeddings, statement_embeddings, lexical_index, segment_filter
+            )
+        ctx.citation_sources["retrieval"] = ctx.citation_sources.get("retrieval", 0) + len(searched)
+        metrics.STATEMENT_CITATIONS.inc(len(searched), method="retrieval")
+        ctx.timings["retrieval"] = round(
+            ctx.timings.get("retrieval", 0.0) + (time.perf_counter() - retrieval_start) * 1000, 2
+        )
+        inline_seconds = 0.0
+        
+        # Build spans from the compact index/score arrays
+        for idx, statement in enumerate(statements):
             citation_list = []
             max_score = 0.0
             
-            for seg_idx, score in zip(top_indices, top_scores):
-                if score >= self.citation_threshold:
-                    segment = segments[seg_idx]
-                    citation_list.append({
-                        'id': segment.id,
-                        'num': global_citation_num,  # Use global counter
-                        'transcript': segment.text,
-                        'score': float(score)
-                    })
-                    max_score = max(max_score, score)
+            kept_numbers = citation_numbers[idx] if citation_numbers else {}
+            passing = retrieval.mask[idx]
+            for seg_idx, score in zip(retrieval.indices[idx][passing], retrieval.scores[idx][passing]):
+                segment_id = segments.ids[seg_idx]
+                num = kept_numbers.get(segment_id)
+                if num is None:
+                    num = global_citation_num  # Use global counter
                     global_citation_num += 1  # Increment global counter
+                citation_list.append({
+                    'id': segment_id,
+                    'num': num,
+                    'transcript': segments.text_at(seg_idx),
+                    'score': float(score)
+                })
+                max_score = max(max_score, score)
             
-            # Determine if needs confirmation
-            needs_confirmation = len(citation_list) == 0 or max_score < self.citation_threshold
+            # Determine if needs confirmation (lexically rescued citations may score
+            # slightly below the threshold but still count as support)
+            needs_confirmation = len(citation_list) == 0
             
             # Add inline citation numbers within the sentence
-            text_with_citations = await self._insert_inline_citations(
-                statement['text'], 
-                citation_list,
-                segments
-            )
+            inline_start = time.perf_counter()
+            text_with_citations = self._insert_inline_citations(statement['text'], citation_list)
+            inline_seconds += time.perf_counter() - inline_start
             
             # Create Citation objects (without score)
             citations = [
@@ -320,7 +1058,7 @@ Return ONLY a valid JSON object with this structure:
             
             # Create note span
             note_span = NoteSpan(
-                id=f"span_{idx+1:03d}",
+                id=span_ids[idx] if span_ids else f"span_{first_span+idx+1:03d}",
                 section=statement['section'],
                 text=text_with_citations,
                 citations=citations,
@@ -336,14 +1074,65 @@ Return ONLY a valid JSON object with this structure:
                 f"Needs confirmation: {needs_confirmation}"
             )
         
+        ctx.timings["inline_citations"] = round(
+            ctx.timings.get("inline_citations", 0.0) + inline_seconds * 1000, 2
+        )
+        
         return note_spans
     
-    async def _insert_inline_citations(
+    def _search_segments(
+        self,
+        statements: List[Dict],
+        segment_embeddings: np.ndarray,
+        statement_embeddings: np.ndarray,
+        lexical_index: Optional[BM25Index],
+        segment_filter: Optional[SegmentFilter]
+    ) -> RetrievalResult:
+        """Top-k segments per statement (hybrid when a lexical index is given)"""
+        candidates = [s.get('candidates') for s in statements]
+        if segment_filter is not None:
+            candidates = [segment_filter.candidates(s['section'], c) for s, c in zip(statements, candidates)]
+        if lexical_index is not None:
+            return hybrid_search(
+                SegmentIndex(segment_embeddings),
+                lexical_index,
+                statement_embeddings,
+                [s['text'] for s in statements],
+                top_k=self.citation_top_k,
+                threshold=self.citation_threshold,
+                candidates=candidates,
+                rrf_k=self.rrf_k,
+                lexical_weight=self.lexical_weight,
+                dense_margin=self.lexical_margin,
+                min_lexical=self.min_lexical_score
+            )
+        return SegmentIndex(segment_embeddings).search(
+            statement_embeddings,
+            top_k=self.citation_top_k,
+            threshold=self.citation_threshold,
+            candidates=candidates
+        )
+    
+    def _claimed_segments(
         self,
-        text: str,
-        citation_list: List[Dict],
-        segments: List[TranscriptSegment]
-    ) -> str:
+        statements: List[Dict],
+        segments: TranscriptColumns,
+        ctx: RequestContext
+    ) -> List[np.ndarray]:
+        """Per statement, the rows of its valid, distinct source_ids (empty if it named none)"""
+        valid_ids = set(segments.ids)
+        claims = []
+        for statement in statements:
+            source_ids = list(dict.fromkeys(statement.get('source_ids') or []))
+            validated = validate_segment_ids(source_ids, valid_ids)
+            if len(validated) < len(source_ids):
+                ctx.citation_sources["invalid_ids"] = (
+                    ctx.citation_sources.get("invalid_ids", 0) + len(source_ids) - len(validated)
+                )
+            claims.append(np.array([segments.position(i) for i in validated], dtype=np.int64))
+        return claims
+    
+    def _insert_inline_citations(self, text: str, citation_list: List[Dict]) -> str:
         """
         Insert citation numbers inline within the sentence based on semantic relevance
         
@@ -391,30 +1180,72 @@ Return ONLY a valid JSON object with this structure:
 
     
     async def _embed_texts(self, texts: List[str]) -> np.ndarray:
-        """Embed a list of texts"""
-        try:
-            response = await self.client.embeddings.create(
-                model=self.embedding_model,
-                input=texts
-            )
-            embeddings = np.array([item.embedding for item in response.data])
+        """
+        Embed a list of texts, serving repeated texts from the embedding cache
+        
+        Only cache misses are sent to the embedding backend, deduplicated; the
+        OpenAI backend merges them with concurrent requests' misses and splits them
+        into as few requests as the API's limits allow. Backends that are cheaper to
+        run than to look up skip the cache.
+        
+        Returns:
+            float32 numpy array of shape (len(texts), embedding_dim)
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        cacheable = self.embedding_backend.cacheable
+        if cacheable:
+            cached = self.embedding_cache.get_many(self.embedding_model, texts)
+        else:
+            cached = [None] * len(texts)
+        
+        # Deduplicate misses so repeated lines are embedded once
+        miss_positions: Dict[str, List[int]] = {}
+        for i, (text, vector) in enumerate(zip(texts, cached)):
+            if vector is None:
+                miss_positions.setdefault(text, []).append(i)
+        
+        misses = sum(len(positions) for positions in miss_positions.values())
+        ctx = get_context()
+        if cacheable:
+            ctx.add_cache_lookup(len(texts) - misses, misses)
+        
+        if miss_positions:
+            miss_texts = list(miss_positions)
+            try:
+                vectors, tokens = await self.embedding_backend.embed(miss_texts)
+            except Exception as e:
+                logger.error(f"Error embedding texts: {e}")
+                raise
             
-            # Track token usage
-            if hasattr(response, 'usage') and response.usage:
-                self.token_counter.add_embedding(response.usage.total_tokens)
+            # Track token usage (local backends are free)
+            if tokens:
+                ctx.add_embedding(self.embedding_model, tokens)
             
-            return embeddings
-        except Exception as e:
-            logger.error(f"Error embedding texts: {e}")
-            raise
+            if cacheable:
+                self.embedding_cache.put_many(self.embedding_model, miss_texts, vectors)
+            for text, vector in zip(miss_texts, vectors):
+                for i in miss_positions[text]:
+                    cached[i] = vector
+        
+        return np.vstack(cached).astype(np.float32, copy=False)
+    
+    def _format_transcript_for_llm(self, segments: TranscriptColumns, start: int = 0, end: Optional[int] = None) -> str:
+        """Format transcript segments [start, end) into text for the LLM (PROMPT_FORMAT)"""
+        return self.prompts.format_transcript(segments, start, end)
     
-    def _format_transcript_for_llm(self, segments: List[TranscriptSegment]) -> str:
-        """Format transcript segments into readable text for LLM"""
-        lines = []
-        for seg in segments:
-            timestamp = self._format_timestamp(seg.start_ms)
-            lines.append(f"[{timestamp}] {seg.speaker.upper()}: {seg.text}")
-        return "\n".join(lines)
+    def _prompt_budget(self, ctx: RequestContext) -> Dict:
+        """Estimated prompt composition plus the provider-reported prompt and cached tokens"""
+        prompt_tokens = ctx.usage.total_prompt_tokens
+        cached_tokens = ctx.usage.total_cached_prompt_tokens
+        return {
+            "format": self.prompts.transcript_format,
+            **ctx.prompt_budget,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0
+        }
     
     def _format_timestamp(self, ms: int) -> str:
         """Convert milliseconds to MM:SS format"""
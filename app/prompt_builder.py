@@ -0,0 +1,323 @@
+"""
+Prompt assembly with a stable cacheable prefix and a token-lean transcript
+
+`PromptBuilder` assembles the system prompt once per configuration and
+reuses the same string for every call. Each request therefore starts with
+byte-identical bytes, which upstream prompt caching needs to hit. It also
+encodes the transcript in one of two formats (PROMPT_FORMAT):
+
+- full:    one line per segment, "[MM:SS] SPEAKER: text"
+- compact: one line per speaker turn (consecutive segments by the same
+           speaker joined), short speaker codes whose role is spelled out on
+           first use, and a "[MM:SS]" mark only when a new
+           PROMPT_TIMESTAMP_SECONDS window starts
+
+    [00:00] C (clinician): How has your sleep been since our last session?
+    P (patient): I haven't been sleeping well. Work has been really stressful.
+    [01:00] C: Let's try keeping a sleep diary.
+
+With `source_ids` (CITATION_MODE=source_ids) every segment's text is preceded
+by its id, "<seg_001> text", and the model is asked for sentence objects
+naming the ids that support them.
+
+With `structured` (STRUCTURED_OUTPUT, default) every section is requested as
+a list of sentence objects under a strict JSON schema, so statements arrive
+already split; `validate_json` checks a parsed reply against the schema that
+was sent. Without it (models lacking JSON schema support), sections are plain
+strings in JSON mode and the pipeline splits them with its regex.
+
+Both formats only ever change their last line when segments are appended, so
+a growing live session keeps hitting the cached prefix. `budget` estimates
+what the prompt costs, the share that can be cached and what the full
+format would have cost; the pipeline reports it with the provider's
+`cached_tokens` under `metadata.prompt_budget`.
+"""
+
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app.prompts import (
+    COMPACT_TRANSCRIPT_NOTE,
+    EMPTY_SECTION_JSON,
+    EMPTY_SECTION_STRUCTURED,
+    SOAP_CHUNK_USER_PROMPT,
+    SOAP_OUTPUT_FORMAT,
+    SOAP_REDUCE_OUTPUT_FORMAT,
+    SOAP_REDUCE_SENTENCES_OUTPUT_FORMAT,
+    SOAP_REDUCE_SYSTEM_PROMPT,
+    SOAP_REDUCE_USER_PROMPT,
+    SOAP_SECTIONS_USER_PROMPT,
+    SOAP_SENTENCES_OUTPUT_FORMAT,
+    SOAP_SOURCE_IDS_OUTPUT_FORMAT,
+    SOAP_SYSTEM_PROMPT,
+    SOAP_USER_PROMPT,
+    SOURCE_IDS_TRANSCRIPT_NOTE,
+    TRANSCRIPT_HEADER,
+)
+from app.transcript import TranscriptColumns
+from app.utils import calculate_token_estimate
+
+FORMATS = ("compact", "full")
+SECTIONS = ("subjective", "objective", "assessment", "plan")
+JSON_MODE = {"type": "json_object"}
+
+
+class NoteFormatError(ValueError):
+    """A completion that parsed as JSON but does not match the requested schema"""
+
+
+class ChatPrompt(NamedTuple):
+    """Messages and response format of one chat completion"""
+    system: str
+    user: str
+    response_format: Dict
+
+
+def _object_schema(properties: Dict[str, Dict]) -> Dict:
+    # Strict mode: every property required, no others allowed
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def _strings() -> Dict:
+    return {"type": "array", "items": {"type": "string"}}
+
+
+def note_schema(name: str, sections: Sequence[str], source_ids: bool = False, sources: bool = False) -> Dict:
+    """
+    Strict `json_schema` response format: each section a list of sentence objects
+
+    Args:
+        name: Schema name sent to the API
+        sections: Sections the reply must contain
+        source_ids: Sentence objects carry "source_ids" (segment ids)
+        sources: Add the reduce step's "sources" (part numbers per section)
+    """
+    sentence = {"text": {"type": "string"}}
+    if source_ids:
+        sentence["source_ids"] = _strings()
+    properties = {section: {"type": "array", "items": _object_schema(sentence)} for section in sections}
+    if sources:
+        parts = {"type": "array", "items": {"type": "integer"}}
+        properties["sources"] = _object_schema({section: parts for section in SECTIONS})
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": _object_schema(properties)}}
+
+
+def validate_json(value: Any, schema: Dict, path: str = "$"):
+    """
+    Check a parsed reply against the subset of JSON schema used by `note_schema`
+
+    Raises:
+        NoteFormatError: naming the first offending path
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise NoteFormatError(f"{path}: expected an object")
+        for key in schema.get("required", []):
+            if key not in value:
+                raise NoteFormatError(f"{path}: missing {key!r}")
+        for key, item_schema in schema.get("properties", {}).items():
+            if key in value:
+                validate_json(value[key], item_schema, f"{path}.{key}")
+    elif kind == "array":
+        if not isinstance(value, list):
+            raise NoteFormatError(f"{path}: expected an array")
+        for i, item in enumerate(value):
+            validate_json(item, schema.get("items", {}), f"{path}[{i}]")
+    elif kind == "string" and not isinstance(value, str):
+        raise NoteFormatError(f"{path}: expected a string")
+    elif kind == "integer" and (not isinstance(value, int) or isinstance(value, bool)):
+        raise NoteFormatError(f"{path}: expected an integer")
+
+
+def speaker_codes(names: List[str]) -> List[str]:
+    """Short, unique uppercase codes for speaker names (first letter, numbered on clashes)"""
+    codes: List[str] = []
+    for name in names:
+        letters = [c for c in name if c.isalnum()]
+        base = letters[0].upper() if letters else "S"
+        code, n = base, 2
+        while code in codes:
+            code = f"{base}{n}"
+            n += 1
+        codes.append(code)
+    return codes
+
+
+def _timestamp(seconds: int) -> str:
+    return f"[{seconds // 60:02d}:{seconds % 60:02d}]"
+
+
+class PromptBuilder:
+    """Builds chat messages for SOAP generation in the configured transcript format"""
+
+    def __init__(
+        self,
+        transcript_format: str = "compact",
+        timestamp_seconds: int = 60,
+        source_ids: bool = False,
+        structured: bool = True
+    ):
+        """
+        Args:
+            transcript_format: "compact" or "full"
+            timestamp_seconds: Time-mark granularity of the compact format
+            source_ids: Mark segment ids in the transcript and ask for per-sentence source_ids
+            structured: Request sentence lists under a strict JSON schema (else JSON mode)
+        """
+        if transcript_format not in FORMATS:
+            raise ValueError(f"Unknown PROMPT_FORMAT: {transcript_format} (expected one of {', '.join(FORMATS)})")
+        self.transcript_format = transcript_format
+        self.timestamp_seconds = max(timestamp_seconds, 1)
+        self.compact = transcript_format == "compact"
+        self.source_ids = source_ids
+        self.structured = structured
+        if source_ids:
+            output_format = SOURCE_IDS_TRANSCRIPT_NOTE + SOAP_SOURCE_IDS_OUTPUT_FORMAT
+        else:
+            output_format = SOAP_SENTENCES_OUTPUT_FORMAT if structured else SOAP_OUTPUT_FORMAT
+        # Built once: the same strings and schemas are sent with every request
+        # (the response format is part of the provider's cached prefix too)
+        self.system_prompt = SOAP_SYSTEM_PROMPT + (COMPACT_TRANSCRIPT_NOTE if self.compact else "") + output_format
+        self.empty_section = EMPTY_SECTION_STRUCTURED if structured else EMPTY_SECTION_JSON
+        self.reduce_prompt = SOAP_REDUCE_SYSTEM_PROMPT.format(empty_section=self.empty_section) + (
+            SOAP_REDUCE_SENTENCES_OUTPUT_FORMAT if structured else SOAP_REDUCE_OUTPUT_FORMAT
+        )
+        self.note_format = note_schema("soap_note", SECTIONS, source_ids) if structured else JSON_MODE
+        self.reduce_format = note_schema("soap_note_merged", SECTIONS, sources=True) if structured else JSON_MODE
+        self.prefix_tokens = calculate_token_estimate(self.system_prompt + TRANSCRIPT_HEADER)
+
+    @classmethod
+    def from_env(cls, source_ids: bool = False) -> "PromptBuilder":
+        """Create a builder configured from PROMPT_FORMAT, PROMPT_TIMESTAMP_SECONDS and STRUCTURED_OUTPUT"""
+        return cls(
+            transcript_format=os.getenv("PROMPT_FORMAT", "compact").lower(),
+            timestamp_seconds=int(os.getenv("PROMPT_TIMESTAMP_SECONDS", "60")),
+            source_ids=source_ids,
+            structured=os.getenv("STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+        )
+
+    def config(self) -> Dict:
+        """Settings that change the prompt (part of the result cache key)"""
+        return {
+            "format": self.transcript_format,
+            "timestamp_seconds": self.timestamp_seconds if self.compact else None,
+            "source_ids": self.source_ids,
+            "structured": self.structured
+        }
+
+    def format_transcript(self, segments: TranscriptColumns, start: int = 0, end: Optional[int] = None) -> str:
+        """Encode segments [start, end) for the prompt"""
+        end = len(segments) if end is None else end
+        seconds = (segments.start_ms[start:end] // 1000).tolist()
+        codes = segments.speakers[start:end].tolist()
+        texts = segments.texts(start, end)
+        if self.source_ids:
+            texts = [f"<{segment_id}> {text}" for segment_id, text in zip(segments.ids[start:end], texts)]
+        if not self.compact:
+            speakers = [name.upper() for name in segments.speaker_names]
+            return "\n".join(
+                f"{_timestamp(s)} {speakers[code]}: {text}" for s, code, text in zip(seconds, codes, texts)
+            )
+
+        labels = speaker_codes(segments.speaker_names)
+        introduced = set()
+        lines: List[str] = []
+        turn: List[str] = []
+        previous_code = previous_window = None
+        for s, code, text in zip(seconds, codes, texts):
+            window = s // self.timestamp_seconds
+            if code != previous_code or window != previous_window:
+                if turn:
+                    lines.append(" ".join(turn))
+                mark = f"{_timestamp(window * self.timestamp_seconds)} " if window != previous_window else ""
+                label = labels[code]
+                if code not in introduced:
+                    # Inline instead of a legend line, so new speakers only append
+                    label = f"{label} ({segments.speaker_names[code]})"
+                    introduced.add(code)
+                turn = [f"{mark}{label}: {text}"]
+                previous_code, previous_window = code, window
+            else:
+                turn.append(text)
+        if turn:
+            lines.append(" ".join(turn))
+        return "\n".join(lines)
+
+    def line_chars(self, segments: TranscriptColumns, full: Optional[bool] = None) -> np.ndarray:
+        """
+        Estimated prompt characters per segment, from lengths only (no formatting)
+
+        Args:
+            full: Estimate the full format regardless of configuration (default: configured format)
+        """
+        text_chars = np.diff(segments.text_offsets)
+        if self.source_ids:
+            # "<seg_001> " before every segment's text
+            text_chars = text_chars + 3 + np.fromiter(map(len, segments.ids), dtype=np.int64, count=len(segments))
+        if full or (full is None and not self.compact):
+            # "[00:00] SPEAKER: text\n"
+            speaker_chars = np.array([len(name) for name in segments.speaker_names], dtype=np.int64)
+            return 11 + speaker_chars[segments.speakers] + text_chars
+        # New turn: "\nC: " (plus "[00:00] " in a new window); same turn: " ".
+        # The role in parentheses on a speaker's first turn is not counted.
+        code_chars = np.array([len(code) for code in speaker_codes(segments.speaker_names)], dtype=np.int64)
+        windows = segments.start_ms // 1000 // self.timestamp_seconds
+        new_turn = np.ones(len(segments), dtype=bool)
+        new_window = np.ones(len(segments), dtype=bool)
+        if len(segments) > 1:
+            new_window[1:] = windows[1:] != windows[:-1]
+            new_turn[1:] = (segments.speakers[1:] != segments.speakers[:-1]) | new_window[1:]
+        return text_chars + 1 + new_turn * (code_chars[segments.speakers] + 2) + new_window * 8
+
+    def soap(self, transcript_text: str) -> ChatPrompt:
+        """Prompt for a whole-session note"""
+        user = SOAP_USER_PROMPT.format(transcript_text=transcript_text)
+        return ChatPrompt(self.system_prompt, user, self.note_format)
+
+    def chunk(self, transcript_text: str, part: int, total_parts: int, start: str, end: str) -> ChatPrompt:
+        """Prompt for one map-reduce excerpt"""
+        return ChatPrompt(self.system_prompt, SOAP_CHUNK_USER_PROMPT.format(
+            transcript_text=transcript_text, part=part, total_parts=total_parts, start=start, end=end,
+            empty_section=self.empty_section
+        ), self.note_format)
+
+    def sections(self, transcript_text: str, current_note: str, sections: List[str]) -> ChatPrompt:
+        """
+        Prompt rewriting some sections of an existing note
+
+        The reply uses the full-note format (the model copies the other
+        sections), so the response format is the same as for every other call.
+        """
+        return ChatPrompt(self.system_prompt, SOAP_SECTIONS_USER_PROMPT.format(
+            transcript_text=transcript_text, current_note=current_note, sections=", ".join(sections),
+            empty_section=self.empty_section
+        ), self.note_format)
+
+    def reduce(self, partial_notes: str) -> ChatPrompt:
+        """Prompt merging map-reduce partial notes"""
+        user = SOAP_REDUCE_USER_PROMPT.format(partial_notes=partial_notes)
+        return ChatPrompt(self.reduce_prompt, user, self.reduce_format)
+
+    def budget(self, segments: TranscriptColumns, transcript_text: str) -> Dict[str, int]:
+        """
+        Estimated prompt tokens of a whole-session note request
+
+        Returns:
+            Dict with prefix_tokens (cacheable static prefix), transcript_tokens,
+            full_format_tokens (the same transcript in the full format) and
+            saved_tokens (full minus configured format)
+        """
+        transcript_tokens = calculate_token_estimate(transcript_text)
+        if self.compact:
+            full_tokens = int(self.line_chars(segments, full=True).sum()) // 4
+        else:
+            full_tokens = transcript_tokens
+        return {
+            "prefix_tokens": self.prefix_tokens,
+            "transcript_tokens": transcript_tokens,
+            "full_format_tokens": full_tokens,
+            "saved_tokens": max(full_tokens - transcript_tokens, 0)
+        }
@@ -0,0 +1,141 @@
+"""
+Prompt templates for SOAP note generation
+
+Every request's messages start with a byte-identical prefix: the system prompt
+(fixed per transcript format) and the user message's "Therapy session
+transcript" header. The transcript follows, then the per-call instructions,
+so upstream prompt caching can reuse everything up to the first changed
+transcript line, e.g. across incremental updates of a growing session.
+Messages are assembled by app/prompt_builder.py.
+"""
+
+# Part of the result cache key: bump whenever a template below changes
+PROMPT_VERSION = "6"
+
+SOAP_SYSTEM_PROMPT = """You are an expert clinical documentation assistant specializing in behavioral health.
+Your task is to generate a professional SOAP note from a therapy session transcript.
+
+SOAP Format:
+- Subjective: Patient's reported experiences, feelings, and concerns in their own words
+- Objective: Observable behaviors, affect, and clinical observations
+- Assessment: Clinical interpretation, diagnosis considerations, progress evaluation
+- Plan: Treatment interventions, homework, follow-up items
+
+Guidelines:
+- Be concise and clinically appropriate
+- Use professional clinical language
+- Focus on clinically relevant information
+- Each section should be 2-4 sentences
+- Stick to what's in the transcript - don't infer beyond what's stated
+"""
+
+# Appended to the system prompt for PROMPT_FORMAT=compact
+COMPACT_TRANSCRIPT_NOTE = """
+Transcript format:
+- Speakers are written as short codes; the first line of each speaker gives their role in parentheses
+- Each line is one speaker turn; consecutive segments by the same speaker are joined
+- A [MM:SS] time mark starts a line whenever the session enters a new time window
+"""
+
+# STRUCTURED_OUTPUT=false (models without JSON schema support): one string per section
+SOAP_OUTPUT_FORMAT = """
+Return ONLY a valid JSON object with this structure:
+{
+  "subjective": "...",
+  "objective": "...",
+  "assessment": "...",
+  "plan": "..."
+}"""
+
+# STRUCTURED_OUTPUT=true: every section is a list of complete sentences
+SOAP_SENTENCES_OUTPUT_FORMAT = """
+Return ONLY a valid JSON object with this structure, where each section is a list of its sentences
+(one complete sentence per item; abbreviations such as "Dr." or "e.g." do not end a sentence):
+{
+  "subjective": [{"text": "..."}],
+  "objective": [{"text": "..."}],
+  "assessment": [{"text": "..."}],
+  "plan": [{"text": "..."}]
+}"""
+
+# CITATION_MODE=source_ids: sentences name the segments that support them
+SOURCE_IDS_TRANSCRIPT_NOTE = """
+Each transcript segment starts with its id in angle brackets, e.g. <seg_001>.
+"""
+
+SOAP_SOURCE_IDS_OUTPUT_FORMAT = """
+Return ONLY a valid JSON object with this structure, where each section is a list of sentences and
+"source_ids" lists the ids of the transcript segments that support the sentence (empty if none does):
+{
+  "subjective": [{"text": "...", "source_ids": ["seg_001"]}],
+  "objective": [{"text": "...", "source_ids": ["seg_002", "seg_003"]}],
+  "assessment": [{"text": "...", "source_ids": []}],
+  "plan": [{"text": "...", "source_ids": ["seg_004"]}]
+}"""
+
+# How a section without content is written, filled into {empty_section} below:
+# the strict schema only allows a (possibly empty) sentence list
+EMPTY_SECTION_STRUCTURED = "an empty list"
+EMPTY_SECTION_JSON = "an empty string"
+
+# Everything before {transcript_text} is shared by all user prompts below
+TRANSCRIPT_HEADER = "Therapy session transcript:\n\n"
+
+SOAP_USER_PROMPT = TRANSCRIPT_HEADER + """{transcript_text}
+
+Generate the SOAP note for this session."""
+
+# Incremental update: rewrite only the sections whose source material changed
+SOAP_SECTIONS_USER_PROMPT = TRANSCRIPT_HEADER + """{transcript_text}
+
+The transcript has since been corrected or extended. This SOAP note was written from an earlier version of it:
+
+{current_note}
+
+Rewrite only these sections so they match the transcript above: {sections}.
+Keep sentences that are still accurate word for word, and use {empty_section} for a section with no content.
+Return the complete note in the format above, copying the other sections unchanged."""
+
+# Map step: one excerpt of a long session
+SOAP_CHUNK_USER_PROMPT = TRANSCRIPT_HEADER + """{transcript_text}
+
+This is part {part} of {total_parts} of a long session ({start} - {end}).
+Extract SOAP note content supported by this part only (use {empty_section} for sections with no content in this part)."""
+
+# Reduce step: merge the per-part notes into one note
+SOAP_REDUCE_SYSTEM_PROMPT = """You are an expert clinical documentation assistant specializing in behavioral health.
+You are given partial SOAP notes, each written from one consecutive part of the same therapy session.
+Merge them into a single professional SOAP note for the whole session.
+
+Guidelines:
+- Remove repetition across parts and keep the most clinically relevant information
+- Keep the chronology of the session where it matters (e.g. plan items agreed at the end)
+- Each section should be 2-6 sentences
+- Do not add information that is not in the partial notes
+- Use {empty_section} for a section none of the partial notes has content for
+"""
+
+SOAP_REDUCE_OUTPUT_FORMAT = """
+Return ONLY a valid JSON object with this structure, where "sources" lists the part numbers each section draws on:
+{
+  "subjective": "...",
+  "objective": "...",
+  "assessment": "...",
+  "plan": "...",
+  "sources": {"subjective": [1], "objective": [1], "assessment": [1], "plan": [1]}
+}"""
+
+SOAP_REDUCE_SENTENCES_OUTPUT_FORMAT = """
+Return ONLY a valid JSON object with this structure, where each section is a list of its sentences
+and "sources" lists the part numbers each section draws on:
+{
+  "subjective": [{"text": "..."}],
+  "objective": [{"text": "..."}],
+  "assessment": [{"text": "..."}],
+  "plan": [{"text": "..."}],
+  "sources": {"subjective": [1], "objective": [1], "assessment": [1], "plan": [1]}
+}"""
+
+SOAP_REDUCE_USER_PROMPT = """Partial SOAP notes:
+
+{partial_notes}"""
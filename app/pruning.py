@@ -0,0 +1,112 @@
+"""
+Speaker- and time-aware candidate pruning for citation retrieval
+
+SOAP sections have strong priors about where their evidence is: the
+subjective section restates what the patient said, the plan what the
+clinician proposed towards the end of the session. `SegmentFilter` reads the
+speaker and start/end columns of a transcript (app/transcript.py) once, then
+hands each section the segment indices matching its prior, so retrieval scores
+fewer segments and cannot cite, say, a clinician question for a patient report.
+
+A section whose prior leaves fewer than `min_candidates` segments falls back to
+the full set (or to the map-reduce chunk candidates it was given), so pruning
+never leaves a statement without anything to cite.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from app.transcript import TranscriptColumns
+
+
+@dataclass(frozen=True)
+class SectionPrior:
+    """Segments a section draws its evidence from"""
+    speakers: Optional[Tuple[str, ...]] = None  # lowercased speaker roles, None = any
+    start: float = 0.0  # window as fractions of the session's duration
+    end: float = 1.0
+
+
+DEFAULT_PRIORS: Dict[str, SectionPrior] = {
+    "subjective": SectionPrior(speakers=("patient", "client")),
+    "objective": SectionPrior(),
+    "assessment": SectionPrior(),
+    # The last 60% of the session, so plans discussed mid-session still qualify
+    "plan": SectionPrior(speakers=("clinician", "therapist"), start=0.4),
+}
+
+
+class SegmentFilter:
+    """Per-transcript speaker and time index producing candidate sets per section"""
+
+    def __init__(
+        self,
+        segments: TranscriptColumns,
+        priors: Optional[Dict[str, SectionPrior]] = None,
+        min_candidates: int = 8
+    ):
+        """
+        Args:
+            segments: Transcript segments (indices refer to this order)
+            priors: Section name -> SectionPrior (default DEFAULT_PRIORS)
+            min_candidates: Fewer matching segments than this disables pruning
+                for the section
+        """
+        self.priors = DEFAULT_PRIORS if priors is None else priors
+        self.min_candidates = min_candidates
+        self.segments = segments
+        self._sections: Dict[str, Optional[np.ndarray]] = {}
+        # (section, id(chunk candidates)) -> (chunk candidates, result); the
+        # reference keeps the id valid and equal inputs give the same array
+        # object, so SegmentIndex.search still scores a section in one matmul
+        self._intersections: Dict[Tuple[str, int], Tuple[np.ndarray, Optional[np.ndarray]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def section_candidates(self, section: str) -> Optional[np.ndarray]:
+        """Segment indices matching the section's prior (None = all segments)"""
+        if section not in self._sections:
+            self._sections[section] = self._select(self.priors.get(section))
+        return self._sections[section]
+
+    def _select(self, prior: Optional[SectionPrior]) -> Optional[np.ndarray]:
+        if prior is None or len(self) == 0:
+            return None
+        segments = self.segments
+        keep = np.ones(len(self), dtype=bool)
+        if prior.speakers is not None:
+            keep &= np.isin(segments.speakers, segments.speaker_codes(prior.speakers))
+        if prior.start > 0.0 or prior.end < 1.0:
+            first, last = int(segments.start_ms.min()), int(segments.end_ms.max())
+            window_start = first + prior.start * (last - first)
+            window_end = first + prior.end * (last - first)
+            # Segments overlapping the window
+            keep &= (segments.end_ms >= window_start) & (segments.start_ms <= window_end)
+        if keep.all() or keep.sum() < self.min_candidates:
+            return None
+        return np.flatnonzero(keep)
+
+    def candidates(self, section: str, within: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        Candidate segment indices for one statement
+
+        Args:
+            section: SOAP section of the statement
+            within: Candidates it is already restricted to (map-reduce chunks), or None
+
+        Returns:
+            Sorted segment indices, or None for all segments
+        """
+        pruned = self.section_candidates(section)
+        if pruned is None or within is None or len(within) == 0:
+            return within if pruned is None else pruned
+        key = (section, id(within))
+        cached = self._intersections.get(key)
+        if cached is None or cached[0] is not within:
+            both = np.intersect1d(within, pruned)
+            cached = (within, both if len(both) >= self.min_candidates else within)
+            self._intersections[key] = cached
+        return cached[1]
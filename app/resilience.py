@@ -0,0 +1,308 @@
+"""
+Retries, deadlines and circuit breaking for upstream API calls
+
+Every OpenAI request goes through UpstreamCaller.call, which:
+- retries transient failures (429, 5xx, timeouts, connection errors) with
+  full-jitter exponential backoff, waiting at least as long as `Retry-After`
+- never waits or runs past the request's deadline (RequestContext.deadline)
+- fails fast while the circuit breaker for a model is open
+- only retries while the process-wide retry budget allows, so retries cannot
+  multiply load on an upstream that is already overloaded
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import openai
+
+from app import metrics
+from app.context import get_context
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailableError(Exception):
+    """Upstream call refused or abandoned without (another) attempt"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """The circuit breaker is open; upstream is failing"""
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    """The request's deadline does not leave time for another attempt"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transient upstream failures worth retrying"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, asyncio.TimeoutError)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-requested wait from `retry-after-ms` / `retry-after` headers"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form is not used by the OpenAI API
+        return None
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """Full-jitter exponential backoff"""
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    multiplier: float = 2.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number `attempt` (1-based)"""
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryBudget:
+    """
+    Retries allowed as a share of recent requests
+
+    Over a sliding window, retries may not exceed `min_retries` plus `ratio`
+    times the number of first attempts, so a failing upstream sees at most
+    (1 + ratio) times the normal load instead of max_attempts times.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] >= self.window_seconds:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._requests.append(now)
+
+    def try_acquire(self) -> bool:
+        """Reserve one retry if the budget allows it"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    closed -> open after `failure_threshold` consecutive failures; open rejects
+    calls for `reset_seconds`, then half-open lets one trial call through:
+    success closes the circuit, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may proceed"""
+        if self.state == self.OPEN:
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(f"Circuit open for {self.name}", retry_after=remaining)
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                raise CircuitOpenError(f"Circuit half-open for {self.name}", retry_after=1.0)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release(self):
+        """Finish a call that neither succeeded nor failed upstream (e.g. cancelled)"""
+        self._trial_in_flight = False
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.UPSTREAM_CIRCUIT_OPEN.set(1 if state == self.OPEN else 0, model=self.name)
+
+
+class UpstreamCaller:
+    """Run upstream calls with retry, deadline, circuit breaker and retry budget"""
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        budget: Optional[RetryBudget] = None,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0
+    ):
+        self.policy = policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_env(cls) -> "UpstreamCaller":
+        """Create a caller configured from environment variables"""
+        return cls(
+            policy=RetryPolicy(
+                max_attempts=int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "4")),
+                base_delay=float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5")),
+                max_delay=float(os.getenv("UPSTREAM_BACKOFF_MAX", "20"))
+            ),
+            budget=RetryBudget(
+                ratio=float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.2")),
+                min_retries=int(os.getenv("UPSTREAM_RETRY_BUDGET_MIN", "10"))
+            ),
+            failure_threshold=int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5")),
+            reset_seconds=float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+        )
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model, self.failure_threshold, self.reset_seconds)
+        return self._breakers[model]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Circuit state per model (for /health)"""
+        return {
+            name: {"state": breaker.state, "consecutive_failures": breaker.failures}
+            for name, breaker in self._breakers.items()
+        }
+
+    async def call(
+        self,
+        operation: str,
+        model: str,
+        func: Callable[..., Awaitable[T]],
+        retry_on: Tuple[type, ...] = (),
+        can_retry: Optional[Callable[[], bool]] = None
+    ) -> T:
+        """
+        Call `func(timeout)` until it succeeds or retrying is not allowed
+
+        Args:
+            operation: Metrics label ("chat", "chat_stream", "embeddings")
+            model: Model name (one circuit breaker per model)
+            func: Coroutine function taking the per-attempt timeout in seconds
+                (openai.NOT_GIVEN without a deadline, keeping the client's default)
+            retry_on: Extra exception types to retry (not counted as upstream failures)
+            can_retry: Optional check after a failure, e.g. False once a stream has emitted output
+
+        Returns:
+            Result of the first successful attempt
+        """
+        ctx = get_context()
+        breaker = self.breaker(model)
+        self.budget.record_request()
+        attempt = 1
+
+        while True:
+            remaining = ctx.remaining_seconds()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededError(f"Deadline exceeded before {operation} call")
+            breaker.before_call()
+
+            call_start = time.perf_counter()
+            try:
+                result = await func(openai.NOT_GIVEN if remaining is None else remaining)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                upstream_failure = is_retryable(e)
+                retryable = upstream_failure or isinstance(e, retry_on)
+                metrics.observe_upstream_call(model, operation, time.perf_counter() - call_start, error=True)
+                if upstream_failure:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+
+                if not retryable or attempt >= self.policy.max_attempts:
+                    raise
+                if can_retry is not None and not can_retry():
+                    raise
+                delay = self.policy.delay(attempt, retry_after_seconds(e))
+                remaining = ctx.remaining_seconds()
+                if remaining is not None and delay >= remaining:
+                    logger.warning(f"{operation} failed ({e}); no time left before the deadline to retry")
+                    raise
+                if not self.budget.try_acquire():
+                    logger.warning(f"{operation} failed ({e}); retry budget exhausted")
+                    metrics.UPSTREAM_RETRY_BUDGET_EXHAUSTED.inc(model=model, operation=operation)
+                    raise
+
+                ctx.record_retry(operation, model)
+                logger.info(
+                    f"{operation} attempt {attempt}/{self.policy.max_attempts} failed: {e}. "
+                    f"Retrying in {delay:.2f}s..."
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            metrics.observe_upstream_call(model, operation, time.perf_counter() - call_start)
+            breaker.record_success()
+            return result
@@ -0,0 +1,435 @@
+"""
+Vectorized top-k retrieval of transcript segments for note statements
+
+The segment matrix is L2-normalized once (float32). All statements are scored
+with a single matrix multiply, top-k is selected with argpartition and the
+citation threshold is applied as a vectorized mask.
+
+Hybrid retrieval adds a per-transcript BM25 index over the segment text, so
+exact terms the embedding under-weights (medication names, numbers, quoted
+phrases) still surface. Dense and lexical rankings are merged with reciprocal
+rank fusion (see `hybrid_search`).
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Words in nearly every statement or segment carry no matching signal
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be been being but by can could did do does doing
+don't for from had has have having he her here hers him his how i i'd i'll i'm i've if in into is it
+it's its just me more most my no not now of off on once only or other our out over own really said
+same say says she should so some such than that that's the their them then there these they this
+those through to too um uh up very was we well were what when where which while who why will with
+would yeah you your okay ok like know think going get got
+patient clinician therapist client reports reported states stated describes described
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_SUFFIXES = ("ingly", "edly", "ing", "ies", "ied", "ed", "es", "ly", "s")
+
+
+def _stem(token: str) -> str:
+    """Strip one common English suffix (keeps a stem of at least 3 characters)"""
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed content words of a text (numbers are kept)"""
+    return [_stem(t) for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def lexical_terms(text: str) -> List[str]:
+    """Tokens plus adjacent-token bigrams, so multi-word phrases match as a unit"""
+    tokens = tokenize(text)
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row as float32 (all-zero rows stay zero)
+
+    Args:
+        matrix: Array of shape (n, dim)
+
+    Returns:
+        float32 array of shape (n, dim) whose rows have unit length
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+@dataclass
+class RetrievalResult:
+    """
+    Compact top-k retrieval output, one row per statement
+
+    Dense results (`SegmentIndex.search`, `verify_claims`) sort each row by
+    descending cosine score, and `mask` marks scores >= threshold.
+    `hybrid_search` orders rows by fused RRF rank instead, so scores need not
+    descend, and its mask also passes strong lexical matches within the dense
+    margin of the threshold. Rows with fewer than k entries are padded with
+    index -1, score -inf and a False mask.
+    """
+    indices: np.ndarray  # (n_statements, k) int64 segment indices, best first (by cosine or fused rank)
+    scores: np.ndarray   # (n_statements, k) float32 cosine similarities (-inf for padding)
+    mask: np.ndarray     # (n_statements, k) bool, entries that pass as citations
+
+    @property
+    def best_scores(self) -> np.ndarray:
+        """Highest cosine similarity per statement in either ordering (0.0 when there are no segments)"""
+        if self.scores.shape[1] == 0:
+            return np.zeros(self.scores.shape[0], dtype=np.float32)
+        return self.scores.max(axis=1)
+
+
+class SegmentIndex:
+    """Pre-normalized segment embedding matrix for cosine top-k search"""
+
+    def __init__(self, segment_embeddings: np.ndarray):
+        self.matrix = normalize_rows(segment_embeddings)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 3,
+        threshold: float = 0.5,
+        candidates: Optional[List[Optional[np.ndarray]]] = None
+    ) -> RetrievalResult:
+        """
+        Find the top-k most similar segments for every query at once
+
+        Args:
+            query_embeddings: Array of shape (n_queries, dim)
+            top_k: Number of segments to return per query
+            threshold: Minimum cosine similarity for a match to count
+            candidates: Optional per-query arrays of segment indices to restrict the
+                search to (None = all segments). Queries sharing the same array
+                object are scored together in one matrix multiply.
+
+        Returns:
+            RetrievalResult with (n_queries, min(top_k, n_segments)) arrays. Rows
+            restricted to fewer than k candidates are padded with index -1 and a
+            False mask.
+        """
+        n_queries = len(query_embeddings)
+        k = min(top_k, len(self))
+        if n_queries == 0 or k == 0:
+            empty = np.zeros((n_queries, k))
+            return RetrievalResult(
+                indices=empty.astype(np.int64),
+                scores=empty.astype(np.float32),
+                mask=empty.astype(bool)
+            )
+
+        queries = normalize_rows(query_embeddings)
+        if candidates is None or all(c is None or len(c) == 0 for c in candidates):
+            return top_k_rows(queries @ self.matrix.T, k, threshold)
+
+        indices = np.full((n_queries, k), -1, dtype=np.int64)
+        scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        mask = np.zeros((n_queries, k), dtype=bool)
+
+        for cand, rows in _group_candidates(candidates):
+            sub_matrix = self.matrix if cand is None else self.matrix[cand]
+            group_k = min(k, sub_matrix.shape[0])
+            group = top_k_rows(queries[rows] @ sub_matrix.T, group_k, threshold)
+            group_indices = group.indices if cand is None else np.asarray(cand)[group.indices]
+            indices[rows, :group_k] = group_indices
+            scores[rows, :group_k] = group.scores
+            mask[rows, :group_k] = group.mask
+
+        return RetrievalResult(indices=indices, scores=scores, mask=mask)
+
+
+def _group_candidates(candidates: List[Optional[np.ndarray]]) -> List[Tuple[Optional[np.ndarray], List[int]]]:
+    """Group query rows by candidate array (None or empty = all segments) so each group is one matmul"""
+    groups: Dict[int, Tuple[Optional[np.ndarray], List[int]]] = {}
+    for row, cand in enumerate(candidates):
+        if cand is not None and len(cand) == 0:
+            cand = None
+        key = id(cand) if cand is not None else 0
+        groups.setdefault(key, (cand, []))[1].append(row)
+    return list(groups.values())
+
+
+def top_k_rows(scores: np.ndarray, k: int, threshold: float) -> RetrievalResult:
+    """
+    Select the k highest entries of every row of a score matrix
+
+    Args:
+        scores: Array of shape (n_queries, n_candidates)
+        k: Number of entries per row (must be <= n_candidates)
+        threshold: Minimum score for the mask
+
+    Returns:
+        RetrievalResult with column indices into `scores`
+    """
+    if k < scores.shape[1]:
+        # O(n) partial selection, then sort only the k survivors
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    indices = np.take_along_axis(top, order, axis=1).astype(np.int64)
+    top_scores = np.take_along_axis(top_scores, order, axis=1).astype(np.float32)
+
+    return RetrievalResult(indices=indices, scores=top_scores, mask=top_scores >= threshold)
+
+
+def verify_claims(
+    segment_embeddings: np.ndarray,
+    query_embeddings: np.ndarray,
+    claims: List[np.ndarray],
+    top_k: int = 3,
+    threshold: float = 0.5
+) -> RetrievalResult:
+    """
+    Score each query against only the segments it claims as sources
+
+    Used for segment ids named by the model: every (query, claimed segment)
+    pair is scored with one row-wise dot product, without searching the
+    transcript.
+
+    Args:
+        segment_embeddings: Array of shape (n_segments, dim)
+        query_embeddings: Array of shape (n_queries, dim)
+        claims: Per query, an array of claimed segment indices (may be empty)
+        top_k: Number of segments to return per query
+        threshold: Minimum cosine similarity for a claim to count
+
+    Returns:
+        RetrievalResult with (n_queries, min(top_k, n_segments)) arrays; rows
+        with fewer than k claims are padded with index -1 and a False mask
+    """
+    n_queries = len(claims)
+    k = min(top_k, len(segment_embeddings))
+    indices = np.full((n_queries, k), -1, dtype=np.int64)
+    scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    lengths = np.array([len(c) for c in claims], dtype=np.int64)
+    if k == 0 or not lengths.sum():
+        return RetrievalResult(indices=indices, scores=scores, mask=np.zeros((n_queries, k), dtype=bool))
+
+    query_rows = np.repeat(np.arange(n_queries), lengths)
+    segment_rows = np.concatenate([np.asarray(c, dtype=np.int64) for c in claims])
+    pair_scores = np.einsum(
+        "ij,ij->i",
+        normalize_rows(query_embeddings[query_rows]),
+        normalize_rows(segment_embeddings[segment_rows])
+    )
+
+    # Best claims first within each query, then keep the first k of each
+    order = np.lexsort((-pair_scores, query_rows))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    rank = np.arange(len(order)) - np.repeat(starts, lengths)
+    keep = rank < k
+    rows, columns = query_rows[order][keep], rank[keep]
+    indices[rows, columns] = segment_rows[order][keep]
+    scores[rows, columns] = pair_scores[order][keep]
+    return RetrievalResult(indices=indices, scores=scores, mask=scores >= threshold)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over segment texts, stored as postings with precomputed weights
+
+    Each posting holds the full BM25 contribution of a (term, segment) pair, so
+    scoring a query is one scatter-add per distinct query term.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            texts: One text per segment
+            k1: Term-frequency saturation
+            b: Document length normalization
+        """
+        self.n_docs = len(texts)
+        term_ids: Dict[str, int] = {}
+        doc_terms: List[Dict[int, int]] = []
+        lengths = np.zeros(self.n_docs, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            terms = lexical_terms(text)
+            for term in terms:
+                term_id = term_ids.setdefault(term, len(term_ids))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            doc_terms.append(counts)
+            lengths[doc] = len(terms)
+        self.term_ids = term_ids
+
+        # CSR layout: postings of term t are docs[starts[t]:starts[t + 1]]
+        df = np.zeros(len(term_ids), dtype=np.int64)
+        for counts in doc_terms:
+            for term_id in counts:
+                df[term_id] += 1
+        self.starts = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        self.docs = np.zeros(int(df.sum()), dtype=np.int64)
+        tf = np.zeros(int(df.sum()), dtype=np.float32)
+        fill = self.starts[:-1].copy()
+        for doc, counts in enumerate(doc_terms):
+            for term_id, count in counts.items():
+                self.docs[fill[term_id]] = doc
+                tf[fill[term_id]] = count
+                fill[term_id] += 1
+
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = float(lengths.mean()) if self.n_docs and lengths.sum() else 1.0
+        doc_norm = k1 * (1.0 - b + b * lengths / avg_length)
+        posting_idf = np.repeat(self.idf, df)
+        self.weights = (posting_idf * tf * (k1 + 1.0) / (tf + doc_norm[self.docs])).astype(np.float32)
+        self.k1 = k1
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def score(self, text: str) -> Tuple[np.ndarray, float]:
+        """
+        BM25 score of every segment for one query
+
+        Returns:
+            Tuple of (scores of shape (n_docs,), the query's maximum attainable
+            score, used to normalize scores into [0, 1))
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        max_score = 0.0
+        for term in set(lexical_terms(text)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.starts[term_id], self.starts[term_id + 1]
+            np.add.at(scores, self.docs[start:end], self.weights[start:end])
+            max_score += float(self.idf[term_id]) * (self.k1 + 1.0)
+        return scores, max_score
+
+    def score_many(self, texts: List[str]) -> np.ndarray:
+        """Normalized BM25 scores, shape (n_queries, n_docs), each in [0, 1)"""
+        scores = np.zeros((len(texts), self.n_docs), dtype=np.float32)
+        for row, text in enumerate(texts):
+            row_scores, max_score = self.score(text)
+            if max_score > 0:
+                scores[row] = row_scores / max_score
+        return scores
+
+
+def _ranks(scores: np.ndarray, depth: int) -> np.ndarray:
+    """1-based rank of every finite entry within its row's top `depth` (0 = unranked)"""
+    depth = min(depth, scores.shape[1])
+    ranks = np.zeros(scores.shape, dtype=np.int64)
+    if depth == 0:
+        return ranks
+    top = top_k_rows(scores, depth, threshold=-np.inf)
+    positions = np.broadcast_to(np.arange(1, depth + 1), top.indices.shape)
+    np.put_along_axis(ranks, top.indices, np.where(np.isfinite(top.scores), positions, 0), axis=1)
+    return ranks
+
+
+def hybrid_search(
+    index: SegmentIndex,
+    lexical: BM25Index,
+    query_embeddings: np.ndarray,
+    query_texts: List[str],
+    top_k: int = 3,
+    threshold: float = 0.5,
+    candidates: Optional[List[Optional[np.ndarray]]] = None,
+    rrf_k: int = 60,
+    lexical_weight: float = 1.0,
+    depth: int = 50,
+    dense_margin: float = 0.1,
+    min_lexical: float = 0.3
+) -> RetrievalResult:
+    """
+    Top-k segments per query by reciprocal rank fusion of dense and BM25 ranks
+
+    fused = 1 / (rrf_k + dense_rank) + lexical_weight / (rrf_k + bm25_rank),
+    counting only the top `depth` of each ranking. A segment passes if its
+    cosine similarity reaches `threshold`, or if it is a strong lexical match
+    (normalized BM25 >= `min_lexical`) whose cosine is within `dense_margin`
+    of the threshold, so exact-term matches are kept without admitting
+    unrelated segments that merely share a word.
+
+    With `candidates` (see SegmentIndex.search), ranks and fused scores are
+    computed over each query's candidate columns only.
+
+    Returns:
+        RetrievalResult ordered by fused score; `scores` are cosine similarities
+    """
+    n_queries = len(query_embeddings)
+    k = min(top_k, len(index))
+    if n_queries == 0 or k == 0:
+        return index.search(query_embeddings, top_k=top_k, threshold=threshold, candidates=candidates)
+
+    queries = normalize_rows(query_embeddings)
+    lexical_scores = lexical.score_many(query_texts)
+    options = dict(
+        threshold=threshold, rrf_k=rrf_k, lexical_weight=lexical_weight,
+        depth=depth, dense_margin=dense_margin, min_lexical=min_lexical
+    )
+    if candidates is None or all(c is None or len(c) == 0 for c in candidates):
+        return _fuse(queries @ index.matrix.T, lexical_scores, k, **options)
+
+    indices = np.full((n_queries, k), -1, dtype=np.int64)
+    scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    mask = np.zeros((n_queries, k), dtype=bool)
+
+    # Each group scores only its candidate columns
+    for cand, rows in _group_candidates(candidates):
+        if cand is None:
+            group = _fuse(queries[rows] @ index.matrix.T, lexical_scores[rows], k, **options)
+            group_indices = group.indices
+        else:
+            cand = np.asarray(cand)
+            group = _fuse(
+                queries[rows] @ index.matrix[cand].T,
+                lexical_scores[np.ix_(rows, cand)],
+                min(k, len(cand)),
+                **options
+            )
+            group_indices = cand[group.indices]
+        group_k = group.indices.shape[1]
+        indices[rows, :group_k] = group_indices
+        scores[rows, :group_k] = group.scores
+        mask[rows, :group_k] = group.mask
+
+    return RetrievalResult(indices=indices, scores=scores, mask=mask)
+
+
+def _fuse(
+    dense: np.ndarray,
+    lexical_scores: np.ndarray,
+    k: int,
+    threshold: float,
+    rrf_k: int,
+    lexical_weight: float,
+    depth: int,
+    dense_margin: float,
+    min_lexical: float
+) -> RetrievalResult:
+    """Rank fusion over one block of columns (see hybrid_search); indices are column positions"""
+    dense = dense.astype(np.float32)
+    dense_ranks = _ranks(dense, depth)
+    lexical_ranks = _ranks(np.where(lexical_scores > 0, lexical_scores, -np.inf), depth)
+    fused = np.where(dense_ranks > 0, 1.0 / (rrf_k + dense_ranks), 0.0)
+    fused += np.where(lexical_ranks > 0, lexical_weight / (rrf_k + lexical_ranks), 0.0)
+
+    top = top_k_rows(fused, k, threshold=-np.inf)
+    indices = top.indices
+    scores = np.take_along_axis(dense, indices, axis=1)
+    strength = np.take_along_axis(lexical_scores, indices, axis=1)
+    mask = (scores >= threshold) | ((strength >= min_lexical) & (scores >= threshold - dense_margin))
+    return RetrievalResult(indices=indices, scores=scores.astype(np.float32), mask=mask)
@@ -0,0 +1,390 @@
+"""
+Pre-forked multi-process server
+
+    python -m app.serve --workers 4 --port 8000
+
+One uvicorn process is bound to a single core's worth of CPU (JSON parsing,
+retrieval, note assembly). This runs N uvicorn workers sharing one listening
+socket, forked from a supervisor that:
+
+- imports app.main before forking, so module-level state (prompt templates,
+  stopword tables, compiled regexes) is shared copy-on-write by all workers
+- exports the SQLite embedding cache into a read-only EmbeddingSnapshot
+  (app/cache.py) that every worker memory-maps, so hot embeddings sit in the
+  page cache once instead of once per worker LRU
+- keeps a per-worker health table in an anonymous shared mapping: each worker
+  writes its pid, heartbeat, request count and in-flight requests to its row
+  every WORKER_HEARTBEAT_INTERVAL seconds; /health reports all rows
+- respawns workers that exit and kills (then respawns) workers whose heartbeat
+  is older than WORKER_HEARTBEAT_TIMEOUT
+- on SIGHUP, reloads gracefully: re-reads .env, exports a fresh snapshot,
+  starts a new generation of workers and, once they are up, sends SIGTERM to
+  the old ones, which stop accepting and drain in-flight requests
+
+Code changes need a restart; SIGHUP only picks up configuration and a fresh
+embedding snapshot. Requires a platform with os.fork (Linux, macOS).
+"""
+
+import argparse
+import asyncio
+import logging
+import mmap
+import os
+import shutil
+import signal
+import socket
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from dotenv import load_dotenv
+
+from app import metrics
+from app.cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+WORKER_FIELDS = np.dtype([
+    ("pid", np.int64),
+    ("generation", np.int64),
+    ("started", np.float64),
+    ("heartbeat", np.float64),
+    ("requests", np.int64),
+    ("in_flight", np.int64),
+])
+
+
+class WorkerTable:
+    """Per-worker health rows in shared memory, inherited by forked workers"""
+
+    def __init__(self, slots: int):
+        """
+        Args:
+            slots: Number of rows (twice the worker count, for reloads)
+        """
+        # Anonymous MAP_SHARED mapping: writes are visible across fork
+        self._buffer = mmap.mmap(-1, WORKER_FIELDS.itemsize * slots)
+        self.rows = np.ndarray(slots, dtype=WORKER_FIELDS, buffer=self._buffer)
+
+    def claim(self, pid: int, generation: int) -> int:
+        """Reserve a free row for a worker about to be forked"""
+        free = np.flatnonzero(self.rows["pid"] == 0)
+        if len(free) == 0:
+            raise RuntimeError("No free worker slot")
+        slot = int(free[0])
+        self.rows[slot] = (pid, generation, time.time(), 0.0, 0, 0)
+        return slot
+
+    def release(self, slot: int):
+        self.rows[slot] = (0, 0, 0.0, 0.0, 0, 0)
+
+    def beat(self, slot: int, requests: int, in_flight: int):
+        row = self.rows[slot:slot + 1]
+        row["requests"] = requests
+        row["in_flight"] = in_flight
+        row["heartbeat"] = time.time()
+
+    def last_seen(self, slot: int) -> float:
+        """Latest heartbeat, or the fork time while the worker starts up"""
+        row = self.rows[slot]
+        return max(float(row["heartbeat"]), float(row["started"]))
+
+    def row(self, slot: int) -> Dict:
+        row = self.rows[slot]
+        now = time.time()
+        return {
+            "slot": slot,
+            "pid": int(row["pid"]),
+            "generation": int(row["generation"]),
+            "ready": bool(row["heartbeat"] > 0),
+            "uptime_seconds": round(now - float(row["started"]), 1),
+            "heartbeat_age_seconds": round(now - float(row["heartbeat"]), 1) if row["heartbeat"] > 0 else None,
+            "requests": int(row["requests"]),
+            "in_flight": int(row["in_flight"]),
+        }
+
+    def snapshot(self) -> List[Dict]:
+        return [self.row(int(slot)) for slot in np.flatnonzero(self.rows["pid"] != 0)]
+
+
+# Set in each forked worker
+_table: Optional[WorkerTable] = None
+_slot: Optional[int] = None
+_heartbeat_task: Optional[asyncio.Task] = None
+
+
+def worker_health() -> Optional[Dict]:
+    """This worker's health row and all others' (None when not started by app.serve)"""
+    if _table is None or _slot is None:
+        return None
+    return {"this_worker": _table.row(_slot), "workers": _table.snapshot()}
+
+
+async def _heartbeat(interval: float):
+    while True:
+        _table.beat(_slot, int(metrics.HTTP_REQUESTS.get()), int(metrics.HTTP_IN_FLIGHT.get()))
+        await asyncio.sleep(interval)
+
+
+async def _start_heartbeat():
+    """Startup handler: a worker counts as ready from its first heartbeat"""
+    global _heartbeat_task
+    if _table is not None:
+        interval = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "1.0"))
+        _heartbeat_task = asyncio.create_task(_heartbeat(interval))
+
+
+async def _stop_heartbeat():
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+
+
+@dataclass
+class Worker:
+    pid: int
+    slot: int
+    generation: int
+    killed: bool = False
+
+
+class Supervisor:
+    """Forks, watches and replaces uvicorn workers sharing one socket"""
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        heartbeat_timeout: float = 30.0,
+        graceful_timeout: float = 30.0,
+        snapshot_dir: Optional[str] = None,
+        snapshot_items: int = 200000,
+        log_level: str = "info"
+    ):
+        """
+        Args:
+            app: ASGI app, imported before forking
+            sock: Bound listening socket shared by all workers
+            workers: Number of worker processes
+            heartbeat_timeout: Seconds without a heartbeat before a worker is replaced
+            graceful_timeout: Seconds old workers get to drain on reload or shutdown
+            snapshot_dir: Directory for embedding snapshots (None disables them)
+            snapshot_items: Most recently used embeddings exported per snapshot
+            log_level: uvicorn log level for the workers
+        """
+        self.app = app
+        self.sock = sock
+        self.size = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.graceful_timeout = graceful_timeout
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_items = snapshot_items
+        self.log_level = log_level
+        self.table = WorkerTable(slots=2 * workers)
+        self.workers: Dict[int, Worker] = {}
+        self.generation = 0
+        self._stopping = False
+        self._reload_requested = False
+
+    @classmethod
+    def from_env(cls, app, sock: socket.socket, workers: Optional[int] = None, log_level: str = "info") -> "Supervisor":
+        """Create a supervisor configured from WORKERS and WORKER_* / EMBEDDING_SNAPSHOT_* variables"""
+        snapshot_dir = os.getenv("EMBEDDING_SNAPSHOT_DIR")
+        if snapshot_dir is None:
+            cache_path = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+            snapshot_dir = f"{cache_path}.snapshots" if cache_path else ""
+        return cls(
+            app,
+            sock,
+            workers=workers or int(os.getenv("WORKERS", str(os.cpu_count() or 1))),
+            heartbeat_timeout=float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30")),
+            graceful_timeout=float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30")),
+            snapshot_dir=snapshot_dir or None,
+            snapshot_items=int(os.getenv("EMBEDDING_SNAPSHOT_SIZE", "200000")),
+            log_level=log_level
+        )
+
+    def run(self):
+        """Start the workers and supervise them until SIGTERM/SIGINT"""
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if self.snapshot_dir:
+            # Generations from an earlier run are stale
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+        self._start_generation()
+        logger.info(f"Supervisor {os.getpid()} serving with {self.size} workers")
+        while not self._stopping:
+            if self._reload_requested:
+                self._reload_requested = False
+                self.reload()
+            self._reap()
+            self._check_heartbeats()
+            time.sleep(0.2)
+        self._stop_workers(list(self.workers))
+        if self.snapshot_dir:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    def reload(self):
+        """Graceful reload: new generation up first, then drain the old one"""
+        logger.info(f"Reloading workers (generation {self.generation + 1})")
+        load_dotenv(override=True)
+        previous = self.generation
+        old = [pid for pid, worker in self.workers.items() if worker.generation == previous]
+        self._start_generation()
+        deadline = time.time() + self.heartbeat_timeout
+        while time.time() < deadline and not self._stopping:
+            self._reap()
+            current = [w for w in self.workers.values() if w.generation == self.generation]
+            if len(current) == self.size and all(self.table.rows[w.slot]["heartbeat"] > 0 for w in current):
+                break
+            time.sleep(0.1)
+        else:
+            logger.warning("New workers not ready in time; stopping the old generation anyway")
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+        if self.snapshot_dir:
+            # Mapped files stay readable to the draining workers after removal
+            shutil.rmtree(os.path.join(self.snapshot_dir, f"gen-{previous}"), ignore_errors=True)
+
+    def _start_generation(self):
+        self.generation += 1
+        self._export_snapshot()
+        for _ in range(self.size):
+            self._spawn()
+
+    def _export_snapshot(self):
+        """Write this generation's embedding snapshot and point new workers at it"""
+        if not self.snapshot_dir:
+            return
+        cache = EmbeddingCache.from_env()
+        if cache.disk_path is None:
+            cache.close()
+            return
+        path = os.path.join(self.snapshot_dir, f"gen-{self.generation}")
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        started = time.perf_counter()
+        count = cache.export_snapshot(path, self.snapshot_items)
+        cache.close()
+        # Read by EmbeddingCache.from_env in the workers
+        os.environ["EMBEDDING_SNAPSHOT_PATH"] = path
+        logger.info(f"Embedding snapshot {path}: {count} entries in {time.perf_counter() - started:.2f}s")
+
+    def _spawn(self):
+        slot = self.table.claim(-1, self.generation)
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        self.table.rows[slot:slot + 1]["pid"] = pid
+        self.workers[pid] = Worker(pid=pid, slot=slot, generation=self.generation)
+        logger.info(f"Started worker {pid} (slot {slot}, generation {self.generation})")
+
+    def _run_worker(self, slot: int):
+        """Child process: serve until uvicorn exits, never return to the supervisor loop"""
+        global _table, _slot
+        code = 0
+        try:
+            for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.SIG_DFL)
+            _table, _slot = self.table, slot
+            config = uvicorn.Config(self.app, log_level=self.log_level, timeout_graceful_shutdown=self.graceful_timeout)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _reap(self):
+        """Collect exited workers and replace those of the current generation"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            self.table.release(worker.slot)
+            if worker.generation == self.generation and not self._stopping:
+                logger.warning(f"Worker {pid} exited (status {status}); restarting")
+                self._spawn()
+
+    def _check_heartbeats(self):
+        now = time.time()
+        for worker in list(self.workers.values()):
+            if not worker.killed and now - self.table.last_seen(worker.slot) > self.heartbeat_timeout:
+                logger.error(f"Worker {worker.pid} missed heartbeats for {self.heartbeat_timeout:.0f}s; killing it")
+                self._signal(worker.pid, signal.SIGKILL)
+                # Replaced once it has been reaped
+                worker.killed = True
+
+    def _stop_workers(self, pids: List[int]):
+        for pid in pids:
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGKILL)
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is not None:
+                self.table.release(worker.slot)
+
+    def _signal(self, pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket created once in the supervisor and inherited by workers"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default WORKERS or CPU count)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO))
+    # Preload before forking: modules, templates and constants are shared copy-on-write
+    from app.main import app
+    app.add_event_handler("startup", _start_heartbeat)
+    app.add_event_handler("shutdown", _stop_heartbeat)
+
+    sock = bind_socket(args.host, args.port)
+    Supervisor.from_env(app, sock, workers=args.workers, log_level=args.log_level).run()
+
+
+if __name__ == "__main__":
+    # Run from the importable module: app.main reads its worker globals
+    from app import serve
+    serve.main()
@@ -0,0 +1,89 @@
+"""
+Stage graph execution for the transcript pipeline
+
+Each stage declares the stages it depends on. A stage starts as soon as all of
+its dependencies have finished, so independent stages overlap on the event loop.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """A single named step in the pipeline"""
+    name: str
+    func: Callable[..., Any]
+    deps: Tuple[str, ...] = field(default_factory=tuple)
+
+
+class StageGraph:
+    """Dependency graph of pipeline stages with per-stage wall-clock timings"""
+
+    def __init__(self):
+        self._stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[..., Any], deps: Tuple[str, ...] = ()) -> "StageGraph":
+        """
+        Register a stage
+
+        Args:
+            name: Unique stage name (also the keyword its result is passed under)
+            func: Sync or async callable receiving dependency results as keyword arguments
+            deps: Names of stages that must finish first (must already be registered)
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage already registered: {name}")
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+        self._stages[name] = Stage(name=name, func=func, deps=tuple(deps))
+        return self
+
+    async def run(self) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """
+        Run all stages, overlapping independent ones
+
+        Returns:
+            Tuple of (results by stage name, timings in ms by stage name).
+            Timings include a "total" entry for the whole graph.
+        """
+        tasks: Dict[str, asyncio.Task] = {}
+        timings: Dict[str, float] = {}
+        graph_start = time.perf_counter()
+
+        async def run_stage(stage: Stage) -> Any:
+            if stage.deps:
+                await asyncio.gather(*(tasks[d] for d in stage.deps))
+            inputs = {d: tasks[d].result() for d in stage.deps}
+
+            start = time.perf_counter()
+            result = stage.func(**inputs)
+            if inspect.isawaitable(result):
+                result = await result
+            timings[stage.name] = round((time.perf_counter() - start) * 1000, 2)
+            logger.debug(f"Stage '{stage.name}' finished in {timings[stage.name]}ms")
+            return result
+
+        # Stages are registered in dependency order, so every dependency task
+        # exists before the stage that awaits it starts running
+        for name, stage in self._stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        timings["total"] = round((time.perf_counter() - graph_start) * 1000, 2)
+        results = {name: task.result() for name, task in tasks.items()}
+        return results, timings
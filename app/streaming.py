@@ -0,0 +1,203 @@
+"""
+Incremental parsing of a streamed SOAP note
+
+The chat completion is streamed as JSON text, a few characters at a time.
+JSONStringStream tracks where in the JSON document each character falls and
+emits string values as they grow. StreamingSOAPParser turns the section strings
+into finished sentences as soon as their terminating whitespace arrives, using
+the same boundary rule as TranscriptProcessor._split_into_sentences.
+
+Structured output (STRUCTURED_OUTPUT, CITATION_MODE=source_ids) streams each
+section as a list of sentence objects, {"text": ...[, "source_ids": [...]]},
+instead. Each object is emitted as one sentence, without re-splitting it, once
+the next object (or section) starts streaming; only string values are taken,
+so malformed items are dropped as they complete.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+SOAP_SECTIONS = ('subjective', 'objective', 'assessment', 'plan')
+
+JSONPath = Tuple[Union[str, int], ...]
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+@dataclass
+class _Frame:
+    """One open JSON container"""
+    kind: str                       # "object" or "array"
+    key: Optional[Union[str, int]] = None
+    expecting_key: bool = True      # objects only
+
+
+@dataclass
+class StringEvent:
+    """Text appended to (or the end of) a JSON string value at `path`"""
+    path: JSONPath
+    text: str = ""
+    end: bool = False
+
+
+class JSONStringStream:
+    """Streaming tokenizer that reports string values of a JSON document by path"""
+
+    def __init__(self):
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._is_key = False
+        self._key_buffer: List[str] = []
+        self._escape: Optional[str] = None  # pending escape sequence after a backslash
+
+    def _path(self) -> JSONPath:
+        return tuple(frame.key for frame in self._stack)
+
+    def feed(self, chunk: str) -> List[StringEvent]:
+        """Consume the next piece of JSON text"""
+        events: List[StringEvent] = []
+        value_chars: List[str] = []
+
+        def flush_value():
+            if value_chars:
+                events.append(StringEvent(path=self._path(), text="".join(value_chars)))
+                value_chars.clear()
+
+        for char in chunk:
+            if self._in_string:
+                if self._escape is not None:
+                    self._escape += char
+                    decoded = self._decode_escape()
+                    if decoded is None:
+                        continue
+                    char = decoded
+                elif char == '\\':
+                    self._escape = ""
+                    continue
+                elif char == '"':
+                    self._in_string = False
+                    if self._is_key:
+                        self._stack[-1].key = "".join(self._key_buffer)
+                        self._key_buffer.clear()
+                    else:
+                        flush_value()
+                        events.append(StringEvent(path=self._path(), end=True))
+                    continue
+
+                if self._is_key:
+                    self._key_buffer.append(char)
+                else:
+                    value_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._is_key = bool(self._stack) and self._stack[-1].kind == "object" and self._stack[-1].expecting_key
+            elif char == '{':
+                self._stack.append(_Frame(kind="object"))
+            elif char == '[':
+                self._stack.append(_Frame(kind="array", key=0))
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+            elif char == ':':
+                if self._stack and self._stack[-1].kind == "object":
+                    self._stack[-1].expecting_key = False
+            elif char == ',':
+                if self._stack:
+                    frame = self._stack[-1]
+                    if frame.kind == "object":
+                        frame.expecting_key = True
+                    else:
+                        frame.key += 1
+
+        flush_value()
+        return events
+
+    def _decode_escape(self) -> Optional[str]:
+        """Decode a complete escape sequence, or None if more characters are needed"""
+        sequence = self._escape
+        if sequence[0] == 'u':
+            if len(sequence) < 5:
+                return None
+            self._escape = None
+            try:
+                return chr(int(sequence[1:5], 16))
+            except ValueError:
+                return ""
+        self._escape = None
+        return _ESCAPES.get(sequence[0], sequence[0])
+
+
+class StreamingSOAPParser:
+    """
+    Emit (section, sentence) pairs from a streamed SOAP JSON object
+
+    Sections may be prose strings or lists of sentence objects. With
+    `source_ids`, (section, sentence, source_ids) triples instead.
+    """
+
+    def __init__(self, source_ids: bool = False):
+        self.source_ids = source_ids
+        self._json = JSONStringStream()
+        self._buffers = {}
+        # Sentence object being streamed: (section, index), its text and its ids by position
+        self._item: Optional[Tuple[str, int]] = None
+        self._item_text: List[str] = []
+        self._item_ids: Dict[int, List[str]] = {}
+
+    def feed(self, chunk: str) -> List[Tuple]:
+        """Consume streamed JSON text, returning sentences completed by it"""
+        sentences: List[Tuple] = []
+        for event in self._json.feed(chunk):
+            if not event.path or event.path[0] not in SOAP_SECTIONS:
+                continue
+            section = event.path[0]
+            if self._item is not None and event.path[:2] != self._item:
+                self._flush_item(sentences)
+            if len(event.path) != 1:
+                if isinstance(event.path[1], int):
+                    self._feed_item(event, sentences)
+                continue
+            if event.end:
+                self._flush(section, sentences)
+                continue
+            buffer = self._buffers.setdefault(section, [])
+            for char in event.text:
+                # Sentence boundary: whitespace following . ! or ?
+                if char.isspace() and buffer and buffer[-1] in '.!?':
+                    self._flush(section, sentences)
+                    buffer = self._buffers.setdefault(section, [])
+                buffer.append(char)
+        return sentences
+
+    def close(self) -> List[Tuple]:
+        """Flush sentences left in unterminated strings"""
+        sentences: List[Tuple] = []
+        for section in list(self._buffers):
+            self._flush(section, sentences)
+        self._flush_item(sentences)
+        return sentences
+
+    def _feed_item(self, event: StringEvent, sentences: List[Tuple]):
+        """A string inside sentence object `path[:2]` (its text, or one of its source ids)"""
+        self._item, field = event.path[:2], event.path[2:]
+        if field in ((), ("text",)):
+            self._item_text.append(event.text)
+        elif len(field) == 2 and field[0] == "source_ids" and isinstance(field[1], int):
+            self._item_ids.setdefault(field[1], []).append(event.text)
+
+    def _flush_item(self, sentences: List[Tuple]):
+        if self._item is not None:
+            text = "".join(self._item_text).strip()
+            if text:
+                ids = ["".join(parts) for _, parts in sorted(self._item_ids.items())]
+                sentences.append((self._item[0], text, ids) if self.source_ids else (self._item[0], text))
+        self._item = None
+        self._item_text = []
+        self._item_ids = {}
+
+    def _flush(self, section: str, sentences: List[Tuple]):
+        text = "".join(self._buffers.pop(section, [])).strip()
+        if text:
+            sentences.append((section, text, []) if self.source_ids else (section, text))
@@ -0,0 +1,206 @@
+"""
+Columnar transcript store used by every pipeline stage
+
+`TranscriptInput` holds one Pydantic object per segment, which is fine at the
+API boundary but costly to walk again and again for a 10k-segment group
+session. `TranscriptColumns` is built once per request and keeps the segments
+as parallel columns instead:
+
+- ids:          list of segment ids (plus an id -> position map built on demand)
+- speakers:     int32 codes into `speaker_names`
+- start_ms/end_ms: int64 arrays
+- text:         one concatenated text buffer, segment i being
+                text[text_offsets[i]:text_offsets[i + 1]]
+
+`from_records` builds the store straight from decoded JSON with a plain type
+check per field (no model objects), e.g. for job payloads read back from the
+queue. Indexing or iterating yields lightweight `SegmentRow` tuples with the
+same attribute names as `TranscriptSegment`.
+"""
+
+import json
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from app.models import TranscriptInput, TranscriptSegment
+
+
+class SegmentRow(NamedTuple):
+    """One segment read from the columns (attribute-compatible with TranscriptSegment)"""
+    id: str
+    speaker: str
+    start_ms: int
+    end_ms: int
+    text: str
+
+
+class TranscriptColumns:
+    """Parallel-array view of a transcript's segments"""
+
+    def __init__(
+        self,
+        session_id: str,
+        patient_id: str,
+        ids: List[str],
+        speaker_names: List[str],
+        speakers: np.ndarray,
+        start_ms: np.ndarray,
+        end_ms: np.ndarray,
+        text: str,
+        text_offsets: np.ndarray
+    ):
+        """Use `from_input`, `from_segments` or `from_records` instead"""
+        self.session_id = session_id
+        self.patient_id = patient_id
+        self.ids = ids
+        self.speaker_names = speaker_names
+        self.speakers = speakers
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text = text
+        self.text_offsets = text_offsets
+        self._positions: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def _build(cls, session_id: str, patient_id: str, ids, speakers, starts, ends, texts) -> "TranscriptColumns":
+        codes: Dict[str, int] = {}
+        speaker_codes = np.fromiter(
+            (codes.setdefault(speaker, len(codes)) for speaker in speakers), dtype=np.int32, count=len(ids)
+        )
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(ids)), out=offsets[1:])
+        return cls(
+            session_id=session_id,
+            patient_id=patient_id,
+            ids=list(ids),
+            speaker_names=list(codes),
+            speakers=speaker_codes,
+            start_ms=np.asarray(starts, dtype=np.int64),
+            end_ms=np.asarray(ends, dtype=np.int64),
+            text="".join(texts),
+            text_offsets=offsets
+        )
+
+    @classmethod
+    def from_segments(
+        cls,
+        segments: Sequence[Union[TranscriptSegment, SegmentRow]],
+        session_id: str = "",
+        patient_id: str = ""
+    ) -> "TranscriptColumns":
+        """Columns from already validated segment objects"""
+        return cls._build(
+            session_id,
+            patient_id,
+            [s.id for s in segments],
+            [s.speaker for s in segments],
+            [s.start_ms for s in segments],
+            [s.end_ms for s in segments],
+            [s.text for s in segments]
+        )
+
+    @classmethod
+    def from_input(cls, transcript: Union[TranscriptInput, "TranscriptColumns"]) -> "TranscriptColumns":
+        """Columns of an API transcript (columns are returned unchanged)"""
+        if isinstance(transcript, TranscriptColumns):
+            return transcript
+        return cls.from_segments(transcript.segments, transcript.session_id, transcript.patient_id)
+
+    @classmethod
+    def from_records(cls, records: List[Dict], session_id: str, patient_id: str) -> "TranscriptColumns":
+        """
+        Columns from decoded JSON segment dicts, validated field by field
+
+        Raises:
+            ValueError: A segment is not an object or a field is missing or mistyped
+        """
+        n = len(records)
+        ids: List[str] = [""] * n
+        speakers: List[str] = [""] * n
+        texts: List[str] = [""] * n
+        starts = np.zeros(n, dtype=np.int64)
+        ends = np.zeros(n, dtype=np.int64)
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise ValueError(f"segments[{i}] must be an object")
+            try:
+                ids[i], speakers[i], texts[i] = record["id"], record["speaker"], record["text"]
+                start, end = record["start_ms"], record["end_ms"]
+            except KeyError as e:
+                raise ValueError(f"segments[{i}] is missing field {e.args[0]!r}") from None
+            if type(ids[i]) is not str or type(speakers[i]) is not str or type(texts[i]) is not str:
+                raise ValueError(f"segments[{i}]: id, speaker and text must be strings")
+            if type(start) is not int or type(end) is not int:
+                raise ValueError(f"segments[{i}]: start_ms and end_ms must be integers")
+            starts[i] = start
+            ends[i] = end
+        return cls._build(session_id, patient_id, ids, speakers, starts, ends, texts)
+
+    @classmethod
+    def from_json(cls, payload: Union[str, bytes]) -> "TranscriptColumns":
+        """Columns from a serialized TranscriptInput (see `from_records`)"""
+        data = json.loads(payload)
+        if not isinstance(data, dict) or not isinstance(data.get("segments"), list):
+            raise ValueError("Transcript must be an object with a segments list")
+        session_id, patient_id = data.get("session_id"), data.get("patient_id")
+        if type(session_id) is not str or type(patient_id) is not str:
+            raise ValueError("session_id and patient_id must be strings")
+        return cls.from_records(data["segments"], session_id, patient_id)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> SegmentRow:
+        return SegmentRow(
+            self.ids[i],
+            self.speaker_names[self.speakers[i]],
+            int(self.start_ms[i]),
+            int(self.end_ms[i]),
+            self.text_at(i)
+        )
+
+    def __iter__(self) -> Iterator[SegmentRow]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def text_at(self, i: int) -> str:
+        return self.text[self.text_offsets[i]:self.text_offsets[i + 1]]
+
+    def speaker_at(self, i: int) -> str:
+        return self.speaker_names[self.speakers[i]]
+
+    def texts(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """Segment texts of rows [start, end)"""
+        end = len(self) if end is None else end
+        offsets = self.text_offsets[start:end + 1].tolist()
+        text = self.text
+        return [text[a:b] for a, b in zip(offsets, offsets[1:])]
+
+    def position(self, segment_id: str) -> Optional[int]:
+        """Row of a segment id (None if unknown)"""
+        if self._positions is None:
+            self._positions = {segment_id: i for i, segment_id in enumerate(self.ids)}
+        return self._positions.get(segment_id)
+
+    def speaker_codes(self, names: Sequence[str]) -> List[int]:
+        """Codes of the speakers whose lowercased name is in `names`"""
+        wanted = set(names)
+        return [code for code, name in enumerate(self.speaker_names) if name.strip().lower() in wanted]
+
+    def take(self, rows: Sequence[int]) -> "TranscriptColumns":
+        """Columns of a subset of rows, in the given order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return TranscriptColumns._build(
+            self.session_id,
+            self.patient_id,
+            [self.ids[i] for i in rows],
+            [self.speaker_names[c] for c in self.speakers[rows]],
+            self.start_ms[rows],
+            self.end_ms[rows],
+            [self.text_at(i) for i in rows]
+        )
+
+    def to_segments(self) -> List[TranscriptSegment]:
+        """Pydantic segments (API boundary only)"""
+        return [TranscriptSegment(**row._asdict()) for row in self]
@@ -1,61 +1,11 @@
 """
-Utility functions for error handling, retries, and validation
+Utility functions for validation and token tracking
 """
 
-import asyncio
 import logging
-from typing import Callable, Any, TypeVar
-from functools import wraps
 
 logger = logging.getLogger(__name__)
 
-T = TypeVar('T')
-
-
-async def retry_with_backoff(
-    func: Callable,
-    max_retries: int = 3,
-    initial_delay: float = 1.0,
-    backoff_factor: float = 2.0,
-    *args,
-    **kwargs
-) -> Any:
-    """
-    Retry an async function with exponential backoff
-    
-    Args:
-        func: Async function to retry
-        max_retries: Maximum number of retry attempts
-        initial_delay: Initial delay in seconds
-        backoff_factor: Multiplier for delay after each retry
-        *args, **kwargs: Arguments to pass to func
-    
-    Returns:
-        Result from successful function call
-    
-    Raises:
-        Last exception if all retries fail
-    """
-    delay = initial_delay
-    last_exception = None
-    
-    for attempt in range(max_retries):
-        try:
-            return await func(*args, **kwargs)
-        except Exception as e:
-            last_exception = e
-            if attempt < max_retries - 1:
-                logger.warning(
-                    f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}. "
-                    f"Retrying in {delay:.1f}s..."
-                )
-                await asyncio.sleep(delay)
-                delay *= backoff_factor
-            else:
-                logger.error(f"All {max_retries} attempts failed")
-    
-    raise last_exception
-
 
 def validate_segment_ids(segment_ids: list, valid_ids: set) -> list:
     """
@@ -96,18 +46,27 @@ class TokenCounter:
     
     def __init__(self):
         self.total_prompt_tokens = 0
+        self.total_cached_prompt_tokens = 0
         self.total_completion_tokens = 0
         self.total_embedding_tokens = 0
+        self.embedding_cache_hits = 0
+        self.embedding_cache_misses = 0
     
-    def add_completion(self, prompt_tokens: int, completion_tokens: int):
-        """Add completion API call tokens"""
+    def add_completion(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Add completion API call tokens (cached_tokens: prompt tokens served from the provider's prompt cache)"""
         self.total_prompt_tokens += prompt_tokens
+        self.total_cached_prompt_tokens += cached_tokens
         self.total_completion_tokens += completion_tokens
     
     def add_embedding(self, tokens: int):
         """Add embedding API call tokens"""
         self.total_embedding_tokens += tokens
     
+    def add_cache_lookup(self, hits: int, misses: int):
+        """Add embedding cache lookup results"""
+        self.embedding_cache_hits += hits
+        self.embedding_cache_misses += misses
+    
     def get_total(self) -> int:
         """Get total tokens used"""
         return self.total_prompt_tokens + self.total_completion_tokens + self.total_embedding_tokens
@@ -116,13 +75,26 @@ class TokenCounter:
         """Get token usage summary"""
         return {
             "prompt_tokens": self.total_prompt_tokens,
+            "cached_prompt_tokens": self.total_cached_prompt_tokens,
             "completion_tokens": self.total_completion_tokens,
             "embedding_tokens": self.total_embedding_tokens,
             "total_tokens": self.get_total()
         }
     
+    def get_cache_summary(self) -> dict:
+        """Get embedding cache hit/miss summary"""
+        lookups = self.embedding_cache_hits + self.embedding_cache_misses
+        return {
+            "hits": self.embedding_cache_hits,
+            "misses": self.embedding_cache_misses,
+            "hit_rate": round(self.embedding_cache_hits / lookups, 3) if lookups else 0.0
+        }
+    
     def reset(self):
         """Reset counters"""
         self.total_prompt_tokens = 0
+        self.total_cached_prompt_tokens = 0
         self.total_completion_tokens = 0
         self.total_embedding_tokens = 0
+        self.embedding_cache_hits = 0
+        self.embedding_cache_misses = 0
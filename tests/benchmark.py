@@ -0,0 +1,274 @@
+"""
+Reproducible load-test benchmark against the offline mock OpenAI API
+
+Drives TranscriptProcessor directly and through the FastAPI app with synthetic
+transcripts of varying length and concurrency. Reports p50/p95/p99 latency,
+throughput and peak traced memory per scenario, and compares them with a saved
+baseline (exit code 1 on regression).
+
+Usage:
+    python -m tests.benchmark                    # run and compare with the baseline
+    python -m tests.benchmark --quick            # smaller scenarios
+    python -m tests.benchmark --save-baseline    # record a new baseline
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# The benchmark must not read or fill the on-disk embedding cache
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+
+import httpx
+import numpy as np
+
+from app.models import TranscriptInput
+from app.pipeline import TranscriptProcessor
+from tests.mock_openai import MockProfile, mock_processor
+
+DEFAULT_BASELINE = Path(__file__).parent.parent / "data" / "benchmark_baseline.json"
+
+PATIENT_LINES = [
+    "I haven't been sleeping well, maybe four hours a night.",
+    "Work has been really stressful since the reorganization.",
+    "I feel anxious most mornings before I leave the house.",
+    "My appetite is down and I skip lunch a lot.",
+    "The breathing exercise helped a little when I remembered to do it.",
+    "I had an argument with my sister and we haven't spoken since.",
+    "I keep replaying conversations from work in my head at night.",
+    "Weekends are better, I went hiking with a friend.",
+    "I stopped drinking coffee after noon like we discussed.",
+    "Sometimes I feel like nothing I do is good enough.",
+]
+CLINICIAN_LINES = [
+    "How has your sleep been since our last session?",
+    "What do you notice in your body when the anxiety starts?",
+    "Let's try keeping a sleep diary for the next two weeks.",
+    "That sounds like a pattern of rumination before bed.",
+    "Can you tell me more about the argument with your sister?",
+    "I'd like you to practice the breathing exercise twice a day.",
+    "We'll review the sleep diary at our next appointment.",
+    "What helped you get through the harder days this week?",
+]
+
+
+def synthetic_transcript(n_segments: int, seed: int = 0, session_id: Optional[str] = None) -> TranscriptInput:
+    """Deterministic alternating clinician/patient transcript with ~20s turns"""
+    rng = random.Random(seed)
+    segments = []
+    t = 0
+    for i in range(n_segments):
+        speaker = "clinician" if i % 2 == 0 else "patient"
+        lines = CLINICIAN_LINES if speaker == "clinician" else PATIENT_LINES
+        text = " ".join(rng.sample(lines, rng.randint(1, 2)))
+        duration = rng.randint(8000, 30000)
+        segments.append({
+            "id": f"seg_{i + 1:03d}",
+            "speaker": speaker,
+            "start_ms": t,
+            "end_ms": t + duration,
+            "text": text
+        })
+        t += duration
+    return TranscriptInput(
+        session_id=session_id or f"bench_{n_segments}_{seed}",
+        patient_id="patient_bench",
+        segments=segments
+    )
+
+
+@dataclass
+class Scenario:
+    """One load pattern: `requests` transcripts of `segments` segments, `concurrency` at a time"""
+    name: str
+    target: str          # "processor" or "api"
+    segments: int
+    concurrency: int
+    requests: int
+
+
+SCENARIOS = [
+    Scenario("processor_short_c1", "processor", 30, 1, 10),
+    Scenario("processor_short_c8", "processor", 30, 8, 40),
+    Scenario("processor_long_c1", "processor", 300, 1, 5),
+    Scenario("processor_long_c4", "processor", 300, 4, 12),
+    Scenario("processor_xlong_c2", "processor", 1200, 2, 4),
+    Scenario("api_short_c8", "api", 30, 8, 40),
+    Scenario("api_long_c4", "api", 300, 4, 12),
+]
+
+QUICK_SCENARIOS = [
+    Scenario("processor_short_c1", "processor", 30, 1, 4),
+    Scenario("processor_short_c8", "processor", 30, 8, 16),
+    Scenario("processor_long_c4", "processor", 300, 4, 4),
+    Scenario("api_short_c8", "api", 30, 8, 16),
+]
+
+
+async def _run_requests(scenario: Scenario, processor: TranscriptProcessor, count: int, seed_base: int) -> List[float]:
+    """Send `count` requests at the scenario's concurrency, returning per-request latencies (s)"""
+    transcripts = [synthetic_transcript(scenario.segments, seed=seed_base + i) for i in range(count)]
+    semaphore = asyncio.Semaphore(scenario.concurrency)
+    latencies: List[float] = []
+
+    if scenario.target == "api":
+        from app import main
+        main.processor = processor
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+    else:
+        http = None
+
+    async def one(transcript: TranscriptInput):
+        async with semaphore:
+            start = time.perf_counter()
+            if http is None:
+                await processor.process_transcript(transcript)
+            else:
+                response = await http.post("/generate-note", content=transcript.model_dump_json(),
+                                           headers={"content-type": "application/json"})
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        await asyncio.gather(*(one(t) for t in transcripts))
+    finally:
+        if http is not None:
+            await http.aclose()
+    return latencies
+
+
+async def run_scenario(scenario: Scenario, profile: MockProfile) -> Dict[str, float]:
+    """Measure latency/throughput, then peak memory in a separate traced pass"""
+    processor = mock_processor(profile)
+
+    start = time.perf_counter()
+    latencies = await _run_requests(scenario, processor, scenario.requests, seed_base=0)
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows allocation-heavy code, so memory is measured on its own
+    # pass of one concurrent wave with a fresh (cold) processor
+    processor = mock_processor(profile)
+    tracemalloc.start()
+    try:
+        await _run_requests(scenario, processor, scenario.concurrency, seed_base=10_000)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ms = np.asarray(latencies) * 1000
+    return {
+        "requests": scenario.requests,
+        "segments": scenario.segments,
+        "concurrency": scenario.concurrency,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "throughput_rps": round(scenario.requests / elapsed, 3),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2)
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """List regressions beyond `tolerance` (fractional) against the baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms", "peak_memory_mb"):
+            if previous.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {previous[key]} -> {current[key]}")
+        if previous.get("throughput_rps") and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput_rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+    return regressions
+
+
+def _format_row(name: str, result: Dict, previous: Optional[Dict]) -> str:
+    def cell(key: str, fmt: str) -> str:
+        text = format(result[key], fmt)
+        if previous and previous.get(key):
+            change = (result[key] - previous[key]) / previous[key] * 100
+            text += f" ({change:+.0f}%)"
+        return text
+    return (
+        f"{name:<22} {cell('p50_ms', '.1f'):>16} {cell('p95_ms', '.1f'):>16} {cell('p99_ms', '.1f'):>16} "
+        f"{cell('throughput_rps', '.2f'):>14} {cell('peak_memory_mb', '.1f'):>14}"
+    )
+
+
+async def run_benchmark(scenarios: List[Scenario], profile: MockProfile) -> Dict[str, Dict]:
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = await run_scenario(scenario, profile)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against the mock OpenAI API")
+    parser.add_argument("--quick", action="store_true", help="Run the smaller scenario set")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--output", type=Path, help="Also write results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression (fraction)")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline INFO logs")
+    args = parser.parse_args()
+    # Configured before app.main is imported, so its basicConfig(INFO) is a no-op
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    profile = MockProfile(
+        chat_latency_ms=args.chat_latency_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        error_rate=args.error_rate
+    )
+    scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+    results = asyncio.run(run_benchmark(scenarios, profile))
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()).get("scenarios", {})
+
+    print(f"{'scenario':<22} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'req/s':>14} {'peak MB':>14}")
+    for name, result in results.items():
+        print(_format_row(name, result, baseline.get(name)))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "profile": vars(profile),
+        "scenarios": results
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    if baseline:
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,13 @@ import json
 import os
 from dotenv import load_dotenv
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 load_dotenv()
 
 from app.models import TranscriptInput
 from app.pipeline import TranscriptProcessor
+from app.retrieval import SegmentIndex
+from app.transcript import TranscriptColumns
 
 async def diagnose():
     print("=" * 80)
@@ -36,11 +37,12 @@ async def diagnose():
     
     # Get embeddings
     print(f"\nEmbedding {len(transcript.segments)} segments...")
-    segment_embeddings = await processor._embed_segments(transcript.segments)
+    columns = TranscriptColumns.from_input(transcript)
+    segment_embeddings = await processor._embed_segments(columns)
     
     # Generate note
     print(f"Generating SOAP note...")
-    soap_note = await processor._generate_soap_note(transcript)
+    soap_note = await processor._generate_soap_note(columns)
     statements = processor._parse_soap_note(soap_note)
     
     print(f"\nGenerated {len(statements)} statements")
@@ -50,20 +52,18 @@ async def diagnose():
     statement_texts = [s['text'] for s in statements]
     statement_embeddings = await processor._embed_texts(statement_texts)
     
+    # Score every statement against every segment at once
+    index = SegmentIndex(segment_embeddings)
+    retrieval = index.search(statement_embeddings, top_k=3, threshold=processor.citation_threshold)
+    
     # For each statement, show top 3 matches
-    for idx, (statement, stmt_embedding) in enumerate(zip(statements, statement_embeddings)):
+    for idx, statement in enumerate(statements):
         print(f"\n{idx+1}. [{statement['section'].upper()}]")
         print(f"   Statement: {statement['text'][:80]}...")
         
-        # Calculate similarities
-        similarities = cosine_similarity(
-            stmt_embedding.reshape(1, -1),
-            segment_embeddings
-        )[0]
-        
-        # Get top 3
-        top_3_indices = np.argsort(similarities)[-3:][::-1]
-        top_3_scores = similarities[top_3_indices]
+        # Top 3 (already sorted by descending similarity)
+        top_3_indices = retrieval.indices[idx]
+        top_3_scores = retrieval.scores[idx]
         
         print(f"\n   Top 3 matching segments:")
         for seg_idx, score in zip(top_3_indices, top_3_scores):
@@ -79,15 +79,7 @@ async def diagnose():
     print("SIMILARITY STATISTICS")
     print("=" * 80)
     
-    all_max_scores = []
-    for stmt_embedding in statement_embeddings:
-        similarities = cosine_similarity(
-            stmt_embedding.reshape(1, -1),
-            segment_embeddings
-        )[0]
-        all_max_scores.append(similarities.max())
-    
-    all_max_scores = np.array(all_max_scores)
+    all_max_scores = retrieval.best_scores
     
     print(f"\nMax similarity scores distribution:")
     print(f"  Mean: {all_max_scores.mean():.3f}")
@@ -0,0 +1,405 @@
+"""
+Offline stand-in for the OpenAI chat and embedding endpoints
+
+Serves /v1/embeddings and /v1/chat/completions (including streaming) with
+deterministic output and configurable latency/error profiles, so the pipeline
+can be tested and benchmarked without an API key.
+
+In-process (no network):
+    client = mock_client(MockProfile(chat_latency_ms=50))
+    processor.client = client
+
+    processor = mock_processor(FAST)    # mock client + memory-only embedding cache
+
+Standalone server for the real AsyncOpenAI client:
+    python -m tests.mock_openai --port 8100 --chat-latency-ms 800 --error-rate 0.02
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=mock python -m app.main
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from openai import AsyncOpenAI
+
+SECTIONS = ('subjective', 'objective', 'assessment', 'plan')
+
+
+@dataclass
+class MockProfile:
+    """Latency and failure behaviour of the mock server"""
+    embedding_dim: int = 256
+    embedding_latency_ms: float = 20.0
+    embedding_latency_per_input_ms: float = 0.05
+    chat_latency_ms: float = 300.0
+    chat_latency_per_token_ms: float = 2.0
+    stream_chunk_chars: int = 12
+    jitter: float = 0.1                 # +/- fraction of latency
+    error_rate: float = 0.0             # share of requests failing with error_status
+    fail_first: int = 0                 # the first N requests fail with error_status
+    error_status: int = 429
+    retry_after_seconds: Optional[float] = 0.05
+    prompt_cache: bool = True           # report cached_tokens for repeated prompt prefixes
+    seed: int = 0
+
+
+# Near-instant responses for unit tests
+FAST = MockProfile(chat_latency_ms=5, chat_latency_per_token_ms=0, embedding_latency_ms=1, jitter=0)
+
+
+# Prompt caching as OpenAI does it: prompts of at least 1024 tokens, in 128-token increments
+CACHE_MIN_CHARS = 4096
+CACHE_BLOCK_CHARS = 512
+
+
+def _prefix_blocks(prompt: str) -> List[bytes]:
+    """Digest of every prompt prefix ending on a cache block boundary"""
+    digest = hashlib.blake2b(digest_size=16)
+    blocks = []
+    for end in range(CACHE_BLOCK_CHARS, len(prompt) + 1, CACHE_BLOCK_CHARS):
+        digest.update(prompt[end - CACHE_BLOCK_CHARS:end].encode())
+        blocks.append(digest.copy().digest())
+    return blocks
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def deterministic_embedding(text: str, dim: int) -> List[float]:
+    """
+    Hashed bag-of-words embedding: identical texts map to identical vectors and
+    texts sharing words have positive cosine similarity, like a real model.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in _tokens(text):
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+def _transcript_lines(prompt: str) -> List[Dict[str, str]]:
+    """
+    Pull speaker/text pairs out of a formatted transcript prompt
+
+    Reads the full format ("[00:00] SPEAKER: text") and the compact one, where
+    a speaker code is introduced as "C (clinician): text" and later lines may
+    start with "C: text" and no time mark. Lines with segment id markers
+    ("<seg_001> text <seg_002> text") yield one entry per segment, with its id.
+    """
+    lines = []
+    roles: Dict[str, str] = {}
+    for raw in prompt.splitlines():
+        match = re.match(r"^\s*((?:\[[^\]]*\]\s*)*)([A-Za-z0-9_ ]{1,20})(?: \(([^)]{1,40})\))?:\s*(.+)$", raw)
+        if not match:
+            continue
+        marked, speaker, role, text = match.groups()
+        speaker = speaker.strip()
+        if role:
+            roles[speaker] = role.strip().lower()
+        elif speaker in roles:
+            pass
+        elif not marked or not re.fullmatch(r"[A-Za-z_ ]+", speaker):
+            continue
+        speaker = roles.get(speaker, speaker.lower())
+        pieces = re.split(r"<([^<>\s]+)>\s*", text)
+        if len(pieces) == 1:
+            lines.append({"speaker": speaker, "text": text.strip()})
+            continue
+        for segment_id, piece in zip(pieces[1::2], pieces[2::2]):
+            lines.append({"speaker": speaker, "text": piece.strip(), "id": segment_id})
+    return lines
+
+
+def _first_sentence(text: str) -> str:
+    sentence = re.split(r"(?<=[.!?])\s+", text.strip())[0].rstrip(".!?")
+    return sentence[:160]
+
+
+def build_soap_note(prompt: str, response_format: Optional[Dict] = None) -> Dict:
+    """
+    Deterministic SOAP note built from the transcript lines in the prompt
+
+    A strict `json_schema` response format is honored (see `_conform`);
+    otherwise sections are prose, or sentence lists when the prompt asks for
+    "source_ids".
+    """
+    schema = None
+    if response_format and response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+
+    if "Partial SOAP notes" in prompt:
+        note = _reduce_partial_notes(prompt)
+    else:
+        lines = _transcript_lines(prompt)
+        clinician = [line for line in lines if line["speaker"].startswith("clin")]
+        patient = [line for line in lines if not line["speaker"].startswith("clin")]
+
+        def pick(picked: List[Dict[str, str]], count: int, template: str) -> List[Dict]:
+            return [
+                {
+                    "text": template.format(_first_sentence(line["text"]).lower()) + ".",
+                    "source_ids": [line["id"]] if line.get("id") else []
+                }
+                for line in picked[:count]
+            ]
+
+        note = {
+            "subjective": pick(patient, 3, "Patient reports {}"),
+            "objective": pick(patient[3:], 1, "Patient described {}"),
+            "assessment": pick(patient[-2:], 1, "Presentation is consistent with {}"),
+            "plan": pick(clinician[-2:], 2, "Clinician recommended {}")
+        }
+        if schema is None and '"source_ids"' not in prompt:
+            note = {section: " ".join(item["text"] for item in items) for section, items in note.items()}
+    return _conform(note, schema) if schema else note
+
+
+def _conform(note: Dict, schema: Dict) -> Dict:
+    """Reshape a note to a strict schema: only its keys, sections as lists of its sentence fields"""
+    result = {}
+    for key, spec in schema["properties"].items():
+        value = note.get(key)
+        if spec["type"] == "object":
+            result[key] = {name: (value or {}).get(name, []) for name in spec["properties"]}
+            continue
+        if not isinstance(value, list):
+            value = [{"text": text} for text in re.split(r"(?<=[.!?])\s+", value or "") if text.strip()]
+        fields = spec["items"]["properties"]
+        result[key] = [{name: item.get(name, []) for name in fields} for item in value]
+    return result
+
+
+def _reduce_partial_notes(prompt: str) -> Dict:
+    merged = {section: [] for section in SECTIONS}
+    sources = {section: [] for section in SECTIONS}
+    for part, block in re.findall(r"Part (\d+)[^\n]*:\n(\{.*?\n\})", prompt, flags=re.S):
+        part = int(part)
+        try:
+            note = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        for section in SECTIONS:
+            text = note.get(section) or ""
+            if isinstance(text, list):
+                text = " ".join(item.get("text", "") for item in text if isinstance(item, dict))
+            if text:
+                merged[section].append(re.split(r"(?<=[.!?])\s+", text)[0])
+                sources[section].append(part)
+    result = {section: " ".join(merged[section][:4]) for section in SECTIONS}
+    result["sources"] = sources
+    return result
+
+
+def create_mock_app(profile: Optional[MockProfile] = None) -> FastAPI:
+    """Build the mock OpenAI API app"""
+    profile = profile or MockProfile()
+    rng = random.Random(profile.seed)
+    app = FastAPI(title="Mock OpenAI API")
+    app.state.profile = profile
+    app.state.calls = {"embeddings": 0, "chat": 0, "errors": 0}
+    app.state.prompt_prefixes = set()
+
+    def cached_chars(prompt: str) -> int:
+        """Length of the longest previously seen block-aligned prefix; remembers this prompt's"""
+        if not profile.prompt_cache or len(prompt) < CACHE_MIN_CHARS:
+            return 0
+        blocks = _prefix_blocks(prompt)
+        hits = 0
+        for block in blocks:
+            if block not in app.state.prompt_prefixes:
+                break
+            hits += 1
+        app.state.prompt_prefixes.update(blocks)
+        return hits * CACHE_BLOCK_CHARS if hits * CACHE_BLOCK_CHARS >= CACHE_MIN_CHARS else 0
+
+    async def delay(base_ms: float):
+        jitter = 1.0 + rng.uniform(-profile.jitter, profile.jitter)
+        await asyncio.sleep(max(base_ms * jitter, 0.0) / 1000)
+
+    def maybe_fail() -> Optional[JSONResponse]:
+        requests = app.state.calls["embeddings"] + app.state.calls["chat"]
+        failing = requests <= profile.fail_first
+        if failing or (profile.error_rate and rng.random() < profile.error_rate):
+            app.state.calls["errors"] += 1
+            headers = {}
+            if profile.retry_after_seconds is not None:
+                headers["retry-after"] = str(profile.retry_after_seconds)
+            return JSONResponse(
+                status_code=profile.error_status,
+                content={"error": {"message": "Mock upstream error", "type": "mock_error"}},
+                headers=headers
+            )
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        app.state.calls["embeddings"] += 1
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await delay(profile.embedding_latency_ms + profile.embedding_latency_per_input_ms * len(inputs))
+        failure = maybe_fail()
+        if failure:
+            return failure
+        tokens = sum(max(len(text) // 4, 1) for text in inputs)
+        return {
+            "object": "list",
+            "model": body.get("model", "mock-embedding"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": deterministic_embedding(text, profile.embedding_dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls["chat"] += 1
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        content = json.dumps(build_soap_note(prompt, body.get("response_format")))
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = max(len(content) // 4, 1)
+        model = body.get("model", "mock-chat")
+        created = int(time.time())
+
+        failure = maybe_fail()
+        if failure:
+            await delay(profile.chat_latency_ms / 4)
+            return failure
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_chars(prompt) // 4}
+        }
+
+        if not body.get("stream"):
+            await delay(profile.chat_latency_ms + profile.chat_latency_per_token_ms * completion_tokens)
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def stream():
+            await delay(profile.chat_latency_ms)
+            size = profile.stream_chunk_chars
+            for start in range(0, len(content), size):
+                piece = content[start:start + size]
+                await delay(profile.chat_latency_per_token_ms * max(len(piece) // 4, 1))
+                chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                usage_chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage
+                }
+                yield f"data: {json.dumps(usage_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    return app
+
+
+def mock_client(profile: Optional[MockProfile] = None, app: Optional[FastAPI] = None) -> AsyncOpenAI:
+    """AsyncOpenAI client wired to an in-process mock app (no network)"""
+    app = app or create_mock_app(profile)
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock-openai/v1")
+    return AsyncOpenAI(api_key="mock", base_url="http://mock-openai/v1", http_client=http_client, max_retries=0)
+
+
+def mock_processor(profile: Optional[MockProfile] = FAST, app: Optional[FastAPI] = None):
+    """
+    TranscriptProcessor wired to an in-process mock app and a cold memory-only embedding cache
+
+    The cache is passed in, so the SQLite tier at EMBEDDING_CACHE_PATH is never opened.
+    """
+    # Imported here so the standalone server does not load the pipeline
+    from app.cache import EmbeddingCache
+    from app.pipeline import TranscriptProcessor
+
+    processor = TranscriptProcessor(embedding_cache=EmbeddingCache(disk_path=None))
+    processor.client = mock_client(profile, app)
+    return processor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--chat-latency-per-token-ms", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+    profile = MockProfile(
+        embedding_dim=args.embedding_dim,
+        embedding_latency_ms=args.embedding_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        chat_latency_per_token_ms=args.chat_latency_per_token_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed
+    )
+    uvicorn.run(create_mock_app(profile), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Throughput of the pre-forked server (app/serve.py) from 1 to N workers
+
+Starts the mock OpenAI API as a subprocess, then `python -m app.serve` with
+each worker count in turn, and sends the same concurrent load of long
+transcripts to POST /generate-note (result cache bypassed). Prints req/s and
+latency percentiles per worker count.
+
+Usage:
+    python -m tests.serve_benchmark                       # 1, 2 and 4 workers
+    python -m tests.serve_benchmark --workers 1 2 4 8 --requests 64 --segments 600
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import argparse
+import asyncio
+import os
+import subprocess
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from tests.benchmark import synthetic_transcript
+
+ROOT = Path(__file__).parent.parent
+
+
+def _wait_until_up(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def _wait_for_workers(url: str, workers: int, timeout: float = 60.0):
+    """Until /health shows every worker has sent a heartbeat"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        health = httpx.get(url, timeout=5.0).json().get("workers") or {}
+        if sum(row["ready"] for row in health.get("workers", [])) >= workers:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"{workers} workers not ready within {timeout:.0f}s")
+
+
+async def _load(base_url: str, bodies: List[str], concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        async def one(body: str):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/generate-note?cache=bypass", content=body,
+                                             headers={"content-type": "application/json"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*(one(body) for body in bodies))
+    return latencies
+
+
+def run(workers: int, args, env: Dict[str, str], bodies: List[str]) -> Dict[str, float]:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        _wait_until_up(f"{base_url}/")
+        _wait_for_workers(f"{base_url}/health", workers)
+        # Warm-up: connection pools, lazy imports
+        asyncio.run(_load(base_url, bodies[:args.concurrency], args.concurrency))
+        start = time.perf_counter()
+        latencies = asyncio.run(_load(base_url, bodies, args.concurrency))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    ms = np.asarray(latencies) * 1000
+    return {
+        "throughput_rps": round(len(bodies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.serve throughput by worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=48)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--segments", type=int, default=600)
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--mock-port", type=int, default=8301)
+    parser.add_argument("--chat-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=5.0)
+    parser.add_argument("--embedding-backend", default="openai", help="hashing keeps the mock off the embedding path")
+    args = parser.parse_args()
+
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "tests.mock_openai", "--port", str(args.mock_port),
+         "--chat-latency-ms", str(args.chat_latency_ms), "--chat-latency-per-token-ms", "0",
+         "--embedding-latency-ms", str(args.embedding_latency_ms)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "EMBEDDING_BACKEND": args.embedding_backend,
+        # Cold caches: every request does the full work
+        "EMBEDDING_CACHE_PATH": "",
+        "EMBEDDING_CACHE_SIZE": "0",
+        "RESULT_CACHE_PATH": "",
+        "JOB_WORKERS": "0",
+    }
+    bodies = [
+        synthetic_transcript(args.segments, seed=i).model_dump_json() for i in range(args.requests)
+    ]
+    try:
+        _wait_until_up(f"http://127.0.0.1:{args.mock_port}/v1/models")
+        print(f"{args.requests} requests x {args.segments} segments, concurrency {args.concurrency}")
+        print(f"{'workers':>8} {'req/s':>10} {'speedup':>9} {'p50 ms':>10} {'p95 ms':>10}")
+        single = None
+        for workers in args.workers:
+            result = run(workers, args, env, bodies)
+            single = single or result["throughput_rps"]
+            print(
+                f"{workers:>8} {result['throughput_rps']:>10.2f} {result['throughput_rps'] / single:>8.2f}x "
+                f"{result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f}"
+            )
+    finally:
+        mock.terminate()
+        mock.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
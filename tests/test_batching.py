@@ -0,0 +1,116 @@
+"""
+Offline tests for the chunked embedding batcher
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+import random
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.batching import EmbeddingBatcher, EmbeddingCoalescer
+from app.context import request_context
+from app.resilience import RetryPolicy, UpstreamCaller
+
+
+class FakeEmbeddings:
+    """Embeds "text N" as [N, N], with random latency so chunks finish out of order"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_sizes = []
+
+    async def create(self, model, input):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.request_sizes.append(len(input))
+        await asyncio.sleep(random.uniform(0, 0.02))
+        self.in_flight -= 1
+        data = [SimpleNamespace(embedding=[float(t.split()[1])] * 2) for t in input]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=len(input)))
+
+
+def test_plan_respects_item_and_token_limits():
+    batcher = EmbeddingBatcher(max_items=3, max_tokens=10)
+    texts = ["x" * 8] * 5 + ["y" * 40]  # 2 tokens each, then one 10-token input
+
+    chunks = batcher.plan(texts)
+
+    assert [(start, end) for start, end, _ in chunks] == [(0, 3), (3, 5), (5, 6)]
+    assert all(tokens <= 10 for _, _, tokens in chunks)
+
+
+def test_chunks_reassembled_in_order_under_concurrency_limit():
+    embeddings = FakeEmbeddings()
+    client = SimpleNamespace(embeddings=embeddings)
+    batcher = EmbeddingBatcher(max_items=7, concurrency=2)
+    texts = [f"text {i}" for i in range(50)]
+
+    vectors, tokens = asyncio.run(batcher.embed(client, "model", texts))
+
+    assert vectors.shape == (50, 2)
+    np.testing.assert_array_equal(vectors[:, 0], np.arange(50))
+    assert tokens == 50
+    assert max(embeddings.request_sizes) == 7
+    assert embeddings.max_in_flight <= 2
+
+
+def test_concurrent_calls_are_coalesced():
+    embeddings = FakeEmbeddings()
+    client = SimpleNamespace(embeddings=embeddings)
+    coalescer = EmbeddingCoalescer(EmbeddingBatcher(), window_ms=5)
+
+    async def run():
+        return await asyncio.gather(
+            coalescer.embed(client, "model", ["text 1", "text 2"]),
+            coalescer.embed(client, "model", ["text 2", "text 3", "text 4"])
+        )
+
+    (first, first_tokens), (second, second_tokens) = asyncio.run(run())
+
+    assert len(embeddings.request_sizes) == 1
+    assert embeddings.request_sizes[0] == 4  # "text 2" deduplicated
+    np.testing.assert_array_equal(first[:, 0], [1, 2])
+    np.testing.assert_array_equal(second[:, 0], [2, 3, 4])
+    assert first_tokens + second_tokens == 4
+
+
+class FlakyEmbeddings:
+    """Times out on the first request, then embeds "text N" as [N, N]; records each attempt's timeout"""
+
+    def __init__(self):
+        self.timeouts = []
+
+    async def create(self, model, input, timeout):
+        self.timeouts.append(timeout)
+        if len(self.timeouts) == 1:
+            raise asyncio.TimeoutError()
+        data = [SimpleNamespace(embedding=[float(t.split()[1])] * 2) for t in input]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=len(input)))
+
+
+def test_coalesced_call_uses_batch_deadline_and_attributes_retries():
+    embeddings = FlakyEmbeddings()
+    client = SimpleNamespace(embeddings=embeddings)
+    upstream = UpstreamCaller(policy=RetryPolicy(base_delay=0.001))
+    coalescer = EmbeddingCoalescer(EmbeddingBatcher(upstream=upstream), window_ms=5)
+
+    async def request(texts, timeout):
+        with request_context(timeout=timeout) as ctx:
+            rows, _ = await coalescer.embed(client, "model", texts)
+            return rows, ctx
+
+    async def run():
+        # The short-deadline request opens the window
+        return await asyncio.gather(request(["text 1"], 0.05), request(["text 2"], 30))
+
+    (first, short_ctx), (second, long_ctx) = asyncio.run(run())
+
+    np.testing.assert_array_equal(first[:, 0], [1])
+    np.testing.assert_array_equal(second[:, 0], [2])
+    assert len(embeddings.timeouts) == 2
+    assert all(timeout > 1 for timeout in embeddings.timeouts)
+    assert short_ctx.retries == long_ctx.retries == {"embeddings": 1}
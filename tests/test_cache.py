@@ -0,0 +1,125 @@
+"""
+Offline tests for the content-addressed embedding cache
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import time
+
+import numpy as np
+
+from app.cache import EmbeddingCache, EmbeddingSnapshot, ResultCache, embedding_cache_key, result_cache_key
+from app.models import TranscriptSegment
+
+
+def test_key_normalizes_whitespace_and_separates_models():
+    assert embedding_cache_key("m", "I feel  tired\n") == embedding_cache_key("m", "I feel tired")
+    assert embedding_cache_key("m1", "same") != embedding_cache_key("m2", "same")
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_memory_items=2)
+    cache.put_many("m", ["a", "b"], np.eye(2))
+    cache.get_many("m", ["a"])  # "a" is now most recently used
+    cache.put_many("m", ["c"], np.ones((1, 2)))
+
+    hits = cache.get_many("m", ["a", "b", "c"])
+    assert hits[0] is not None and hits[2] is not None
+    assert hits[1] is None
+    assert cache.stats()["memory_items"] == 2
+
+
+def test_disk_tier_persists_and_is_bounded(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(max_memory_items=10, disk_path=path, max_disk_items=3)
+    cache.put_many("m", ["a", "b", "c", "d"], np.arange(8, dtype=np.float32).reshape(4, 2))
+    assert cache.stats()["disk_items"] == 3
+    cache.close()
+
+    reopened = EmbeddingCache(max_memory_items=10, disk_path=path, max_disk_items=3)
+    vectors = reopened.get_many("m", ["a", "b", "c", "d"])
+    assert sum(v is not None for v in vectors) == 3
+    np.testing.assert_array_equal(vectors[3], np.array([6, 7], dtype=np.float32))
+    assert reopened.stats()["hits"] == 3
+    reopened.close()
+
+
+def test_disk_tiers_shared_by_workers_stay_bounded(tmp_path):
+    # Both open the file before either writes, like pre-forked workers
+    path = str(tmp_path / "embeddings.sqlite")
+    workers = [EmbeddingCache(max_memory_items=10, disk_path=path, max_disk_items=3) for _ in range(2)]
+    workers[0].put_many("m", ["a", "b", "c"], np.zeros((3, 2), dtype=np.float32))
+    workers[1].put_many("m", ["d", "e", "f"], np.zeros((3, 2), dtype=np.float32))
+    assert workers[1].stats()["disk_items"] == 3
+    assert workers[0]._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 3
+
+    results_path = str(tmp_path / "results.sqlite")
+    result_workers = [ResultCache(max_items=2, disk_path=results_path) for _ in range(2)]
+    for i, key in enumerate("abcd"):
+        result_workers[i % 2].put(key, key.upper())
+    assert result_workers[0]._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 2
+
+    for cache in workers + result_workers:
+        cache.close()
+
+
+def test_snapshot_is_shared_read_only_tier(tmp_path):
+    disk_path = str(tmp_path / "embeddings.sqlite")
+    snapshot_path = str(tmp_path / "snapshot")
+    writer = EmbeddingCache(max_memory_items=10, disk_path=disk_path)
+    writer.put_many("m", ["a", "b", "c"], np.arange(6, dtype=np.float32).reshape(3, 2))
+    assert writer.export_snapshot(snapshot_path, max_items=2) == 2
+    writer.close()
+
+    reader = EmbeddingCache(max_memory_items=10, snapshot_path=snapshot_path)
+    vectors = reader.get_many("m", ["a", "b", "c", "d"])
+    assert sum(v is not None for v in vectors) == 2 and vectors[3] is None
+    row = next(i for i, v in enumerate(vectors) if v is not None)
+    np.testing.assert_array_equal(vectors[row], np.array([2 * row, 2 * row + 1], dtype=np.float32))
+    assert not vectors[row].flags.writeable
+    # Snapshot hits stay out of the process-local LRU
+    assert reader.stats()["memory_items"] == 0 and reader.stats()["snapshot_items"] == 2
+
+    missing = EmbeddingCache(snapshot_path=str(tmp_path / "missing"))
+    assert missing.snapshot is None
+
+
+def _segments(text="I feel tired."):
+    return [TranscriptSegment(id="seg_001", speaker="patient", start_ms=0, end_ms=1000, text=text)]
+
+
+def test_result_key_covers_content_and_configuration():
+    base = result_cache_key(_segments(), chat_model="a", prompt_version="1")
+    assert result_cache_key(_segments("I feel  tired. "), chat_model="a", prompt_version="1") == base
+    assert result_cache_key(_segments("I feel fine."), chat_model="a", prompt_version="1") != base
+    assert result_cache_key(_segments(), chat_model="b", prompt_version="1") != base
+    assert result_cache_key(_segments(), chat_model="a", prompt_version="2") != base
+
+
+def test_result_cache_ttl_and_lru():
+    cache = ResultCache(max_items=2, ttl_seconds=0.05)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == "A"
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+
+def test_result_cache_disk_tier(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = ResultCache(max_items=2, disk_path=path)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    cache.put("c", "C2")
+    assert cache.stats()["disk_items"] == 2
+    cache.close()
+
+    reopened = ResultCache(max_items=2, disk_path=path)
+    assert reopened.get("a") is None
+    assert reopened.get("c")[0] == "C2"
+    reopened.close()
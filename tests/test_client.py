@@ -0,0 +1,80 @@
+"""
+Offline tests for the managed OpenAI client and its connection pool stats
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import httpx
+
+from app.client import ManagedOpenAIClient, http2_available
+from tests.mock_openai import MockProfile, create_mock_app
+
+FAST = MockProfile(chat_latency_ms=20, chat_latency_per_token_ms=0, embedding_latency_ms=20, jitter=0)
+
+
+def _client(**kwargs) -> ManagedOpenAIClient:
+    transport = httpx.ASGITransport(app=create_mock_app(FAST))
+    return ManagedOpenAIClient(api_key="mock", base_url="http://mock-openai/v1", transport=transport, **kwargs)
+
+
+def test_tracks_concurrent_requests():
+    managed = _client()
+
+    async def run():
+        await asyncio.gather(*(
+            managed.client.embeddings.create(model="m", input=[f"text {i}"]) for i in range(5)
+        ))
+        await managed.aclose()
+
+    asyncio.run(run())
+    stats = managed.stats()
+
+    assert stats["requests_total"] == 5
+    assert stats["active_requests"] == 0
+    assert 1 <= stats["peak_active_requests"] <= 5
+    assert stats["closed"]
+
+
+def test_streamed_response_counts_as_active_until_read():
+    managed = _client()
+
+    async def run():
+        stream = await managed.client.chat.completions.create(
+            model="m",
+            messages=[{"role": "user", "content": "[00:00] PATIENT: I feel tired."}],
+            stream=True
+        )
+        active_while_streaming = managed.active_requests
+        async for _ in stream:
+            pass
+        return active_while_streaming
+
+    assert asyncio.run(run()) == 1
+    assert managed.active_requests == 0
+
+
+def test_prewarm_sends_token_free_requests():
+    managed = _client(prewarm_connections=3)
+
+    asyncio.run(managed.prewarm())
+
+    assert managed.requests_total == 3
+
+
+def test_default_transport_reports_pool_state():
+    managed = ManagedOpenAIClient(api_key="k", max_connections=10, max_keepalive_connections=5)
+    stats = managed.stats()
+
+    assert stats["open_connections"] == 0
+    assert stats["idle_connections"] == 0
+    assert stats["max_connections"] == 10
+    assert stats["utilization"] == 0.0
+    asyncio.run(managed.aclose())
+
+
+def test_http2_only_when_h2_is_installed():
+    managed = ManagedOpenAIClient(api_key="k", http2=True)
+    assert managed.http2 == http2_available()
+    asyncio.run(managed.aclose())
@@ -0,0 +1,42 @@
+"""
+Offline tests for per-request contexts and process-wide usage aggregates
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+from app.context import UsageAggregator, get_context, request_context
+
+
+def test_concurrent_requests_do_not_share_usage():
+    async def fake_request(session_id: str, tokens: int):
+        with request_context(session_id) as ctx:
+            # Stages run as child tasks and reach the context through the contextvar
+            async def stage():
+                await asyncio.sleep(0.01)
+                get_context().add_completion("gpt-4o-mini", tokens, 1)
+            await asyncio.gather(stage(), stage())
+            return ctx.usage.get_summary()
+
+    async def run():
+        return await asyncio.gather(fake_request("a", 100), fake_request("b", 7))
+
+    first, second = asyncio.run(run())
+
+    assert first["prompt_tokens"] == 200
+    assert second["prompt_tokens"] == 14
+
+
+def test_aggregator_rates_and_costs():
+    aggregator = UsageAggregator(window_seconds=60)
+    aggregator.record("gpt-4o-mini", prompt_tokens=1_000_000, completion_tokens=0)
+    aggregator.record("text-embedding-3-small", embedding_tokens=500)
+
+    snapshot = aggregator.snapshot()
+
+    chat = snapshot["by_model"]["gpt-4o-mini"]
+    assert chat["prompt_tokens"] == 1_000_000
+    assert chat["cost_usd"] == 0.15
+    assert snapshot["tokens_per_second"] > 0
+    assert snapshot["cost_per_hour_usd"] > 0
@@ -0,0 +1,84 @@
+"""
+Offline tests for the pluggable embedding backends
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+import importlib.util
+
+import numpy as np
+import pytest
+
+from app.embeddings import HashingEmbeddingBackend, OpenAIEmbeddingBackend, backend_from_env
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import FAST, create_mock_app, mock_processor
+
+
+def test_hashing_vectors_are_deterministic_and_lexically_similar():
+    backend = HashingEmbeddingBackend(dim=512)
+    vectors = backend.encode([
+        "patient: I haven't been sleeping well, maybe four hours a night.",
+        "Patient reports sleeping only four hours per night.",
+        "clinician: Let's review the breathing homework next week."
+    ])
+
+    assert vectors.shape == (3, 512)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.array_equal(vectors, backend.encode([
+        "patient: I haven't been sleeping well, maybe four hours a night.",
+        "Patient reports sleeping only four hours per night.",
+        "clinician: Let's review the breathing homework next week."
+    ]))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert backend.encode([""])[0].sum() == 0.0
+
+
+def test_local_backend_batches_on_the_thread_pool():
+    backend = HashingEmbeddingBackend(dim=64, batch_size=2, threads=2)
+    texts = [f"text number {i}" for i in range(5)]
+
+    vectors, tokens = asyncio.run(backend.embed(texts))
+
+    assert tokens == 0
+    assert np.array_equal(np.vstack(vectors), backend.encode(texts))
+    backend.close()
+
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setenv("EMBEDDING_HASH_DIM", "256")
+    assert backend_from_env(None, lambda: None).model == "hashing-256"
+
+    monkeypatch.setenv("EMBEDDING_BACKEND", "openai")
+    assert isinstance(backend_from_env(None, lambda: None), OpenAIEmbeddingBackend)
+
+    monkeypatch.setenv("EMBEDDING_BACKEND", "word2vec")
+    with pytest.raises(ValueError):
+        backend_from_env(None, lambda: None)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("sentence_transformers") is not None,
+                    reason="sentence-transformers is installed")
+def test_sentence_transformers_backend_needs_the_optional_package(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BACKEND", "sentence-transformers")
+    with pytest.raises(ImportError):
+        backend_from_env(None, lambda: None)
+
+
+def test_processor_uses_the_backend_threshold_and_skips_the_api(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BACKEND", "hashing")
+    monkeypatch.delenv("CITATION_THRESHOLD", raising=False)
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+
+    output = asyncio.run(processor.process_transcript(synthetic_transcript(20, seed=1), cache_mode="bypass"))
+
+    assert processor.citation_threshold == HashingEmbeddingBackend.citation_threshold
+    assert mock_app.state.calls["embeddings"] == 0
+    assert output.metadata["embedding_model"] == "hashing-1024"
+    assert output.metadata["token_usage"]["embedding_tokens"] == 0
+    assert any(span.citations for span in output.note_spans)
+
+    monkeypatch.setenv("CITATION_THRESHOLD", "0.3")
+    assert mock_processor().citation_threshold == 0.3
@@ -0,0 +1,89 @@
+"""
+Offline tests for CPU offloading and the event-loop lag monitor
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from app.context import get_context, request_context
+from app.executor import LoopLagMonitor, Offloader
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def _where():
+    return threading.current_thread().name, get_context().session_id
+
+
+def test_small_inputs_run_inline_and_large_ones_on_a_thread():
+    offloader = Offloader(mode="thread", min_segments=100)
+
+    async def run():
+        with request_context("s1"):
+            small = await offloader.run("t", _where, size=10)
+            large = await offloader.run("t", _where, size=100)
+        return small, large
+
+    (small_thread, _), (large_thread, session_id) = asyncio.run(run())
+    offloader.close()
+
+    assert small_thread == threading.main_thread().name
+    assert large_thread.startswith("offload")
+    # The request context follows the call into the pool
+    assert session_id == "s1"
+    assert offloader.stats()["offloaded"] == 1 and offloader.stats()["inline"] == 1
+
+
+def test_process_mode_only_takes_process_safe_calls():
+    offloader = Offloader(mode="process", min_segments=0, workers=1)
+
+    async def run():
+        return (
+            await offloader.run("t", os.getpid, size=1, process_safe=True),
+            await offloader.run("t", os.getpid, size=1)
+        )
+
+    in_process, in_thread = asyncio.run(run())
+    offloader.close()
+    assert in_process != os.getpid() and in_thread == os.getpid()
+
+    with pytest.raises(ValueError, match="OFFLOAD_MODE"):
+        Offloader(mode="fibers")
+
+
+def test_lag_monitor_sees_a_blocked_loop():
+    monitor = LoopLagMonitor(interval=0.01)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # blocks the loop
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+    stats = monitor.stats()
+    assert stats["samples"] >= 3
+    assert stats["lag_max_ms"] >= 150
+
+
+def test_offloaded_pipeline_matches_inline_output():
+    transcript = synthetic_transcript(60, seed=5)
+
+    def run(mode: str):
+        processor = mock_processor()
+        processor.offload = Offloader(mode=mode, min_segments=0)
+        try:
+            return asyncio.run(processor.process_transcript(transcript, cache_mode="bypass"))
+        finally:
+            processor.offload.close()
+
+    inline, offloaded = run("off"), run("thread")
+    assert [s.model_dump() for s in offloaded.note_spans] == [s.model_dump() for s in inline.note_spans]
+    assert offloaded.metadata["timings_ms"]["retrieval"] > 0
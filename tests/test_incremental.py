@@ -0,0 +1,215 @@
+"""
+Offline tests for incremental re-processing of edited transcripts
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import numpy as np
+
+from app.incremental import diff_segments, segment_hash
+from app.models import TranscriptSegment
+from app.pipeline import TranscriptProcessor
+from app.transcript import TranscriptColumns
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import FAST, create_mock_app, mock_processor
+
+
+def _dense_processor(app) -> TranscriptProcessor:
+    processor = mock_processor(app=app)
+    # Dense-only retrieval is where re-citing can be limited to reachable statements
+    processor.hybrid_retrieval = False
+    processor.candidate_pruning = False
+    return processor
+
+
+def _segment(seg_id: str, text: str, speaker: str = "patient") -> TranscriptSegment:
+    return TranscriptSegment(id=seg_id, speaker=speaker, start_ms=0, end_ms=1000, text=text)
+
+
+def _edit(transcript, index: int, **changes):
+    segments = list(transcript.segments)
+    segments[index] = segments[index].model_copy(update=changes)
+    return transcript.model_copy(update={"segments": segments})
+
+
+def test_diff_segments():
+    old = [_segment("a", "one"), _segment("b", "two"), _segment("c", "three"), _segment("d", "four")]
+    new = [
+        _segment("a", "one"),
+        _segment("b", "two  "),           # whitespace only: unchanged
+        _segment("c", "three, fixed"),    # ASR fix
+        _segment("x", "four"),            # renamed
+        _segment("e", "five")             # appended
+    ]
+
+    diff = diff_segments([segment_hash(s) for s in old], [s.id for s in old], TranscriptColumns.from_segments(new))
+
+    assert diff.unchanged == {0: 0, 1: 1, 3: 3}
+    assert diff.changed == [2]
+    assert diff.added == [4]
+    assert diff.removed == []
+    assert diff.fresh == [2, 4]
+
+
+def test_renamed_segments_are_recited_not_reused():
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+    transcript = synthetic_transcript(12, seed=5)
+    renamed = transcript.model_copy(update={"segments": [
+        seg.model_copy(update={"id": f"v2_{seg.id}"}) for seg in reversed(transcript.segments)
+    ]})
+
+    async def run():
+        first = await processor.process_transcript_incremental(transcript)
+        embeddings = processor.incremental.get(transcript.session_id).segment_embeddings.copy()
+        chat_calls = mock_app.state.calls["chat"]
+        updated = await processor.process_transcript_incremental(renamed)
+        assert mock_app.state.calls["chat"] == chat_calls
+        return first, embeddings, updated
+
+    first, embeddings, updated = asyncio.run(run())
+    new_ids = {seg.id for seg in renamed.segments}
+    state = processor.incremental.get(transcript.session_id)
+
+    assert updated.metadata["incremental"]["mode"] == "incremental"
+    assert sum(len(span.citations) for span in first.note_spans) > 0
+    assert all(c.id in new_ids for span in updated.note_spans for c in span.citations)
+    # Hashes and embedding rows follow the new (reversed) order
+    assert state.segment_hashes == [segment_hash(seg) for seg in renamed.segments]
+    assert np.array_equal(state.segment_embeddings, embeddings[::-1])
+    assert diff_segments(state.segment_hashes, state.segments.ids, TranscriptColumns.from_input(renamed)).is_empty
+
+
+def test_speaker_relabel_changes_the_hash():
+    assert segment_hash(_segment("a", "hi", "patient")) != segment_hash(_segment("a", "hi", "clinician"))
+
+
+def test_unchanged_transcript_reuses_previous_note():
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+    transcript = synthetic_transcript(20, seed=1)
+
+    async def run():
+        first = await processor.process_transcript_incremental(transcript)
+        calls = dict(mock_app.state.calls)
+        again = await processor.process_transcript_incremental(transcript)
+        assert mock_app.state.calls == calls
+        return first, again
+
+    first, again = asyncio.run(run())
+
+    assert first.metadata["incremental"] == {"mode": "full", "reason": "first_version"}
+    assert again.metadata["incremental"]["mode"] == "unchanged"
+    assert again.note_spans == first.note_spans
+
+
+def test_retimed_segments_are_recited_under_pruning():
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+    transcript = synthetic_transcript(20, seed=1)
+    # ASR re-alignment: same ids and text, every segment shifted by 1.5s
+    retimed = transcript.model_copy(update={"segments": [
+        seg.model_copy(update={"start_ms": seg.start_ms + 1500, "end_ms": seg.end_ms + 1500})
+        for seg in transcript.segments
+    ]})
+
+    async def run():
+        await processor.process_transcript_incremental(transcript)
+        chat_calls = mock_app.state.calls["chat"]
+        updated = await processor.process_transcript_incremental(retimed)
+        assert mock_app.state.calls["chat"] == chat_calls
+        return updated
+
+    updated = asyncio.run(run())
+    summary = updated.metadata["incremental"]
+
+    assert summary["mode"] == "incremental"
+    assert summary["segments_embedded"] == 0 and summary["sections_regenerated"] == []
+    assert summary["statements_recited"] == len(updated.note_spans)
+    assert np.array_equal(
+        processor.incremental.get(transcript.session_id).segments.start_ms,
+        TranscriptColumns.from_input(retimed).start_ms
+    )
+
+
+def test_appended_segments_only_embed_new_material_and_keep_numbering():
+    processor = _dense_processor(create_mock_app(FAST))
+    transcript = synthetic_transcript(24, seed=2, session_id="s")
+    extended = synthetic_transcript(26, seed=2, session_id="s")
+
+    async def run():
+        first = await processor.process_transcript_incremental(transcript)
+        return first, await processor.process_transcript_incremental(extended)
+
+    first, updated = asyncio.run(run())
+    summary = updated.metadata["incremental"]
+
+    assert summary["mode"] == "incremental"
+    assert summary["segments_added"] == 2 and summary["segments_embedded"] == 2
+    assert len(summary["sections_regenerated"]) < 4
+    assert summary["spans_reused"] > 0
+
+    before = {span.id: span for span in first.note_spans}
+    clean = [s for s in updated.note_spans if s.section not in summary["sections_regenerated"]]
+    assert clean and all(before[span.id] == span for span in clean)
+    # Numbers are unique even though new citations are appended after the old maximum
+    numbers = [c.num for span in updated.note_spans for c in span.citations]
+    assert len(numbers) == len(set(numbers))
+
+
+def test_corrected_segment_regenerates_only_sections_citing_it():
+    processor = _dense_processor(create_mock_app(FAST))
+    transcript = synthetic_transcript(20, seed=3)
+
+    async def run():
+        first = await processor.process_transcript_incremental(transcript)
+        cited = next(span for span in first.note_spans if span.citations)
+        index = next(i for i, seg in enumerate(transcript.segments) if seg.id == cited.citations[0].id)
+        corrected = _edit(transcript, index, text="I have been having panic attacks at work every morning.")
+        return first, cited, await processor.process_transcript_incremental(corrected)
+
+    first, cited, updated = asyncio.run(run())
+    summary = updated.metadata["incremental"]
+
+    assert summary["segments_changed"] == 1 and summary["segments_embedded"] == 1
+    assert cited.section in summary["sections_regenerated"]
+    assert summary["statements_recited"] < len(updated.note_spans)
+    first_ids = {span.id for span in first.note_spans}
+    new_ids = [span.id for span in updated.note_spans if span.id not in first_ids]
+    assert all(int(span_id[5:]) > len(first.note_spans) for span_id in new_ids)
+
+
+def test_hybrid_incremental_citations_match_a_full_citation_pass():
+    processor = mock_processor(app=create_mock_app(FAST))
+    assert processor.hybrid_retrieval and processor.candidate_pruning
+    transcript = synthetic_transcript(30, seed=3, session_id="s")
+    extended = synthetic_transcript(34, seed=3, session_id="s")
+
+    async def run():
+        await processor.process_transcript_incremental(transcript)
+        updated = await processor.process_transcript_incremental(extended)
+        state = processor.incremental.get("s")
+        full = await processor._extract_citations_rag(
+            state.statements, state.segments, state.segment_embeddings, state.statement_embeddings
+        )
+        return updated, full
+
+    updated, full = asyncio.run(run())
+
+    assert updated.metadata["incremental"]["mode"] == "incremental"
+    assert [[c.id for c in span.citations] for span in updated.note_spans] == \
+        [[c.id for c in span.citations] for span in full]
+
+
+def test_large_edits_fall_back_to_a_full_run():
+    processor = mock_processor(app=create_mock_app(FAST))
+
+    async def run():
+        await processor.process_transcript_incremental(synthetic_transcript(10, seed=4, session_id="s"))
+        return await processor.process_transcript_incremental(synthetic_transcript(10, seed=5, session_id="s"))
+
+    output = asyncio.run(run())
+
+    assert output.metadata["incremental"] == {"mode": "full", "reason": "too_many_changes"}
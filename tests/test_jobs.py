@@ -0,0 +1,134 @@
+"""
+Offline tests for the durable job queue and the /jobs endpoints
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobStore, QueueFullError
+from app.models import SOAPNoteOutput
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import FAST, create_mock_app, mock_client, mock_processor
+
+
+def test_claims_by_priority_then_age(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    low, _ = store.submit(synthetic_transcript(3, session_id="low"), priority=0)
+    high, _ = store.submit(synthetic_transcript(3, session_id="high"), priority=5)
+    later, _ = store.submit(synthetic_transcript(3, session_id="later"), priority=0)
+
+    claimed = [store.claim()[0] for _ in range(3)]
+
+    assert claimed == [high["job_id"], low["job_id"], later["job_id"]]
+    assert store.claim() is None
+    assert store.get(low["job_id"])["status"] == RUNNING
+
+
+def test_resubmission_is_idempotent_and_requeues_failures(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    job, created = store.submit(synthetic_transcript(3, session_id="s1"))
+    again, created_again = store.submit(synthetic_transcript(3, session_id="s1"))
+
+    assert created and not created_again
+    assert again["job_id"] == job["job_id"]
+
+    store.claim()
+    store.fail(job["job_id"], "boom")
+    retried, created_retry = store.submit(synthetic_transcript(3, session_id="s1"))
+
+    assert created_retry
+    assert retried["job_id"] == job["job_id"]
+    assert retried["status"] == QUEUED and retried["error"] is None
+
+
+def test_expired_lease_is_reclaimed_until_max_attempts(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease_seconds=0.01, max_attempts=2)
+    job, _ = store.submit(synthetic_transcript(3, session_id="s1"))
+
+    assert store.claim()[0] == job["job_id"]
+    time.sleep(0.02)
+    assert store.claim()[0] == job["job_id"]        # worker presumed dead
+    time.sleep(0.02)
+    assert store.claim() is None
+    assert store.get(job["job_id"])["status"] == FAILED
+
+
+def test_finished_jobs_are_purged_after_retention(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), retention_seconds=0.05)
+    done, _ = store.submit(synthetic_transcript(3, session_id="done"))
+    failed, _ = store.submit(synthetic_transcript(3, session_id="failed"))
+    store.claim()
+    store.claim()
+    store.complete(done["job_id"], SOAPNoteOutput(session_id="done", note_spans=[]))
+    store.fail(failed["job_id"], "boom")
+    waiting, _ = store.submit(synthetic_transcript(3, session_id="waiting"))
+
+    assert store.purge() == 0
+    time.sleep(0.06)
+    # Purged on the next claim; the queued job is claimed, not deleted
+    assert store.claim()[0] == waiting["job_id"]
+    assert store.get(done["job_id"]) is None and store.get(failed["job_id"]) is None
+    assert store.counts() == {QUEUED: 0, RUNNING: 1, SUCCEEDED: 0, FAILED: 0}
+
+
+def test_queue_limit_rejects_new_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    store.submit(synthetic_transcript(3, session_id="a"), max_queued=1)
+
+    with pytest.raises(QueueFullError):
+        store.submit(synthetic_transcript(3, session_id="b"), max_queued=1)
+    # Resubmitting an existing session is still answered
+    assert store.submit(synthetic_transcript(3, session_id="a"), max_queued=1)[1] is False
+
+
+def test_workers_process_jobs(tmp_path):
+    queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite")), mock_processor(), workers=2, poll_seconds=0.05)
+
+    async def run():
+        queue.start()
+        jobs = [queue.submit(synthetic_transcript(10, seed=i, session_id=f"s{i}"))[0] for i in range(4)]
+        for _ in range(200):
+            if all(queue.store.get(j["job_id"])["status"] == SUCCEEDED for j in jobs):
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return [queue.store.get(j["job_id"]) for j in jobs]
+
+    finished = asyncio.run(run())
+
+    assert [job["status"] for job in finished] == [SUCCEEDED] * 4
+    assert finished[0]["result"]["session_id"] == "s0"
+    assert finished[0]["result"]["note_spans"]
+
+
+def test_jobs_endpoints(tmp_path, monkeypatch):
+    monkeypatch.setenv("JOB_DB_PATH", str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setenv("JOB_POLL_SECONDS", "0.05")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    from app import main
+
+    with TestClient(main.app) as client:
+        main.processor.client = mock_client(app=create_mock_app(FAST))
+        body = synthetic_transcript(10, session_id="api_job").model_dump()
+
+        submitted = client.post("/jobs?priority=2", json=body)
+        assert submitted.status_code == 202
+        job_id = submitted.json()["job_id"]
+        assert submitted.headers["location"] == f"/jobs/{job_id}"
+        assert client.post("/jobs", json=body).status_code == 200
+
+        for _ in range(200):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] == SUCCEEDED:
+                break
+            time.sleep(0.02)
+
+        assert job["status"] == SUCCEEDED
+        assert job["result"]["session_id"] == "api_job"
+        assert client.get("/jobs/job_missing").status_code == 404
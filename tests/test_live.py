@@ -0,0 +1,106 @@
+"""
+Offline tests for live sessions (incremental ingestion over WebSocket)
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.live import LiveSession
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import FAST, create_mock_app, mock_client, mock_processor
+
+
+def _session(processor, messages, **kwargs) -> LiveSession:
+    async def send(message):
+        messages.append(message)
+
+    options = dict(embed_batch_size=8, embed_interval=0.01, refresh_segments=1000, refresh_seconds=60)
+    options.update(kwargs)
+    return LiveSession(processor, "live_1", "patient_1", send, **options)
+
+
+def test_drafts_push_only_changed_spans_and_finalize_reuses_work():
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+    segments = synthetic_transcript(30, seed=1).segments
+    messages = []
+
+    async def run():
+        session = _session(processor, messages)
+        session.start()
+        await session.add_segments(segments[:24])
+        first = await session.refresh()
+        await session.add_segments(segments[24:])
+        await asyncio.sleep(0.05)   # the micro-batch embedder catches up
+        embeddings_before_final = mock_app.state.calls["embeddings"]
+        final = await session.finalize()
+        await session.close()
+        return first, final, embeddings_before_final
+
+    first, final, embeddings_before_final = asyncio.run(run())
+    drafts = [m for m in messages if m["type"] == "draft"]
+
+    assert drafts[0]["version"] == 1
+    assert len(drafts[0]["spans"]) == len(first.note_spans)
+    assert drafts[1]["order"] == [span.id for span in final.note_spans]
+    assert len(drafts[1]["spans"]) < len(final.note_spans)
+    assert messages[-1]["type"] == "final"
+    assert final.metadata["live"]["segments"] == 30
+    assert final.metadata["incremental"]["segments_embedded"] == 6
+    # New segments were embedded while the session ran, not at finalize
+    assert mock_app.state.calls["embeddings"] - embeddings_before_final <= 1
+
+
+def test_corrected_segment_replaces_the_original():
+    processor = mock_processor(app=create_mock_app(FAST))
+    segments = synthetic_transcript(10, seed=2).segments
+    messages = []
+
+    async def run():
+        session = _session(processor, messages)
+        session.start()
+        await session.add_segments(segments)
+        fixed = segments[3].model_copy(update={"text": "Corrected line."})
+        await session.add_segments([fixed])
+        await session.add_segments([fixed])    # exact resend is a no-op
+        final = await session.finalize()
+        await session.close()
+        return session, final
+
+    session, final = asyncio.run(run())
+
+    assert len(session.segments) == 10
+    assert session.segments[3].text == "Corrected line."
+    assert final.metadata["total_segments"] == 10
+
+
+def test_live_websocket_endpoint(monkeypatch):
+    monkeypatch.setenv("JOB_DB_PATH", "")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", "")
+    monkeypatch.setenv("LIVE_EMBED_INTERVAL_MS", "10")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    from app import main
+
+    with TestClient(main.app) as client:
+        main.processor.client = mock_client(app=create_mock_app(FAST))
+        segments = [seg.model_dump() for seg in synthetic_transcript(12, seed=3).segments]
+
+        with client.websocket_connect("/live/ws_session?patient_id=p1") as ws:
+            ws.send_json({"type": "segments", "segments": segments[:8]})
+            assert ws.receive_json() == {"type": "ack", "segments": 8, "pending": 8}
+            ws.send_json({"type": "bogus"})
+            assert ws.receive_json()["type"] == "error"
+            for segment in segments[8:]:
+                ws.send_json({"type": "segment", "segment": segment})
+            ws.send_json({"type": "finalize"})
+            received = []
+            while not received or received[-1]["type"] != "final":
+                received.append(ws.receive_json())
+
+        note = received[-1]["note"]
+        assert note["session_id"] == "ws_session"
+        assert note["metadata"]["live"]["segments"] == 12
+        assert any(m["type"] == "draft" for m in received)
@@ -0,0 +1,58 @@
+"""
+Offline tests for the Prometheus-style metrics registry
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+from app import metrics
+from app.metrics import Counter, Gauge, Histogram, Registry
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(Histogram("stage_seconds", "Stage latency", ("stage",), buckets=(0.1, 1.0)))
+    histogram.observe(0.05, stage="parse")
+    histogram.observe(0.5, stage="parse")
+    histogram.observe(5.0, stage="parse")
+
+    text = registry.render()
+
+    assert 'stage_seconds_bucket{stage="parse",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="parse",le="1"} 2' in text
+    assert 'stage_seconds_bucket{stage="parse",le="+Inf"} 3' in text
+    assert 'stage_seconds_count{stage="parse"} 3' in text
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = registry.register(Counter("calls_total", "Calls", ("model",)))
+    gauge = registry.register(Gauge("in_flight", "In flight"))
+    counter.inc(model="gpt-4o-mini")
+    counter.inc(2, model="gpt-4o-mini")
+
+    with gauge.track_inprogress():
+        assert gauge.get() == 1
+    text = registry.render()
+
+    assert 'calls_total{model="gpt-4o-mini"} 3' in text
+    assert "in_flight 0" in text
+    assert "# TYPE calls_total counter" in text
+
+
+def test_time_to_first_span_is_not_a_stage():
+    processor = mock_processor()
+    before = metrics.FIRST_SPAN_LATENCY.get_count()
+
+    async def collect():
+        return [event async for event in processor.stream_transcript(synthetic_transcript(20, seed=7))]
+
+    events = asyncio.run(collect())
+
+    assert "first_span" in events[-1][1]["timings_ms"]
+    assert metrics.FIRST_SPAN_LATENCY.get_count() == before + 1
+    assert metrics.STAGE_LATENCY.get_count(stage="first_span") == 0
+    assert metrics.STAGE_LATENCY.get_count(stage="retrieval") > 0
@@ -0,0 +1,143 @@
+"""
+Offline end-to-end tests against the mock OpenAI API
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import numpy as np
+import openai
+import pytest
+
+from tests.mock_openai import FAST, MockProfile, create_mock_app, deterministic_embedding, mock_client, mock_processor
+from tests.benchmark import compare, synthetic_transcript
+
+
+def test_embeddings_are_deterministic_and_similarity_preserving():
+    a = np.asarray(deterministic_embedding("I have not been sleeping well", 256))
+    b = np.asarray(deterministic_embedding("I have not been sleeping well", 256))
+    c = np.asarray(deterministic_embedding("Patient reports not sleeping well", 256))
+    d = np.asarray(deterministic_embedding("We will review the homework", 256))
+
+    assert np.array_equal(a, b)
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert a @ c > a @ d
+
+
+def test_process_transcript_end_to_end():
+    processor = mock_processor()
+    transcript = synthetic_transcript(30, seed=1)
+
+    output = asyncio.run(processor.process_transcript(transcript))
+
+    assert output.session_id == transcript.session_id
+    assert {span.section for span in output.note_spans} == {"subjective", "objective", "assessment", "plan"}
+    assert any(span.citations for span in output.note_spans)
+    segment_ids = {seg.id for seg in transcript.segments}
+    for span in output.note_spans:
+        assert all(citation.id in segment_ids for citation in span.citations)
+    assert output.metadata["token_usage"]["total_tokens"] > 0
+    assert output.metadata["generation_mode"] == "single"
+
+
+def test_long_transcript_uses_map_reduce():
+    processor = mock_processor()
+    processor.max_prompt_tokens = 2000
+    processor.chunk_max_tokens = 1000
+
+    output = asyncio.run(processor.process_transcript(synthetic_transcript(200, seed=2)))
+
+    assert output.metadata["generation_mode"] == "map_reduce"
+    assert output.metadata["generation_chunks"] > 1
+    assert output.note_spans
+
+
+def test_stream_transcript_end_to_end():
+    processor = mock_processor()
+
+    async def collect():
+        return [event async for event in processor.stream_transcript(synthetic_transcript(30, seed=3))]
+
+    events = asyncio.run(collect())
+
+    assert events[-1][0] == "done"
+    spans = [data for event, data in events if event == "span"]
+    assert spans and spans[0]["id"] == "span_001"
+    assert events[-1][1]["token_usage"]["completion_tokens"] > 0
+
+
+def test_result_cache_modes():
+    mock_app = create_mock_app(FAST)
+    processor = mock_processor(app=mock_app)
+    transcript = synthetic_transcript(20, seed=4)
+    retry = transcript.model_copy(update={"session_id": "retry"})
+
+    async def run():
+        first = await processor.process_transcript(transcript)
+        calls = dict(mock_app.state.calls)
+        cached = await processor.process_transcript(retry)
+        assert mock_app.state.calls == calls
+        refreshed = await processor.process_transcript(transcript, cache_mode="refresh")
+        bypassed = await processor.process_transcript(transcript, cache_mode="bypass")
+        return first, cached, refreshed, bypassed
+
+    first, cached, refreshed, bypassed = asyncio.run(run())
+
+    assert first.metadata["result_cache"]["status"] == "miss"
+    assert cached.metadata["result_cache"]["hit"]
+    assert cached.session_id == "retry"
+    assert [s.text for s in cached.note_spans] == [s.text for s in first.note_spans]
+    assert refreshed.metadata["result_cache"]["status"] == "refresh"
+    assert bypassed.metadata["result_cache"]["status"] == "bypass"
+
+
+def test_concurrent_identical_requests_share_one_run():
+    processor = mock_processor()
+    transcript = synthetic_transcript(20, seed=5)
+
+    async def run():
+        return await asyncio.gather(*(processor.process_transcript(transcript) for _ in range(3)))
+
+    outputs = asyncio.run(run())
+
+    statuses = sorted(output.metadata["result_cache"]["status"] for output in outputs)
+    assert statuses == ["miss", "shared", "shared"]
+
+
+def test_waiter_recomputes_when_the_shared_run_is_cancelled():
+    processor = mock_processor()
+    transcript = synthetic_transcript(20, seed=6)
+
+    async def run():
+        owner = asyncio.ensure_future(processor.process_transcript(transcript))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(processor.process_transcript(transcript))
+        await asyncio.sleep(0.01)
+        # e.g. the owner's client disconnected
+        owner.cancel()
+        return owner, await waiter
+
+    owner, output = asyncio.run(run())
+
+    assert owner.cancelled()
+    assert output.metadata["result_cache"]["status"] == "miss"
+    assert len(output.note_spans) > 0
+
+
+def test_error_profile_surfaces_upstream_errors():
+    processor = mock_processor(MockProfile(chat_latency_ms=5, embedding_latency_ms=1, error_rate=1.0, error_status=429))
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(processor.process_transcript(synthetic_transcript(10)))
+
+
+def test_benchmark_compare_flags_regressions():
+    baseline = {"s": {"p50_ms": 100, "p95_ms": 200, "p99_ms": 300, "throughput_rps": 10, "peak_memory_mb": 5}}
+    same = {"s": dict(baseline["s"])}
+    slower = {"s": {**baseline["s"], "p95_ms": 300, "throughput_rps": 5}}
+
+    assert compare(same, baseline, 0.25) == []
+    regressions = compare(slower, baseline, 0.25)
+    assert any("p95_ms" in line for line in regressions)
+    assert any("throughput_rps" in line for line in regressions)
@@ -0,0 +1,151 @@
+"""
+Offline tests for the cacheable prompt prefix and the compact transcript format
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import pytest
+
+from app.models import TranscriptInput
+from app.prompt_builder import NoteFormatError, PromptBuilder, speaker_codes, validate_json
+from app.transcript import TranscriptColumns
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def _columns(segments):
+    return TranscriptColumns.from_input(TranscriptInput(session_id="s", patient_id="p", segments=[
+        {"id": f"seg_{i}", "speaker": speaker, "start_ms": start_ms, "end_ms": start_ms + 1000, "text": text}
+        for i, (speaker, start_ms, text) in enumerate(segments)
+    ]))
+
+
+def test_compact_format_merges_turns_and_marks_time_windows():
+    columns = _columns([
+        ("clinician", 0, "How has your sleep been?"),
+        ("patient", 5_000, "Not great."),
+        ("patient", 20_000, "Work is stressful."),
+        ("patient", 65_000, "I wake up at 3am."),
+        ("clinician", 70_000, "Let's try a sleep diary."),
+    ])
+
+    text = PromptBuilder("compact", timestamp_seconds=60).format_transcript(columns)
+
+    assert text.split("\n") == [
+        "[00:00] C (clinician): How has your sleep been?",
+        "P (patient): Not great. Work is stressful.",
+        "[01:00] P: I wake up at 3am.",
+        "C: Let's try a sleep diary.",
+    ]
+    assert speaker_codes(["clinician", "client", "patient"]) == ["C", "C2", "P"]
+
+
+def test_source_ids_mode_marks_every_segment():
+    columns = _columns([
+        ("clinician", 0, "How has your sleep been?"),
+        ("patient", 5_000, "Not great."),
+        ("patient", 20_000, "Work is stressful."),
+    ])
+    builder = PromptBuilder("compact", source_ids=True)
+
+    text = builder.format_transcript(columns)
+
+    assert text.split("\n") == [
+        "[00:00] C (clinician): <seg_0> How has your sleep been?",
+        "P (patient): <seg_1> Not great. <seg_2> Work is stressful.",
+    ]
+    assert '"source_ids"' in builder.system_prompt and '"source_ids"' not in PromptBuilder().system_prompt
+    assert int(builder.line_chars(columns).sum()) == len(text) + 1 - len(" (clinician)") - len(" (patient)")
+
+
+def test_appending_segments_only_changes_the_last_line():
+    columns = TranscriptColumns.from_input(synthetic_transcript(80, seed=2))
+    builder = PromptBuilder("compact")
+
+    before = builder.format_transcript(columns, 0, 60).split("\n")
+    after = builder.format_transcript(columns).split("\n")
+
+    assert after[:len(before) - 1] == before[:-1]
+    assert after[len(before) - 1].startswith(before[-1])
+
+
+def test_system_prefix_is_shared_and_compact_is_cheaper():
+    builder = PromptBuilder("compact")
+    a = TranscriptColumns.from_input(synthetic_transcript(40, seed=1))
+    b = TranscriptColumns.from_input(synthetic_transcript(90, seed=9))
+
+    first = builder.soap(builder.format_transcript(a))
+    second = builder.chunk(builder.format_transcript(b), 1, 2, "00:00", "15:00")
+    assert first.system is second.system and first.response_format is second.response_format
+    assert first.user.startswith("Therapy session transcript:\n\n")
+    assert second.user.startswith("Therapy session transcript:\n\n")
+
+    text = builder.format_transcript(b)
+    budget = builder.budget(b, text)
+    full = PromptBuilder("full").format_transcript(b)
+    assert budget["transcript_tokens"] < len(full) // 4
+    assert abs(budget["full_format_tokens"] - len(full) // 4) <= 2
+    assert budget["saved_tokens"] > 0
+    # The chunk planner's per-segment estimate stays close to the real length
+    assert abs(int(builder.line_chars(b).sum()) - len(text)) < 0.05 * len(text)
+
+
+def test_structured_output_schema_is_strict_and_validated():
+    builder = PromptBuilder(source_ids=True)
+    prompt = builder.soap("...")
+    schema = prompt.response_format["json_schema"]["schema"]
+    sentence = schema["properties"]["plan"]["items"]
+
+    assert prompt.response_format["json_schema"]["strict"] is True
+    assert schema["required"] == ["subjective", "objective", "assessment", "plan"]
+    assert sentence["required"] == ["text", "source_ids"] and sentence["additionalProperties"] is False
+
+    note = {section: [{"text": "Stable.", "source_ids": ["seg_1"]}] for section in schema["required"]}
+    validate_json(note, schema)
+    note["plan"] = "Follow up. Review sleep log."
+    with pytest.raises(NoteFormatError, match=r"\$\.plan: expected an array"):
+        validate_json(note, schema)
+
+    # Rewriting part of a note reuses the same response format object (a stable cached prefix)
+    assert builder.sections("...", "{}", ["plan"]).response_format is prompt.response_format
+    assert PromptBuilder(structured=False).soap("...").response_format == {"type": "json_object"}
+
+
+def test_empty_section_instruction_matches_the_output_mode():
+    for structured, empty, other in [(True, "an empty list", "empty string"), (False, "an empty string", "empty list")]:
+        builder = PromptBuilder(structured=structured)
+        prompts = [
+            builder.chunk("...", 1, 2, "00:00", "15:00").user,
+            builder.sections("...", "{}", ["plan"]).user,
+            builder.reduce("...").system,
+        ]
+        assert all(empty in prompt and other not in prompt for prompt in prompts)
+
+
+def test_sentence_lists_are_not_resplit():
+    processor = mock_processor()
+    sentences = ["Patient saw Dr. Lee, e.g. for sleep.", "Takes sertraline 50 mg. daily."]
+
+    structured = processor._parse_soap_note({"plan": [{"text": t} for t in sentences]})
+    legacy = processor._parse_soap_note({"plan": " ".join(sentences)})
+
+    assert [s["text"] for s in structured] == sentences
+    # The regex fallback breaks on every abbreviation
+    assert len(legacy) == 5
+
+
+def test_repeated_session_reports_cached_prompt_tokens():
+    processor = mock_processor()
+    transcript = synthetic_transcript(120, seed=3)
+
+    first = asyncio.run(processor.process_transcript(transcript, cache_mode="bypass"))
+    second = asyncio.run(processor.process_transcript(transcript, cache_mode="bypass"))
+
+    assert first.metadata["prompt_budget"]["cached_tokens"] == 0
+    budget = second.metadata["prompt_budget"]
+    assert budget["format"] == "compact" and budget["saved_tokens"] > 0
+    assert 0 < budget["cached_tokens"] <= budget["prompt_tokens"]
+    assert second.metadata["token_usage"]["cached_prompt_tokens"] == budget["cached_tokens"]
+    assert len(second.note_spans) > 0 and any(span.citations for span in second.note_spans)
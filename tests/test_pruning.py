@@ -0,0 +1,75 @@
+"""
+Offline tests for speaker- and time-aware candidate pruning
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import numpy as np
+
+from app.pruning import SectionPrior, SegmentFilter
+from app.transcript import TranscriptColumns
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def test_section_priors_select_speakers_and_late_segments():
+    segments = TranscriptColumns.from_input(synthetic_transcript(40, seed=1))
+    segment_filter = SegmentFilter(segments, min_candidates=4)
+
+    subjective = segment_filter.section_candidates("subjective")
+    plan = segment_filter.section_candidates("plan")
+
+    assert all(segments[i].speaker == "patient" for i in subjective)
+    assert len(subjective) == 20
+    assert all(segments[i].speaker == "clinician" for i in plan)
+    assert 0 < len(plan) < 20 and plan[-1] == 38
+    assert segment_filter.section_candidates("objective") is None
+
+
+def test_too_few_candidates_fall_back_to_all_segments():
+    segments = TranscriptColumns.from_input(synthetic_transcript(10, seed=2))
+    segment_filter = SegmentFilter(segments, priors={"plan": SectionPrior(speakers=("clinician",), start=0.9)})
+
+    assert segment_filter.candidates("plan") is None
+    assert segment_filter.candidates("unknown") is None
+
+
+def test_chunk_candidates_are_intersected_and_shared():
+    segments = TranscriptColumns.from_input(synthetic_transcript(60, seed=3))
+    segment_filter = SegmentFilter(segments, min_candidates=4)
+    chunk = np.arange(0, 30)
+    small_chunk = np.arange(0, 6)
+
+    first = segment_filter.candidates("subjective", chunk)
+    again = segment_filter.candidates("subjective", chunk)
+
+    assert first is again
+    assert set(first.tolist()) == {i for i in range(30) if segments[i].speaker == "patient"}
+    # Three patient segments are too few: keep the whole chunk
+    assert segment_filter.candidates("subjective", small_chunk) is small_chunk
+
+
+def test_extract_citations_skips_segments_outside_the_section_prior():
+    processor = mock_processor()
+    processor.hybrid_retrieval = False
+    processor.citation_threshold = -1.0
+    transcript = TranscriptColumns.from_input(synthetic_transcript(20, seed=4))
+    rng = np.random.default_rng(0)
+    segment_embeddings = rng.normal(size=(20, 16))
+    # The statement is closest to a clinician segment (index 0)
+    statement_embeddings = segment_embeddings[[0]] + 0.01
+    statements = [{"section": "subjective", "text": "Reports poor sleep.", "candidates": None}]
+
+    async def run():
+        return await processor._extract_citations_rag(
+            statements, transcript, segment_embeddings, statement_embeddings
+        )
+
+    spans = asyncio.run(run())
+    assert spans[0].citations
+    assert all(transcript.speaker_at(transcript.position(c.id)) == "patient" for c in spans[0].citations)
+
+    processor.candidate_pruning = False
+    assert asyncio.run(run())[0].citations[0].id == transcript.ids[0]
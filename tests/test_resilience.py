@@ -0,0 +1,154 @@
+"""
+Offline tests for upstream retries, deadlines, circuit breaking and retry budgets
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from app.context import request_context
+from app.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    RetryBudget,
+    RetryPolicy,
+    UpstreamCaller,
+    retry_after_seconds
+)
+from tests.mock_openai import MockProfile, mock_client
+
+FAST = dict(chat_latency_ms=1, chat_latency_per_token_ms=0, embedding_latency_ms=1, jitter=0)
+
+
+def _status_error(status: int, headers=None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://mock/v1/embeddings")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def _caller(**kwargs) -> UpstreamCaller:
+    policy = RetryPolicy(max_attempts=kwargs.pop("max_attempts", 4), base_delay=0.001, max_delay=0.01)
+    return UpstreamCaller(policy=policy, **kwargs)
+
+
+def test_retries_transient_errors_and_honors_retry_after():
+    client = mock_client(MockProfile(fail_first=2, retry_after_seconds=0.1, **FAST))
+    caller = _caller()
+
+    async def run():
+        with request_context("s1") as ctx:
+            start = time.perf_counter()
+            response = await caller.call(
+                "embeddings", "m",
+                lambda timeout: client.embeddings.create(model="m", input=["hello"], timeout=timeout)
+            )
+            return response, ctx, time.perf_counter() - start
+
+    response, ctx, elapsed = asyncio.run(run())
+
+    assert len(response.data) == 1
+    assert ctx.retries == {"embeddings": 2}
+    assert elapsed >= 0.2
+
+
+def test_non_retryable_errors_fail_immediately():
+    caller = _caller()
+    calls = []
+
+    async def bad_request(timeout):
+        calls.append(timeout)
+        raise _status_error(400)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(caller.call("chat", "m", bad_request))
+    assert len(calls) == 1
+
+
+def test_can_retry_false_stops_retries():
+    caller = _caller()
+    calls = []
+
+    async def failing(timeout):
+        calls.append(timeout)
+        raise _status_error(503)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(caller.call("chat_stream", "m", failing, can_retry=lambda: False))
+    assert len(calls) == 1
+
+
+def test_deadline_is_passed_as_timeout_and_enforced():
+    caller = _caller()
+    timeouts = []
+
+    async def slow_failure(timeout):
+        timeouts.append(timeout)
+        await asyncio.sleep(0.06)
+        raise _status_error(500)
+
+    async def run():
+        with request_context("s2", timeout=0.1):
+            await caller.call("chat", "m", slow_failure)
+
+    with pytest.raises((DeadlineExceededError, openai.APIStatusError)):
+        asyncio.run(run())
+    assert 0 < timeouts[0] <= 0.1
+    assert len(timeouts) <= 2
+
+
+def test_circuit_opens_and_recovers():
+    breaker = CircuitBreaker("m", failure_threshold=2, reset_seconds=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError) as info:
+        breaker.before_call()
+    assert info.value.retry_after > 0
+
+    time.sleep(0.06)
+    breaker.before_call()                  # half-open trial
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()              # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_fails_fast_without_calling_upstream():
+    caller = _caller(failure_threshold=1, reset_seconds=60, max_attempts=1)
+    calls = []
+
+    async def failing(timeout):
+        calls.append(timeout)
+        raise _status_error(500)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(caller.call("chat", "m", failing))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(caller.call("chat", "m", failing))
+    assert len(calls) == 1
+    assert caller.snapshot()["m"]["state"] == "open"
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.5, min_retries=1, window_seconds=60)
+    for _ in range(4):
+        budget.record_request()
+
+    granted = sum(budget.try_acquire() for _ in range(10))
+
+    assert granted == 3
+
+
+def test_retry_after_header_parsing():
+    assert retry_after_seconds(_status_error(429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(_status_error(429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(_status_error(429)) is None
+    assert RetryPolicy(base_delay=0.01).delay(1, retry_after=0.5) >= 0.5
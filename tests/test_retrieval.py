@@ -0,0 +1,201 @@
+"""
+Offline tests for vectorized top-k citation retrieval
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import asyncio
+import time
+
+import numpy as np
+
+from app import retrieval
+from app.retrieval import BM25Index, SegmentIndex, hybrid_search, normalize_rows, tokenize, verify_claims
+from app.transcript import TranscriptColumns
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def _reference_top_k(queries, segments, k):
+    """Per-statement cosine similarity + full argsort (the previous implementation)"""
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    s = segments / np.linalg.norm(segments, axis=1, keepdims=True)
+    sims = q @ s.T
+    indices = np.argsort(sims, axis=1)[:, -k:][:, ::-1]
+    return indices, np.take_along_axis(sims, indices, axis=1)
+
+
+def test_matches_reference_implementation():
+    rng = np.random.default_rng(0)
+    segments = rng.normal(size=(200, 32))
+    queries = rng.normal(size=(15, 32))
+
+    result = SegmentIndex(segments).search(queries, top_k=3, threshold=0.2)
+    ref_indices, ref_scores = _reference_top_k(queries, segments, 3)
+
+    np.testing.assert_array_equal(result.indices, ref_indices)
+    np.testing.assert_allclose(result.scores, ref_scores, rtol=1e-5)
+    np.testing.assert_array_equal(result.mask, result.scores >= 0.2)
+
+
+def test_fewer_segments_than_k():
+    segments = np.array([[1.0, 0.0], [0.0, 1.0]])
+    result = SegmentIndex(segments).search(np.array([[1.0, 0.1]]), top_k=3, threshold=0.5)
+
+    assert result.indices.shape == (1, 2)
+    assert result.indices[0].tolist() == [0, 1]
+    assert result.mask[0].tolist() == [True, False]
+
+
+def test_empty_inputs():
+    index = SegmentIndex(np.eye(3))
+    result = index.search(np.zeros((0, 3)), top_k=3)
+    assert result.indices.shape == (0, 3)
+    assert result.best_scores.shape == (0,)
+
+
+def test_normalize_rows_keeps_zero_rows():
+    normed = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert normed.dtype == np.float32
+    np.testing.assert_allclose(normed, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_candidates_restrict_search_per_query():
+    segments = np.eye(4)
+    queries = np.array([[1.0, 0.9, 0.0, 0.0], [1.0, 0.9, 0.0, 0.0]])
+    second_half = np.array([2, 3])
+
+    result = SegmentIndex(segments).search(queries, top_k=3, threshold=0.0, candidates=[None, second_half])
+
+    assert result.indices[0].tolist() == [0, 1, 2]
+    # Only two candidates: third column is padding and never passes the mask
+    assert set(result.indices[1][:2].tolist()) == {2, 3}
+    assert result.indices[1][2] == -1
+    assert result.mask[1].tolist() == [True, True, False]
+
+
+def test_verify_claims_scores_only_claimed_segments():
+    segments = np.eye(4)
+    queries = np.array([[1.0, 0.5, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [1.0, 0.0, 0.0, 0.0]])
+    claims = [np.array([1, 0, 3]), np.array([3]), np.array([], dtype=np.int64)]
+
+    result = verify_claims(segments, queries, claims, top_k=2, threshold=0.3)
+
+    # Best claims first, at most k of them; unclaimed segments are never returned
+    assert result.indices[0].tolist() == [0, 1]
+    assert result.mask[0].tolist() == [True, True]
+    assert result.indices[1].tolist() == [3, -1] and not result.mask[1].any()
+    assert result.indices[2].tolist() == [-1, -1] and not result.mask[2].any()
+
+
+def test_source_ids_are_verified_and_unsupported_statements_searched():
+    processor = mock_processor()
+    processor.citation_mode = "source_ids"
+    processor.hybrid_retrieval = False
+    processor.candidate_pruning = False
+    transcript = TranscriptColumns.from_input(synthetic_transcript(20, seed=4))
+    segment_embeddings = np.eye(20)
+    statement_embeddings = segment_embeddings[[3, 5, 7]] + 0.01
+    statements = [
+        # Supported claim: cited as named
+        {"section": "subjective", "text": "a", "candidates": None, "source_ids": ["seg_004", "seg_004"]},
+        # Unsupported and unknown ids: searched instead
+        {"section": "subjective", "text": "b", "candidates": None, "source_ids": ["seg_001", "nope"]},
+        {"section": "plan", "text": "c", "candidates": None, "source_ids": None},
+    ]
+
+    spans = asyncio.run(processor._extract_citations_rag(
+        statements, transcript, segment_embeddings, statement_embeddings
+    ))
+
+    assert [[c.id for c in span.citations] for span in spans] == [["seg_004"], ["seg_006"], ["seg_008"]]
+
+
+TEXTS = [
+    "I started sertraline 50 mg last month.",
+    "Work has been stressful since the reorganization.",
+    "I sleep about five hours a night.",
+    "My sister visited on the weekend.",
+]
+
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert tokenize("The patient reports sleeping badly, 5 nights.") == ["sleep", "bad", "5", "night"]
+
+
+def test_bm25_ranks_exact_term_matches_first():
+    index = BM25Index(TEXTS)
+    scores = index.score_many(["Sertraline was started at 50 mg.", "nothing matches here"])
+
+    assert scores[0].argmax() == 0
+    assert 0 < scores[0, 0] < 1
+    assert not scores[1].any()
+
+
+def test_hybrid_rescues_strong_lexical_match_just_below_threshold():
+    # Dense scores: segment 1 is a loose paraphrase, segment 0 the exact fact just under 0.5
+    segments = np.array([[0.45, 0.893], [0.55, 0.835], [0.0, 1.0], [-1.0, 0.0]])
+    query = np.array([[1.0, 0.0]])
+    text = ["Started sertraline 50 mg last month."]
+
+    dense = SegmentIndex(segments).search(query, top_k=2, threshold=0.5)
+    hybrid = hybrid_search(SegmentIndex(segments), BM25Index(TEXTS), query, text, top_k=2, threshold=0.5)
+
+    assert dense.indices[0][dense.mask[0]].tolist() == [1]
+    assert hybrid.indices[0][0] == 0
+    assert hybrid.mask[0].tolist() == [True, True]
+    # Scores stay cosine similarities
+    np.testing.assert_allclose(hybrid.scores[0], [0.45, 0.55], rtol=1e-3)
+    # ...in fused order, so the best one is not necessarily first
+    np.testing.assert_allclose(hybrid.best_scores, [0.55], rtol=1e-3)
+
+
+def test_hybrid_respects_candidates():
+    segments = np.eye(4)
+    query = np.array([[1.0, 0.2, 0.1, 0.0]])
+    result = hybrid_search(
+        SegmentIndex(segments), BM25Index(TEXTS), query, ["sertraline 50 mg"],
+        top_k=3, threshold=0.0, candidates=[np.array([2, 3])]
+    )
+
+    assert set(result.indices[0][:2].tolist()) == {2, 3}
+    assert result.indices[0][2] == -1 and not result.mask[0][2]
+
+
+def test_hybrid_scores_only_candidate_columns(monkeypatch):
+    rng = np.random.default_rng(4)
+    segments = rng.normal(size=(40, 8))
+    queries = rng.normal(size=(3, 8))
+    vocabulary = [f"word{i}" for i in range(100)]
+    texts = [" ".join(rng.choice(vocabulary, 8)) for _ in range(40)]
+    section = np.arange(0, 40, 4)
+    index, lexical = SegmentIndex(segments), BM25Index(texts)
+    rows = [
+        hybrid_search(index, lexical, queries[i:i + 1], texts[i:i + 1], top_k=3, threshold=0.0, candidates=[c])
+        for i, c in enumerate([section, None, section])
+    ]
+
+    ranked = []
+    ranks = retrieval._ranks
+    monkeypatch.setattr(retrieval, "_ranks", lambda scores, depth: ranked.append(scores.shape) or ranks(scores, depth))
+    result = hybrid_search(index, lexical, queries, texts[:3], top_k=3, threshold=0.0, candidates=[section, None, section])
+
+    # Queries sharing a candidate array are ranked together over just those columns
+    assert sorted(ranked) == [(1, 40), (1, 40), (2, 10), (2, 10)]
+    assert set(result.indices[[0, 2]].ravel().tolist()) <= set(section.tolist())
+    for i, row in enumerate(rows):
+        assert result.indices[i].tolist() == row.indices[0].tolist()
+        np.testing.assert_allclose(result.scores[i], row.scores[0], rtol=1e-5)
+
+
+def test_lexical_scoring_is_sub_millisecond_per_statement():
+    rng = np.random.default_rng(1)
+    vocabulary = [f"word{i}" for i in range(3000)]
+    texts = [" ".join(rng.choice(vocabulary, 25)) for _ in range(2000)]
+    queries = [" ".join(rng.choice(vocabulary, 15)) for _ in range(200)]
+    index = BM25Index(texts)
+
+    start = time.perf_counter()
+    index.score_many(queries)
+    assert (time.perf_counter() - start) / len(queries) < 1e-3
@@ -0,0 +1,66 @@
+"""
+Offline tests for the pre-forked server's shared health table and supervisor
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import os
+import socket
+import time
+
+import pytest
+
+from app import serve
+from app.serve import Supervisor, WorkerTable
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+
+def test_worker_rows_are_shared_across_fork():
+    table = WorkerTable(slots=2)
+    slot = table.claim(-1, generation=1)
+
+    pid = os.fork()
+    if pid == 0:
+        table.beat(slot, requests=7, in_flight=2)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    row = table.row(slot)
+    assert row["ready"] and row["requests"] == 7 and row["in_flight"] == 2
+    table.release(slot)
+    assert table.snapshot() == []
+
+
+def test_worker_health_is_none_outside_app_serve(monkeypatch):
+    assert serve.worker_health() is None
+
+    table = WorkerTable(slots=2)
+    slot = table.claim(os.getpid(), generation=3)
+    monkeypatch.setattr(serve, "_table", table)
+    monkeypatch.setattr(serve, "_slot", slot)
+
+    health = serve.worker_health()
+    assert health["this_worker"]["pid"] == os.getpid()
+    assert [row["generation"] for row in health["workers"]] == [3]
+
+
+def test_supervisor_replaces_exited_workers_of_the_current_generation(monkeypatch):
+    # Workers that exit at once instead of serving
+    monkeypatch.setattr(Supervisor, "_run_worker", lambda self, slot: os._exit(3))
+    with socket.socket() as sock:
+        supervisor = Supervisor(app=None, sock=sock, workers=2)
+        supervisor._start_generation()
+        first = set(supervisor.workers)
+
+        deadline = time.time() + 10
+        while first & set(supervisor.workers) and time.time() < deadline:
+            supervisor._reap()
+            time.sleep(0.05)
+
+        assert len(supervisor.workers) == 2
+        assert not first & set(supervisor.workers)
+        # Old generations are not replaced
+        supervisor.generation += 1
+        supervisor._stop_workers(list(supervisor.workers))
+        assert supervisor.workers == {} and supervisor.table.snapshot() == []
@@ -0,0 +1,57 @@
+"""
+Offline tests for the pipeline stage graph
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import asyncio
+
+import pytest
+
+from app.stages import StageGraph
+
+
+def test_independent_stages_overlap():
+    """Two independent 0.1s stages should finish in ~0.1s, not 0.2s"""
+    async def slow(value):
+        await asyncio.sleep(0.1)
+        return value
+
+    graph = StageGraph()
+    graph.add("a", lambda: slow(1))
+    graph.add("b", lambda: slow(2))
+    graph.add("c", lambda a, b: a + b, deps=("a", "b"))
+
+    results, timings = asyncio.run(graph.run())
+
+    assert results["c"] == 3
+    assert set(timings) == {"a", "b", "c", "total"}
+    assert timings["total"] < 190
+
+
+def test_unknown_dependency_rejected():
+    graph = StageGraph()
+    with pytest.raises(ValueError):
+        graph.add("b", lambda a: a, deps=("a",))
+
+
+def test_failure_cancels_remaining_stages():
+    cancelled = []
+
+    async def boom():
+        raise RuntimeError("upstream failed")
+
+    async def long_running():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    graph = StageGraph()
+    graph.add("boom", boom)
+    graph.add("long", long_running)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(graph.run())
+    assert cancelled == [True]
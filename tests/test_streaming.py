@@ -0,0 +1,84 @@
+"""
+Offline tests for incremental parsing of streamed SOAP notes
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import json
+import re
+
+from app.streaming import JSONStringStream, StreamingSOAPParser
+
+
+def _feed_in_pieces(parser, text, size):
+    sentences = []
+    for start in range(0, len(text), size):
+        sentences.extend(parser.feed(text[start:start + size]))
+    return sentences + parser.close()
+
+
+def test_sentences_match_batch_splitter_for_any_chunking():
+    note = {
+        "subjective": "Patient reports \"poor\" sleep.  She feels tired! Is it stress?",
+        "objective": "Calm affect.\nGood eye contact.",
+        "assessment": "",
+        "plan": "Follow up in 2 weeks — review sleep log."
+    }
+    text = json.dumps(note, indent=2)
+    expected = [
+        (section, sentence.strip())
+        for section, body in note.items()
+        for sentence in re.split(r'(?<=[.!?])\s+', body)
+        if sentence.strip()
+    ]
+
+    for size in (1, 3, 7, len(text)):
+        assert _feed_in_pieces(StreamingSOAPParser(), text, size) == expected
+
+
+def test_sentence_is_emitted_before_the_section_ends():
+    parser = StreamingSOAPParser()
+    assert parser.feed('{"subjective": "Slept badly. Feels') == [("subjective", "Slept badly.")]
+
+
+def test_sentence_objects_are_emitted_with_their_source_ids():
+    note = {
+        "subjective": [
+            {"text": "Patient reports poor sleep.", "source_ids": ["seg_001", "seg_002"]},
+            {"text": "Dr. Lee's plan helped.", "source_ids": []}
+        ],
+        "objective": [],
+        "assessment": "Stable.",
+        "plan": [{"source_ids": ["seg_009"], "text": "Sleep diary."}]
+    }
+    text = json.dumps(note)
+    expected = [
+        ("subjective", "Patient reports poor sleep.", ["seg_001", "seg_002"]),
+        ("subjective", "Dr. Lee's plan helped.", []),
+        ("assessment", "Stable.", []),
+        ("plan", "Sleep diary.", ["seg_009"]),
+    ]
+
+    for size in (1, 5, len(text)):
+        assert _feed_in_pieces(StreamingSOAPParser(source_ids=True), text, size) == expected
+
+
+def test_structured_sentences_are_kept_whole():
+    note = {"subjective": [{"text": "Saw Dr. Lee, e.g. weekly."}, {"text": "Sleeps 5 hrs."}], "plan": []}
+    text = json.dumps(note)
+
+    for size in (1, 4, len(text)):
+        assert _feed_in_pieces(StreamingSOAPParser(), text, size) == [
+            ("subjective", "Saw Dr. Lee, e.g. weekly."), ("subjective", "Sleeps 5 hrs.")
+        ]
+
+
+def test_json_string_stream_reports_paths_and_unicode_escapes():
+    stream = JSONStringStream()
+    events = stream.feed('{"plan": [{"text": "caf\\u00')
+    events += stream.feed('e9"}, {"text": "b"}]}')
+
+    text_by_path = {}
+    for event in events:
+        text_by_path[event.path] = text_by_path.get(event.path, "") + event.text
+    assert text_by_path == {("plan", 0, "text"): "café", ("plan", 1, "text"): "b"}
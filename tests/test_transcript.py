@@ -0,0 +1,73 @@
+"""
+Offline tests for the columnar transcript store
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from app.prompt_builder import PromptBuilder
+from app.transcript import TranscriptColumns
+from tests.benchmark import synthetic_transcript
+from tests.mock_openai import mock_processor
+
+
+def test_columns_round_trip_the_segments():
+    transcript = synthetic_transcript(12, seed=1)
+    columns = TranscriptColumns.from_input(transcript)
+
+    assert len(columns) == 12
+    assert columns.session_id == transcript.session_id
+    assert sorted(columns.speaker_names) == ["clinician", "patient"]
+    assert columns.texts() == [seg.text for seg in transcript.segments]
+    assert columns.to_segments() == transcript.segments
+    assert columns.position("seg_005") == 4 and columns.position("missing") is None
+    assert TranscriptColumns.from_input(columns) is columns
+
+
+def test_from_json_matches_the_pydantic_path():
+    transcript = synthetic_transcript(30, seed=2)
+
+    columns = TranscriptColumns.from_json(transcript.model_dump_json())
+
+    assert list(columns) == list(TranscriptColumns.from_input(transcript))
+    assert columns.patient_id == transcript.patient_id
+
+
+@pytest.mark.parametrize("segment, message", [
+    ({"id": "a", "speaker": "patient", "start_ms": 0, "text": "hi"}, "missing field 'end_ms'"),
+    ({"id": 1, "speaker": "patient", "start_ms": 0, "end_ms": 1, "text": "hi"}, "must be strings"),
+    ({"id": "a", "speaker": "patient", "start_ms": "0", "end_ms": 1, "text": "hi"}, "must be integers"),
+    ("not an object", "must be an object"),
+])
+def test_from_records_rejects_malformed_segments(segment, message):
+    with pytest.raises(ValueError, match=message):
+        TranscriptColumns.from_records([segment], "s", "p")
+
+
+def test_take_keeps_rows_in_the_given_order():
+    columns = TranscriptColumns.from_input(synthetic_transcript(10, seed=3))
+
+    subset = columns.take([7, 2])
+
+    assert subset.ids == ["seg_008", "seg_003"]
+    assert list(subset) == [columns[7], columns[2]]
+
+
+def test_prompt_format_and_chunking_read_the_columns():
+    processor = mock_processor()
+    processor.prompts = PromptBuilder("full")
+    transcript = synthetic_transcript(40, seed=4)
+    columns = TranscriptColumns.from_input(transcript)
+
+    expected = "\n".join(
+        f"[{processor._format_timestamp(s.start_ms)}] {s.speaker.upper()}: {s.text}" for s in transcript.segments
+    )
+    assert processor._format_transcript_for_llm(columns) == expected
+    assert processor._format_transcript_for_llm(columns, 5, 7) == "\n".join(expected.split("\n")[5:7])
+
+    processor.chunk_max_tokens = 200
+    chunks = processor._plan_chunks(columns)
+    assert chunks[0][0] == 0 and chunks[-1][1] == 40
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))